@@ -0,0 +1,98 @@
+"""
+Compares the aiopg and asyncpg backends appending events, reading streams
+and walking a keyspace, for both layouts, keeping the best of ``REPEAT``
+reads and walks. The connection is taken from the same variables as the
+tests:
+
+    $ DATABASE_USER=kant DATABASE_DATABASE=kant python benchmarks/backends.py
+"""
+import asyncio
+import time
+from os import environ
+
+from kant import events
+from kant.eventstore import (
+    AIOPG_BACKEND,
+    APPEND_ONLY_LAYOUT,
+    ASYNCPG_BACKEND,
+    DOCUMENT_LAYOUT,
+    EventStream,
+    connect,
+)
+
+STREAMS = 200
+EVENTS = 20
+REPEAT = 3
+KEYSPACE = "benchmark_backends"
+
+
+class DepositPerformed(events.Event):
+    amount = events.DecimalField()
+    performed_at = events.DateTimeField(auto_now=True)
+
+
+async def append(eventstore):
+    for stream in range(STREAMS):
+        await eventstore.append_to_stream(
+            str(stream),
+            EventStream(DepositPerformed(amount=10) for index in range(EVENTS)),
+        )
+
+
+async def read(eventstore):
+    for stream in range(STREAMS):
+        await eventstore.get_stream(str(stream))
+
+
+async def walk(eventstore):
+    async for stream in eventstore.all_streams():
+        pass
+
+
+async def best(operation, eventstore, repeat):
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        await operation(eventstore)
+        timings.append(time.perf_counter() - started_at)
+    return min(timings)
+
+
+async def measure(backend, layout):
+    connection = await connect(
+        user=environ.get("DATABASE_USER"),
+        password=environ.get("DATABASE_PASSWORD"),
+        database=environ.get("DATABASE_DATABASE"),
+        host=environ.get("DATABASE_HOST", "localhost"),
+        port=environ.get("DATABASE_PORT", 5432),
+        maxsize=1,
+        backend=backend,
+    )
+    await connection.create_keyspace(KEYSPACE, layout)
+    try:
+        async with connection.open(KEYSPACE) as eventstore:
+            timings = [
+                await best(append, eventstore, 1),
+                await best(read, eventstore, REPEAT),
+                await best(walk, eventstore, REPEAT),
+            ]
+    finally:
+        await connection.drop_keyspace(KEYSPACE)
+        await connection.close()
+    return timings
+
+
+async def main():
+    print("{:<8} {:<12} {:>10} {:>10} {:>10}".format("", "", "append", "read", "walk"))
+    for layout in (DOCUMENT_LAYOUT, APPEND_ONLY_LAYOUT):
+        for backend in (AIOPG_BACKEND, ASYNCPG_BACKEND):
+            timings = await measure(backend, layout)
+            print(
+                "{:<8} {:<12} {:>7.1f} ms {:>7.1f} ms {:>7.1f} ms".format(
+                    backend, layout, *[timing * 1e3 for timing in timings]
+                )
+            )
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main())
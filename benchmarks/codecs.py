@@ -0,0 +1,48 @@
+"""
+Measures the encoding and decoding of events, the innermost loop of every
+read and write of the event store.
+
+    $ python benchmarks/codecs.py
+"""
+import timeit
+from datetime import datetime
+
+from kant import events
+
+
+class AddressSchema(events.SchemaModel):
+    street = events.CharField()
+    number = events.IntegerField()
+
+
+class AccountOpened(events.Event):
+    id = events.CUIDField(primary_key=True)
+    owner = events.CharField(json_column="owner_name")
+    balance = events.DecimalField()
+    opened_at = events.DateTimeField()
+    active = events.BooleanField()
+    address = events.SchemaField(to=AddressSchema)
+
+
+SERIALIZED = {
+    "$type": "AccountOpened",
+    "$version": 0,
+    "id": "cjld2cjxh0000qzrmn831i7rn",
+    "owner_name": "John Doe",
+    "balance": 10.5,
+    "opened_at": datetime(2018, 5, 28, 16, 15).isoformat(),
+    "active": "true",
+    "address": {"street": "Main Street", "number": 42},
+}
+EVENT = events.Event.make(SERIALIZED)
+
+
+def bench(name, stmt, number=20000):
+    best = min(timeit.repeat(stmt, number=number, repeat=5))
+    print("{:<14} {:>8.2f} us/op".format(name, best / number * 1e6))
+
+
+if __name__ == "__main__":
+    bench("make", lambda: events.Event.make(SERIALIZED))
+    bench("decode", EVENT.decode)
+    bench("primary_keys", EVENT.primary_keys)
@@ -0,0 +1,46 @@
+"""
+Measures replaying a stream into an aggregate, which dispatches every
+event to its handler.
+
+    $ python benchmarks/dispatch.py
+"""
+import timeit
+
+from kant import aggregates, events
+from kant.eventstore import EventStream
+
+
+class DepositPerformed(events.Event):
+    amount = events.DecimalField()
+
+
+class WithdrawalPerformed(events.Event):
+    amount = events.DecimalField()
+
+
+class BankAccount(aggregates.Aggregate):
+    balance = aggregates.DecimalField()
+
+    def apply_deposit_performed(self, event):
+        self.balance += event.amount
+
+    def apply_withdrawal_performed(self, event):
+        self.balance -= event.amount
+
+
+STREAM = EventStream(
+    DepositPerformed(amount=10) if index % 2 else WithdrawalPerformed(amount=5)
+    for index in range(50000)
+)
+
+
+def replay():
+    account = BankAccount()
+    account.balance = 0
+    for event in STREAM:
+        account.dispatch(event, flush=False)
+
+
+if __name__ == "__main__":
+    best = min(timeit.repeat(replay, number=1, repeat=5))
+    print("replay of {} events {:>8.1f} ms".format(len(STREAM), best * 1e3))
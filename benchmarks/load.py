@@ -0,0 +1,42 @@
+"""
+Measures loading an aggregate from its stored stream, as Manager.get and
+refresh_from_db do, for growing history sizes.
+
+    $ python benchmarks/load.py
+"""
+import timeit
+import tracemalloc
+
+from kant import aggregates, events
+from kant.eventstore import EventStream
+
+
+class DepositPerformed(events.Event):
+    amount = events.DecimalField()
+    performed_at = events.DateTimeField(auto_now=True)
+
+
+class BankAccount(aggregates.Aggregate):
+    balance = aggregates.DecimalField()
+
+    def apply_deposit_performed(self, event):
+        self.balance = self.get("balance", 0) + event.amount
+
+
+def load(stream):
+    return BankAccount.from_stream(stream)
+
+
+if __name__ == "__main__":
+    for size in (1000, 10000, 50000):
+        stream = EventStream(DepositPerformed(amount=10) for index in range(size))
+        best = min(timeit.repeat(lambda: load(stream), number=1, repeat=3))
+        tracemalloc.start()
+        load(stream)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            "{:>6} events {:>8.1f} ms {:>8.1f} MiB peak".format(
+                size, best * 1e3, peak / 2 ** 20
+            )
+        )
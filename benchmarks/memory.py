@@ -0,0 +1,59 @@
+"""
+Compares the memory and attribute access time of events stored in a
+``_values`` dict with compact events stored in ``__slots__``.
+
+    $ python benchmarks/memory.py
+"""
+import timeit
+import tracemalloc
+
+from kant import events
+
+
+class DepositPerformed(events.Event):
+    id = events.CUIDField(primary_key=True)
+    owner = events.CharField()
+    amount = events.DecimalField()
+
+
+class CompactDepositPerformed(events.Event):
+    __compact__ = True
+
+    id = events.CUIDField(primary_key=True)
+    owner = events.CharField(intern=True)
+    amount = events.DecimalField()
+
+
+def serialized(event_type, index):
+    return {
+        "$type": event_type,
+        "$version": index,
+        "id": "cjld2cjxh0000qzrmn831i7rn",
+        "owner": "".join(["John", " Doe"]),
+        "amount": 10.5,
+    }
+
+
+def measure_memory(event_type, count=100000):
+    rows = [serialized(event_type, index) for index in range(count)]
+    tracemalloc.start()
+    decoded = [events.Event.make(row) for row in rows]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return decoded[0], size / count
+
+
+def measure_access(event, number=200000):
+    return min(
+        timeit.repeat(lambda: event.amount, number=number, repeat=5)
+    ) / number * 1e9
+
+
+if __name__ == "__main__":
+    for event_type in ("DepositPerformed", "CompactDepositPerformed"):
+        event, memory = measure_memory(event_type)
+        print(
+            "{:<24} {:>6.0f} bytes/event {:>6.1f} ns/access".format(
+                event_type, memory, measure_access(event)
+            )
+        )
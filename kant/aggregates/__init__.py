@@ -1 +1,4 @@
 from .base import *  # NOQA
+from .cache import *  # NOQA
+from .session import *  # NOQA
+from .snapshots import *  # NOQA
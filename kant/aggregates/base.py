@@ -1,20 +1,45 @@
-from copy import deepcopy
+from decimal import Decimal
+from time import perf_counter
 
 from async_generator import async_generator, yield_
-from inflection import underscore
 from kant.datamapper.base import FieldMapping, ModelMeta
 from kant.datamapper.fields import *  # NOQA
-from kant.eventstore import EventStream, get_connection
+from kant.events.handlers import HandlerTable
+from kant.eventstore import EventStream, Snapshot, get_connection
 
 from .exceptions import AggregateError
 
 
+def _exact_decode(model):
+    """
+    Decodes the model as :meth:`FieldMapping.decode`, keeping the decimals
+    as strings, also in the nested schemas, as floats would lose precision.
+    """
+    encoders = model._encoders
+    data = {}
+    for name, value in model._values.items():
+        field_name, encode = encoders[name]
+        if isinstance(value, Decimal):
+            data[field_name] = str(value)
+        elif isinstance(value, FieldMapping):
+            data[field_name] = _exact_decode(value)
+        else:
+            data[field_name] = value if encode is None else encode(value)
+    return data
+
+
 class Manager:
+    """
+    Loads and saves the aggregates of a keyspace. With a ``cache``, the
+    aggregates loaded and saved are kept, and loading one again checks its
+    stored version and applies only the events appended since.
+    """
 
-    def __init__(self, model, keyspace, using=None):
+    def __init__(self, model, keyspace, using=None, cache=None):
         self._model = model
         self.using = using
         self.keyspace = keyspace
+        self.cache = cache
 
     @property
     def _conn(self):
@@ -22,19 +47,111 @@ class Manager:
             return get_connection()
         return self.using
 
-    async def save(self, aggregate_id, events, notify_save):
-        async with self._conn.open(self.keyspace) as eventstore:
-            await eventstore.append_to_stream(aggregate_id, events, notify_save)
+    async def save(self, aggregate_id, events, notify_save, aggregate=None):
+        """
+        Appends the events. The saved ``aggregate`` is cached, if any.
+        """
+        try:
+            async with self._conn.open(self.keyspace) as eventstore:
+                await eventstore.append_to_stream(aggregate_id, events, notify_save)
+        except Exception:
+            self._forget(aggregate_id)
+            raise
+        if aggregate is not None:
+            self._remember(aggregate_id, aggregate)
+
+    async def save_many(self, aggregates):
+        eventstreams = {}
+        callbacks = {}
+        for aggregate in aggregates:
+            eventstreams[aggregate.get_pk()] = aggregate.get_events()
+            callbacks[aggregate.get_pk()] = aggregate.notify_save
+        try:
+            async with self._conn.open(self.keyspace) as eventstore:
+                await eventstore.append_to_streams(eventstreams, callbacks)
+        except Exception:
+            for aggregate_id in eventstreams:
+                self._forget(aggregate_id)
+            raise
+        for aggregate in aggregates:
+            self._remember(aggregate.get_pk(), aggregate)
 
     async def get(self, aggregate_id):
         async with self._conn.open(self.keyspace) as eventstore:
+            return await self._load(eventstore, aggregate_id)
+
+    async def _load(self, eventstore, aggregate_id):
+        aggregate = None
+        if self.cache is not None:
+            aggregate = await self._get_cached(eventstore, aggregate_id)
+        if aggregate is None:
+            aggregate = await self._get(eventstore, aggregate_id)
+            self._remember(aggregate_id, aggregate)
+        return aggregate
+
+    async def _get_cached(self, eventstore, aggregate_id):
+        """
+        Returns the cached aggregate, brought up to its stored version, or
+        ``None`` when it is not cached or was replaced.
+        """
+        entry = self.cache.get(str(aggregate_id))
+        if entry is None:
+            return None
+        stream, snapshot = entry
+        version = await eventstore.get_version(aggregate_id)
+        if version < stream.current_version:
+            self._forget(aggregate_id)
+            return None
+        if version > stream.current_version:
+            missing = await eventstore.get_stream(
+                aggregate_id, start=stream.current_version + 1
+            )
+            stream = stream.copy()
+            stream.extend(missing)
+            stream.initial_version = stream.current_version
+            self.cache.refreshes += 1
+        aggregate = self._model.from_stream(stream, snapshot)
+        if version > snapshot.version:
+            self._remember(aggregate_id, aggregate)
+        return aggregate
+
+    def _remember(self, aggregate_id, aggregate):
+        if self.cache is not None:
+            self.cache.put(
+                str(aggregate_id), aggregate.all_events().copy(), aggregate.snapshot()
+            )
+
+    def _forget(self, aggregate_id):
+        if self.cache is not None:
+            self.cache.discard(str(aggregate_id))
+
+    async def _get(self, eventstore, aggregate_id):
+        policy = self._model.__snapshot_policy__
+        if policy is None:
             stream = await eventstore.get_stream(aggregate_id)
             return self._model.from_stream(stream)
+        snapshot = await eventstore.get_snapshot(aggregate_id)
+        snapshot_version = -1 if snapshot is None else snapshot.version
+        stream = await eventstore.get_stream(
+            aggregate_id, start=snapshot_version + 1
+        )
+        started_at = perf_counter()
+        aggregate = self._model.from_stream(stream, snapshot)
+        replay_time = (perf_counter() - started_at) * 1000
+        replayed_events = aggregate.version - snapshot_version
+        if policy.should_snapshot(replayed_events, replay_time):
+            await eventstore.save_snapshot(aggregate_id, aggregate.snapshot())
+        return aggregate
+
+    async def save_snapshot(self, aggregate):
+        async with self._conn.open(self.keyspace) as eventstore:
+            await eventstore.save_snapshot(aggregate.get_pk(), aggregate.snapshot())
 
     @async_generator
-    async def all(self):
+    async def all(self, after_id=None, fetch_size=100):
         async with self._conn.open(self.keyspace) as eventstore:
-            async for stream in eventstore.all_streams():
+            streams = eventstore.all_streams(after_id=after_id, fetch_size=fetch_size)
+            async for stream in streams:
                 await yield_(self._model.from_stream(stream))
 
     async def get_stream(self, aggregate_id):
@@ -46,12 +163,16 @@ class AggregateMeta(ModelMeta):
 
     def __new__(mcs, class_name, bases, attrs):
         cls = ModelMeta.__new__(mcs, class_name, bases, attrs)
+        cls._handlers = HandlerTable(cls, "apply_")
         if "__keyspace__" in attrs.keys():
-            cls.objects = Manager(model=cls, keyspace=attrs["__keyspace__"])
+            cls.objects = Manager(
+                model=cls, keyspace=attrs["__keyspace__"], cache=attrs.get("__cache__")
+            )
         return cls
 
 
 class Aggregate(FieldMapping, metaclass=AggregateMeta):
+    __snapshot_policy__ = None
 
     def __init__(self):
         super().__init__()
@@ -74,22 +195,35 @@ class Aggregate(FieldMapping, metaclass=AggregateMeta):
         self._all_events.initial_version = new_version
         self._stored_events.initial_version = new_version
 
-    def fetch_events(self, events: EventStream):
-        self._stored_events = deepcopy(events)
-        self._all_events = deepcopy(self._stored_events)
+    def fetch_events(self, events: EventStream, snapshot: Snapshot = None):
+        self._stored_events = events.copy()
+        self._all_events = events.copy()
         self._events.initial_version = events.initial_version
+        snapshot_version = -1
+        if snapshot is not None and snapshot.version <= events.initial_version:
+            self.restore(snapshot)
+            snapshot_version = snapshot.version
         for event in events:
-            self.dispatch(event, flush=False)
+            if event.version > snapshot_version:
+                self.dispatch(event, flush=False)
+
+    def snapshot(self):
+        return Snapshot(version=self.version, data=_exact_decode(self))
+
+    def restore(self, snapshot: Snapshot):
+        json_columns = self._json_columns
+        self._values = {}
+        for name, value in snapshot.data.items():
+            self[json_columns[name]] = value
 
     def apply(self, event):
-        event_name = underscore(event.__class__.__name__)
-        method_name = "apply_{0}".format(event_name)
-        try:
-            method = getattr(self, method_name)
-            method(event)
-        except AggregateError:
-            msg = "The command for '{}' is not defined".format(event.__class__.__name__)
-            raise CommandError(msg)
+        handler = self._handlers.get(event.__class__)
+        if handler is None:
+            msg = "The handler for '{}' is not defined in '{}'".format(
+                event.__class__.__name__, self.__class__.__name__
+            )
+            raise AggregateError(msg)
+        handler(self, event)
 
     def dispatch(self, events, flush=True):
         if isinstance(events, list):
@@ -111,14 +245,14 @@ class Aggregate(FieldMapping, metaclass=AggregateMeta):
         return self._all_events.initial_version
 
     @classmethod
-    def from_stream(cls, stream):
+    def from_stream(cls, stream, snapshot=None):
         self = cls()
-        self.fetch_events(stream)
+        self.fetch_events(stream, snapshot)
         return self
 
     async def save(self):
         return await self.objects.save(
-            self.get_pk(), self.get_events(), self.notify_save
+            self.get_pk(), self.get_events(), self.notify_save, aggregate=self
         )
 
     async def refresh_from_db(self):
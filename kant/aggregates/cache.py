@@ -0,0 +1,96 @@
+import json
+from collections import OrderedDict
+from time import monotonic
+
+
+class AggregateCache:
+    """
+    Keeps the loaded aggregates of a manager as their stream and their
+    state, so loading an aggregate again only checks its stored version
+    and applies the events appended since. Entries expire ``ttl`` seconds
+    after they were stored and the least recently used are evicted above
+    ``max_entries``, or above ``max_bytes`` estimated from their JSON size.
+
+    >>> from kant.eventstore import EventStream, Snapshot
+    >>> cache = AggregateCache(max_entries=1)
+    >>> cache.put("1", EventStream(), Snapshot(version=-1, data={}))
+    >>> cache.put("2", EventStream(), Snapshot(version=-1, data={}))
+    >>> cache.get("1") is None, cache.get("2") is None
+    (True, False)
+    >>> cache.stats()["evictions"]
+    1
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=None, ttl=None, clock=monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns the ``(stream, snapshot)`` stored for the key, or ``None``.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        stream, snapshot, size, expires_at = entry
+        if expires_at is not None and self.clock() >= expires_at:
+            self.expirations += 1
+            self.misses += 1
+            self.discard(key)
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return stream, snapshot
+
+    def put(self, key, stream, snapshot):
+        self.discard(key)
+        size = 0
+        if self.max_bytes is not None:
+            size = self._estimate(stream, snapshot)
+            if size > self.max_bytes:
+                return
+        expires_at = None if self.ttl is None else self.clock() + self.ttl
+        self._entries[key] = (stream, snapshot, size, expires_at)
+        self.size += size
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None and self.size > self.max_bytes
+        ):
+            self.discard(next(iter(self._entries)))
+            self.evictions += 1
+
+    def discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _estimate(self, stream, snapshot):
+        data = json.dumps(snapshot.data, default=str)
+        return len(data) + sum(len(event.json()) for event in stream)
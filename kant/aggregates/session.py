@@ -0,0 +1,99 @@
+from collections import OrderedDict
+from functools import partial
+
+from async_generator import yield_
+from asyncio_extras.contextmanager import async_contextmanager
+from kant.eventstore import get_connection
+from kant.eventstore.backends.aiopg import transaction
+
+
+class Session:
+    """
+    A unit of work on one connection. The aggregates loaded or added are
+    kept in an identity map, so getting one again returns the same object
+    without a round trip. :meth:`commit` appends the new events of every
+    aggregate in one transaction, keyspace by keyspace in the order the
+    aggregates entered the session, and only then updates their versions
+    and notifies the projections.
+    """
+
+    def __init__(self, connection, cursor):
+        self.connection = connection
+        self.cursor = cursor
+        self._aggregates = OrderedDict()
+        self._eventstores = {}
+
+    def __contains__(self, aggregate):
+        key = (aggregate.objects.keyspace, str(aggregate.get_pk()))
+        return self._aggregates.get(key) is aggregate
+
+    async def _get_eventstore(self, keyspace):
+        if keyspace not in self._eventstores:
+            eventstore = await self.connection._get_eventstore(self.cursor, keyspace)
+            eventstore.deferred = []
+            self._eventstores[keyspace] = eventstore
+        return self._eventstores[keyspace]
+
+    async def get(self, model, aggregate_id):
+        key = (model.objects.keyspace, str(aggregate_id))
+        if key not in self._aggregates:
+            eventstore = await self._get_eventstore(model.objects.keyspace)
+            self._aggregates[key] = await model.objects._load(eventstore, aggregate_id)
+        return self._aggregates[key]
+
+    async def get_stream(self, model, aggregate_id):
+        eventstore = await self._get_eventstore(model.objects.keyspace)
+        return await eventstore.get_stream(aggregate_id)
+
+    def add(self, aggregate):
+        self._aggregates[(aggregate.objects.keyspace, str(aggregate.get_pk()))] = (
+            aggregate
+        )
+
+    async def commit(self):
+        batches = OrderedDict()
+        for aggregate in self._aggregates.values():
+            if len(aggregate.get_events()) > 0:
+                batches.setdefault(aggregate.objects, []).append(aggregate)
+        saved = []
+        try:
+            async with transaction(self.cursor):
+                for manager, aggregates in batches.items():
+                    eventstore = await self._get_eventstore(manager.keyspace)
+                    versions = {}
+                    await eventstore.append_to_streams(
+                        {
+                            aggregate.get_pk(): aggregate.get_events()
+                            for aggregate in aggregates
+                        },
+                        {
+                            aggregate.get_pk(): partial(
+                                versions.__setitem__, aggregate.get_pk()
+                            )
+                            for aggregate in aggregates
+                        },
+                    )
+                    saved.append((manager, eventstore, aggregates, versions))
+        except Exception:
+            for eventstore in self._eventstores.values():
+                eventstore.deferred = []
+            for manager, aggregates in batches.items():
+                for aggregate in aggregates:
+                    manager._forget(aggregate.get_pk())
+            raise
+        for manager, eventstore, aggregates, versions in saved:
+            await eventstore.flush_notifications()
+            for aggregate in aggregates:
+                aggregate.notify_save(versions[aggregate.get_pk()])
+                manager._remember(aggregate.get_pk(), aggregate)
+
+
+@async_contextmanager
+async def session(using=None):
+    """
+    Opens a :class:`Session` on one connection of ``using``, or of the
+    default connection. Nothing is written until it is committed.
+    """
+    connection = using or get_connection()
+    async with connection.cursor() as cursor:
+        await yield_(Session(connection, cursor))
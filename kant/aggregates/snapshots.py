@@ -0,0 +1,40 @@
+class SnapshotPolicy:
+    """
+    Decides whether an aggregate should be snapshotted after it was loaded
+    from the event store.
+    """
+
+    def should_snapshot(self, replayed_events, replay_time):
+        raise NotImplementedError()
+
+
+class EventCountPolicy(SnapshotPolicy):
+    """
+    >>> policy = EventCountPolicy(100)
+    >>> policy.should_snapshot(replayed_events=99, replay_time=0.5)
+    False
+    >>> policy.should_snapshot(replayed_events=100, replay_time=0.5)
+    True
+    """
+
+    def __init__(self, events):
+        self.events = events
+
+    def should_snapshot(self, replayed_events, replay_time):
+        return replayed_events >= self.events
+
+
+class ReplayTimePolicy(SnapshotPolicy):
+    """
+    >>> policy = ReplayTimePolicy(milliseconds=50)
+    >>> policy.should_snapshot(replayed_events=10, replay_time=49.0)
+    False
+    >>> policy.should_snapshot(replayed_events=10, replay_time=50.0)
+    True
+    """
+
+    def __init__(self, milliseconds):
+        self.milliseconds = milliseconds
+
+    def should_snapshot(self, replayed_events, replay_time):
+        return replayed_events > 0 and replay_time >= self.milliseconds
@@ -1,11 +1,70 @@
 import json
+import sys
 from abc import ABCMeta
 from collections import MutableMapping
-from typing import Dict
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from .exceptions import FieldError
 from .fields import Field
 
+SLOT_PREFIX = "_field_"
+
+
+def compile_codecs(cls):
+    """
+    Precomputes the lookups used to encode and decode instances of ``cls``,
+    so the (de)serialization loops do not walk ``concrete_fields``.
+    """
+    cls._json_columns = {}
+    cls._encoders = {}
+    cls._parsers = {}
+    cls._defaults = []
+    cls._primary_keys = []
+    for name, field in cls.concrete_fields.items():
+        json_column = sys.intern(field.json_column or name)
+        encode = field.encode
+        if type(field).encode is Field.encode:
+            encode = None
+        cls._json_columns[json_column] = name
+        cls._encoders[name] = (json_column, encode)
+        cls._parsers[name] = field.parse
+        if field.default is not None:
+            cls._defaults.append((name, field))
+        if field.primary_key:
+            cls._primary_keys.append((name, json_column, field.encode))
+
+
+class FieldDescriptor:
+    """
+    Gives attribute access to a field of a compact model, parsing the value
+    on assignment and storing it in the slot generated for the field.
+    """
+
+    __slots__ = ("name", "member", "parse")
+
+    def __init__(self, name, member, parse):
+        self.name = name
+        self.member = member
+        self.parse = parse
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            return self.member.__get__(instance, owner)
+        except AttributeError:
+            raise KeyError(self.name)
+
+    def __set__(self, instance, value):
+        if value is not None:
+            self.member.__set__(instance, self.parse(value))
+
+    def __delete__(self, instance):
+        try:
+            self.member.__delete__(instance)
+        except AttributeError:
+            raise KeyError(self.name)
+
 
 class ModelMeta(ABCMeta):
 
@@ -18,23 +77,58 @@ class ModelMeta(ABCMeta):
             else:
                 new_attrs[name] = value
 
+        compact = attrs.get(
+            "__compact__", any(getattr(base, "__compact__", False) for base in bases)
+        )
+        if compact:
+            bases, slotted = mcs.compact_bases(bases)
+            fields = {}
+            for base in reversed(bases):
+                fields.update(getattr(base, "concrete_fields", {}))
+            fields.update(concrete_fields)
+            new_attrs["__slots__"] = tuple(new_attrs.get("__slots__", ())) + tuple(
+                SLOT_PREFIX + name for name in fields if name not in slotted
+            )
+
         cls = type.__new__(mcs, class_name, bases, new_attrs)
         cls.concrete_fields = cls.concrete_fields.copy()
         cls.concrete_fields.update(concrete_fields)
+        compile_codecs(cls)
+        if compact:
+            cls._members = dict(slotted)
+            for name, field in cls.concrete_fields.items():
+                if name in slotted and name not in concrete_fields:
+                    continue
+                member = getattr(cls, SLOT_PREFIX + name)
+                cls._members[name] = member
+                setattr(cls, name, FieldDescriptor(name, member, field.parse))
         return cls
 
+    @staticmethod
+    def compact_bases(bases):
+        slotted = {}
+        for base in reversed(bases):
+            slotted.update(getattr(base, "_members", {}))
+        if not any(issubclass(base, CompactFieldMapping) for base in bases):
+            bases = (CompactFieldMapping,) + bases
+        return bases, slotted
+
 
 class FieldMapping(MutableMapping):
+    __slots__ = ()
+    __compact__ = False
     concrete_fields: Dict[str, Field] = {}
+    _json_columns: Dict[str, str] = {}
+    _encoders: Dict[str, Tuple[str, Optional[Callable]]] = {}
+    _parsers: Dict[str, Callable] = {}
+    _defaults: List[Tuple[str, Field]] = []
+    _primary_keys: List[Tuple[str, str, Callable]] = []
 
     def __init__(self, *args, **kwargs):
         self._values = {}
-        initial = {}
-        for name, value in self.concrete_fields.items():
-            if value.default is not None:
-                initial[name] = value.default_value()
-        initial.update(dict(*args, **kwargs))
         if args or kwargs:  # avoid creating dict for most common case
+            initial = {name: field.default_value() for name, field in self._defaults}
+            initial.update(*args, **kwargs)
             for name, value in initial.items():
                 self[name] = value
 
@@ -42,21 +136,24 @@ class FieldMapping(MutableMapping):
         return self._values[key]
 
     def __setitem__(self, key, value):
-        if key in self.concrete_fields:
-            try:
-                self._values[key] = self.concrete_fields[key].parse(value)
-            except TypeError as e:
-                msg = (
-                    "The value '{value}' is invalid. " "The field '{key}' {exception}"
-                ).format(
-                    value=repr(value), field=key, exception=str(e)
-                )
-                raise TypeError(msg)
-        else:
+        self._values[key] = self._parse_item(key, value)
+
+    def _parse_item(self, key, value):
+        parse = self._parsers.get(key)
+        if parse is None:
             msg = "{class_name} does not support field: {field}".format(
                 class_name=self.__class__.__name__, field=key
             )
             raise KeyError(msg)
+        try:
+            return parse(value)
+        except TypeError as e:
+            msg = (
+                "The value '{value}' is invalid. " "The field '{key}' {exception}"
+            ).format(
+                value=repr(value), field=key, exception=str(e)
+            )
+            raise TypeError(msg)
 
     def __delitem__(self, key):
         del self._values[key]
@@ -97,13 +194,20 @@ class FieldMapping(MutableMapping):
         return id(self)
 
     def serializeditems(self):
+        encoders = self._encoders
         for name, value in self._values.items():
-            field_name = self.concrete_fields[name].json_column or name
-            field_value = self.concrete_fields[name].encode(value)
-            yield (field_name, field_value)
+            field_name, encode = encoders[name]
+            if encode is not None:
+                value = encode(value)
+            yield (field_name, value)
 
     def decode(self):
-        return {key: value for key, value in self.serializeditems()}
+        encoders = self._encoders
+        data = {}
+        for name, value in self._values.items():
+            field_name, encode = encoders[name]
+            data[field_name] = value if encode is None else encode(value)
+        return data
 
     def json(self, only=None):
         data = self.decode()
@@ -112,11 +216,56 @@ class FieldMapping(MutableMapping):
         return json.dumps(data, sort_keys=True)
 
     def primary_keys(self):
-        primary_keys = {}
-        for name, value in self._values.items():
-            field = self.concrete_fields[name]
-            field_name = field.json_column or name
-            field_value = field.encode(value)
-            if field.primary_key:
-                primary_keys[field_name] = field_value
-        return primary_keys
+        values = self._values
+        return {
+            field_name: encode(values[name])
+            for name, field_name, encode in self._primary_keys
+            if name in values
+        }
+
+
+class CompactFieldMapping:
+    """
+    Stores the fields of a model declaring ``__compact__ = True`` in
+    generated ``__slots__`` instead of a ``_values`` dict and an instance
+    ``__dict__``. The MutableMapping API is kept.
+    """
+
+    __slots__ = ()
+    # the slot descriptors by field name
+    _members: Dict[str, Any] = {}
+
+    __setattr__ = object.__setattr__
+
+    def __init__(self, *args, **kwargs):
+        if args or kwargs:  # avoid creating dict for most common case
+            initial = {name: field.default_value() for name, field in self._defaults}
+            initial.update(*args, **kwargs)
+            for name, value in initial.items():
+                self[name] = value
+
+    @property
+    def _values(self):
+        values = {}
+        for name, member in self._members.items():
+            try:
+                values[name] = member.__get__(self)
+            except AttributeError:
+                pass
+        return values
+
+    def __getitem__(self, key):
+        try:
+            return self._members[key].__get__(self)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        value = self._parse_item(key, value)
+        self._members[key].__set__(self, value)
+
+    def __delitem__(self, key):
+        try:
+            self._members[key].__delete__(self)
+        except AttributeError:
+            raise KeyError(key)
@@ -1,3 +1,4 @@
+import sys
 from abc import ABCMeta
 from datetime import datetime
 from decimal import Decimal
@@ -81,12 +82,17 @@ class DateTimeField(Field):
         >>> field = DateTimeField()
         >>> field.parse('2009-05-28T16:15:00')
         datetime.datetime(2009, 5, 28, 16, 15)
+        >>> field.parse('May 28 2009 16:15')
+        datetime.datetime(2009, 5, 28, 16, 15)
         >>> create_at = datetime(2009, 5, 28, 16, 15)
         >>> field.parse(create_at)
         datetime.datetime(2009, 5, 28, 16, 15)
         """
         if isinstance(value, str):
-            return dateutil_parser.parse(value)
+            try:
+                return dateutil_parser.isoparse(value)
+            except ValueError:
+                return dateutil_parser.parse(value)
         if not isinstance(value, datetime):
             raise TypeError("expected string or datetime object")
         return value
@@ -94,6 +100,10 @@ class DateTimeField(Field):
 
 class CharField(Field):
 
+    def __init__(self, *args, intern=False, **kwargs):
+        self.intern = intern
+        super().__init__(*args, **kwargs)
+
     def encode(self, value):
         """
         >>> field = CharField()
@@ -107,7 +117,14 @@ class CharField(Field):
         >>> field = CharField()
         >>> field.parse(123)
         '123'
+        >>> field = CharField(intern=True)
+        >>> field.parse("".join(["Depo", "sit"])) is field.parse("Deposit")
+        True
+        >>> CharField("anonymous", intern=True).default
+        'anonymous'
         """
+        if self.intern:
+            return sys.intern(str(value))
         return str(value)
 
 
@@ -168,4 +185,4 @@ class SchemaField(Field):
         """
         if isinstance(value, self.to):
             return value
-        return self.to().make(value, cls=self.to)
+        return self.to.make(value, cls=self.to)
@@ -1 +1,2 @@
 from .base import *  # NOQA
+from .handlers import *  # NOQA
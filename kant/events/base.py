@@ -1,13 +1,64 @@
+import sys
 from abc import ABCMeta
 
 from kant.datamapper.base import FieldMapping, ModelMeta
 from kant.datamapper.fields import *  # NOQA
 from kant.datamapper.models import *  # NOQA
 
-from .exceptions import EventDoesNotExist, EventError
+from .exceptions import EventDoesNotExist, EventError, EventTypeCollision
 
 
-class Event(FieldMapping, metaclass=ModelMeta):
+class EventMeta(ModelMeta):
+    """
+    Registers every event class under its ``$type`` when it is defined, so
+    decoding is a dictionary lookup at any depth of inheritance.
+
+    The type is the class name, prefixed by an inherited ``__namespace__``,
+    unless ``__event_type__`` is given. ``__aliases__`` registers older
+    names of the same class. Registering a type of another class raises
+    :class:`EventTypeCollision`, while a class defined again, as when its
+    module is reloaded, replaces the former one.
+    """
+
+    def __new__(mcs, class_name, bases, attrs):
+        cls = ModelMeta.__new__(mcs, class_name, bases, attrs)
+        if not hasattr(cls, "_registry"):
+            cls._registry = {}
+            cls._class_names = {}
+            cls.__event_type__ = class_name
+            return cls
+        if "__event_type__" not in attrs:
+            namespace = getattr(cls, "__namespace__", None)
+            if namespace:
+                cls.__event_type__ = "{}.{}".format(namespace, class_name)
+            else:
+                cls.__event_type__ = class_name
+        cls.__event_type__ = sys.intern(cls.__event_type__)
+        event_types = [cls.__event_type__] + list(attrs.get("__aliases__", []))
+        qualified_name = _qualified_name(cls)
+        for event_type in event_types:
+            registered = cls._registry.get(event_type, cls)
+            if _qualified_name(registered) != qualified_name:
+                msg = "'{}' is already registered by {}, not by {}".format(
+                    event_type, _qualified_name(registered), qualified_name
+                )
+                raise EventTypeCollision(msg)
+        for event_type in event_types:
+            cls._registry[event_type] = cls
+        classes = cls._class_names.setdefault(class_name, [])
+        classes[:] = [
+            klass for klass in classes if _qualified_name(klass) != qualified_name
+        ]
+        classes.append(cls)
+        return cls
+
+
+def _qualified_name(cls):
+    return "{}.{}".format(cls.__module__, cls.__qualname__)
+
+
+class Event(FieldMapping, metaclass=EventMeta):
+    __slots__ = ()
     EVENT_JSON_COLUMN = "$type"
     version = IntegerField(default=0, json_column="$version")
     __empty_stream__ = False
@@ -18,23 +69,41 @@ class Event(FieldMapping, metaclass=ModelMeta):
         if self.EVENT_JSON_COLUMN not in obj:
             msg = "'{}' is not defined in {}".format(self.EVENT_JSON_COLUMN, obj)
             raise EventError(msg)
-        event_name = obj[self.EVENT_JSON_COLUMN]
-        events = [
-            Event for Event in self.__subclasses__() if Event.__name__ == event_name
-        ]
-        try:
-            Event = events[0]
-        except IndexError:
-            raise EventDoesNotExist()
-        del obj[self.EVENT_JSON_COLUMN]
-        json_columns = {}
-        for name, field in Event.concrete_fields.items():
-            json_column = field.json_column or name
-            json_columns[json_column] = name
-        args = {json_columns[name]: value for name, value in obj.items()}
-        return Event(**args)
+        event_type = obj[self.EVENT_JSON_COLUMN]
+        Event = self._registry.get(event_type)
+        if Event is None or not issubclass(Event, self):
+            raise EventDoesNotExist(event_type)
+        json_columns = Event._json_columns
+        args = {
+            json_columns[name]: value
+            for name, value in obj.items()
+            if name != self.EVENT_JSON_COLUMN
+        }
+        return Event(args)
+
+    @classmethod
+    def get_dependencies(cls):
+        """
+        Returns the types of the events named in ``__dependencies__``, which
+        are class names, as the types are namespaced. A name is resolved to
+        the class of the same module first, then to a registered type or
+        alias, then to any class of that name.
+        """
+        return [cls._resolve_dependency(name) for name in cls.__dependencies__]
+
+    @classmethod
+    def _resolve_dependency(cls, name):
+        classes = cls._class_names.get(name, [])
+        for klass in classes:
+            if klass.__module__ == cls.__module__:
+                return klass.__event_type__
+        if name in cls._registry:
+            return cls._registry[name].__event_type__
+        if classes:
+            return classes[0].__event_type__
+        return name
 
     def decode(self):
-        event = {key: value for key, value in self.serializeditems()}
-        event.update({self.EVENT_JSON_COLUMN: self.__class__.__name__})
+        event = super().decode()
+        event[self.EVENT_JSON_COLUMN] = self.__event_type__
         return event
@@ -4,3 +4,7 @@ class EventDoesNotExist(Exception):
 
 class EventError(Exception):
     pass
+
+
+class EventTypeCollision(EventError):
+    pass
@@ -0,0 +1,50 @@
+from inflection import underscore
+
+
+def handles(*event_types):
+    """
+    Registers the decorated method as the handler of the given event
+    classes or ``$type`` names, instead of the naming convention.
+    """
+
+    def decorator(method):
+        method.__handles__ = getattr(method, "__handles__", ()) + event_types
+        return method
+
+    return decorator
+
+
+class HandlerTable:
+    """
+    Maps the event classes to the handlers of a model class.
+
+    Handlers registered with :func:`handles` are collected when the class is
+    created. The others are found by the ``prefix`` naming convention the
+    first time an event class is dispatched. Both are cached by event class,
+    so dispatching is a dictionary lookup.
+    """
+
+    def __init__(self, cls, prefix):
+        self.cls = cls
+        self.prefix = prefix
+        self.registered = {}
+        for klass in reversed(cls.__mro__):
+            for name, method in vars(klass).items():
+                for event_type in getattr(method, "__handles__", ()):
+                    self.registered[event_type] = name
+        self._handlers = {}
+
+    def get(self, event_class):
+        try:
+            return self._handlers[event_class]
+        except KeyError:
+            handler = self._handlers[event_class] = self._resolve(event_class)
+            return handler
+
+    def _resolve(self, event_class):
+        for klass in event_class.__mro__:
+            for event_type in (klass, vars(klass).get("__event_type__")):
+                if event_type in self.registered:
+                    return getattr(self.cls, self.registered[event_type])
+        method_name = "{0}{1}".format(self.prefix, underscore(event_class.__name__))
+        return getattr(self.cls, method_name, None)
@@ -1,2 +1,6 @@
+from .layouts import *  # NOQA
+from .recorded import *  # NOQA
+from .serializers import *  # NOQA
+from .snapshot import *  # NOQA
 from .stream import *  # NOQA
 from .connection import *  # NOQA
@@ -0,0 +1,4 @@
+AIOPG_BACKEND = "aiopg"
+ASYNCPG_BACKEND = "asyncpg"
+
+BACKENDS = (AIOPG_BACKEND, ASYNCPG_BACKEND)
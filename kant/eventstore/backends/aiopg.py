@@ -1,162 +1,1711 @@
-from collections import namedtuple
+import asyncio
+import hashlib
+import json
+import re
+from collections import Counter, OrderedDict, namedtuple
+from functools import lru_cache
+from typing import Any, Tuple, Type
+from weakref import WeakKeyDictionary
 
 import aiopg
+import psycopg2
 from async_generator import async_generator, yield_
 from asyncio_extras.contextmanager import async_contextmanager
+from kant.events import Event
 from kant.projections import ProjectionManager
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 
-from ..exceptions import StreamDoesNotExist, VersionError
+from ..exceptions import (
+    DependencyDoesNotExist,
+    IntegrityError,
+    LayoutError,
+    SerializerError,
+    StreamDoesNotExist,
+    StreamExists,
+    VersionConflict,
+    VersionError,
+)
+from ..layouts import APPEND_ONLY_LAYOUT, DOCUMENT_LAYOUT
+from ..recorded import RecordedEvent
+from ..serializers import JSON_SERIALIZER, JSONSerializer, get_serializer
+from ..snapshot import Snapshot
 from ..stream import EventStream
 
+KEYSPACES_TABLE = "kant_keyspaces"
+OUTBOX_TABLE = "kant_outbox"
+CHECKPOINTS_TABLE = "kant_outbox_checkpoints"
+# the errors of the statements of a layout on a keyspace migrated or dropped
+# by another connection: undefined table and undefined column
+LAYOUT_ERRORS = ("42P01", "42703")
+PARAMETER = re.compile(r"%\((\w+)\)s(::\w+(?:\[\])?)?")
+
+# the statements prepared on each connection, shared by the event store
+# connections using it, so the names agree with the server
+PREPARED: "WeakKeyDictionary[Any, OrderedDict[str, bool]]" = WeakKeyDictionary()
+
+Statement = namedtuple(
+    "Statement", ["name", "query", "text", "parameters", "prepare", "execute"]
+)
+
+
+@async_contextmanager
+async def transaction(cursor):
+    """
+    Runs the block in a transaction. A transaction already open on the
+    connection is joined instead, and commits or rolls back as a whole.
+    """
+    if in_transaction(cursor):
+        await yield_(cursor)
+        return
+    await cursor.execute("BEGIN")
+    try:
+        await yield_(cursor)
+    except BaseException:
+        await cursor.execute("ROLLBACK")
+        raise
+    else:
+        await cursor.execute("COMMIT")
+
+
+def in_transaction(cursor):
+    # the cursors of the other backends tell it themselves
+    if hasattr(cursor, "in_transaction"):
+        return cursor.in_transaction
+    status = cursor.raw.connection.get_transaction_status()
+    return status != TRANSACTION_STATUS_IDLE
+
+
+def version_conditions(version, start=None, end=None, backward=False):
+    """
+    >>> version_conditions("version", start=5, end=10)
+    ['version >= %(start)s', 'version < %(end)s']
+    >>> version_conditions("version", start=10, end=5, backward=True)
+    ['version <= %(start)s', 'version > %(end)s']
+    """
+    conditions = []
+    if start is not None:
+        conditions.append(version + (" <= " if backward else " >= ") + "%(start)s")
+    if end is not None:
+        conditions.append(version + (" > " if backward else " < ") + "%(end)s")
+    return conditions
+
+
+def stream_conditions(stream_id, after_id=None, partition=None):
+    """
+    >>> stream_conditions("id", after_id="10", partition=(1, 4))
+    ['id > %(after_id)s', 'mod(hashtext(id) + 2147483648, %(partitions)s) = %(partition)s']
+    """
+    conditions = []
+    if after_id is not None:
+        conditions.append(stream_id + " > %(after_id)s")
+    if partition is not None:
+        conditions.append(
+            "mod(hashtext({}) + 2147483648, %(partitions)s) = %(partition)s".format(
+                stream_id
+            )
+        )
+    return conditions
+
+
+def identifier(name):
+    """
+    Quotes a name as an SQL identifier, folded to lower case as Postgres
+    folds the unquoted names of the tables created by the keyspaces.
+
+    >>> identifier("Event_Store")
+    '"event_store"'
+    >>> identifier('my"keyspace')
+    '"my""keyspace"'
+    """
+    return '"{}"'.format(name.lower().replace('"', '""'))
+
+
+@lru_cache(maxsize=1024)
+def build_statement(query, salt=""):
+    """
+    Compiles a query with ``%(name)s`` parameters to its ``text`` with
+    ``$n`` parameters, taken from the ``parameters`` in order, and to the
+    PREPARE and the EXECUTE of a server-side prepared statement. The name is
+    a digest of the query and ``salt``, so it is the same on every
+    connection, and the casts of the parameters are repeated on the values
+    executed.
+
+    >>> stmt = build_statement("SELECT a FROM t WHERE b = %(b)s AND c > %(c)s::bigint")
+    >>> stmt.text, stmt.parameters
+    ('SELECT a FROM t WHERE b = $1 AND c > $2::bigint', ('b', 'c'))
+    >>> stmt.prepare  # doctest: +ELLIPSIS
+    'PREPARE kant_... AS SELECT a FROM t WHERE b = $1 AND c > $2::bigint'
+    >>> stmt.execute  # doctest: +ELLIPSIS
+    'EXECUTE kant_...(%(b)s, %(c)s::bigint)'
+    """
+    names = OrderedDict()
+
+    def parameter(match):
+        name, cast = match.group(1), match.group(2) or ""
+        names.setdefault(name, cast)
+        return "${}{}".format(list(names).index(name) + 1, cast)
+
+    text = PARAMETER.sub(parameter, query).replace("%%", "%")
+    digest = hashlib.md5((salt + query).encode("utf-8")).hexdigest()
+    name = "kant_{}".format(digest[:16])
+    execute = "EXECUTE {}".format(name)
+    if names:
+        execute += "({})".format(
+            ", ".join("%({})s{}".format(key, cast) for key, cast in names.items())
+        )
+    return Statement(
+        name,
+        query,
+        text,
+        tuple(names),
+        "PREPARE {} AS {}".format(name, text.strip()),
+        execute,
+    )
+
+
+@lru_cache(maxsize=1024)
+def keyspace_statement(template, keyspace, column_type, fragments=()):
+    """
+    Builds a statement of a keyspace once. The template is formatted with
+    the quoted ``keyspace`` and ``snapshot`` tables, the ``column_type`` and
+    the SQL ``fragments``.
+    """
+    query = template.format(
+        keyspace=identifier(keyspace),
+        snapshot=identifier("{}_snapshot".format(keyspace)),
+        column_type=column_type,
+        **dict(fragments)
+    )
+    # the types returned by a prepared statement cannot change, so the
+    # statements of keyspaces with another column type have other names
+    return build_statement(query, salt=column_type)
+
+
+class PreparedStatements:
+    """
+    Prepares the statements of the event stores on a connection the first
+    time they run there and then executes them by name, so Postgres parses
+    and plans them once per connection. Up to ``max_statements`` are kept
+    prepared on each connection and the least recently used are
+    deallocated. The statements are SQL ``PREPARE`` and ``EXECUTE``, which
+    work through a connection pooler only in session mode.
+    """
+
+    def __init__(self, max_statements=256):
+        self.max_statements = max_statements
+        self.prepares = 0
+        self.executes = 0
+        self.deallocates = 0
+
+    async def execute(self, cursor, statement, params, then=None):
+        prepared = PREPARED.setdefault(cursor.connection, OrderedDict())
+        if statement.name in prepared:
+            prepared.move_to_end(statement.name)
+        else:
+            stmt_prepare = statement.prepare
+            while prepared and len(prepared) >= self.max_statements:
+                name, _ = prepared.popitem(last=False)
+                stmt_prepare = "DEALLOCATE {};\n{}".format(name, stmt_prepare)
+                self.deallocates += 1
+            await cursor.execute(stmt_prepare)
+            prepared[statement.name] = True
+            self.prepares += 1
+        stmt_execute = statement.execute
+        if then is not None:
+            stmt_execute = "{};\n{}".format(stmt_execute, then)
+        await cursor.execute(stmt_execute, params)
+        self.executes += 1
+
+    def stats(self):
+        return {
+            "prepares": self.prepares,
+            "executes": self.executes,
+            "deallocates": self.deallocates,
+            "statements": build_statement.cache_info().currsize,
+        }
+
 
 class EventStoreConnection:
 
     def __init__(self):
         self.projections = ProjectionManager()
+        self._keyspaces = {}
 
     @classmethod
     async def create(cls, settings):
-        self = EventStoreConnection()
+        self = cls()
         self.settings = settings
+        self.acquire_timeout = settings.get("acquire_timeout")
+        self.serializer = settings.get("serializer", JSON_SERIALIZER)
+        self.outbox = settings.get("outbox", False)
+        self.statements = None
+        statement_cache_size = settings.get("statement_cache_size", 256)
+        if statement_cache_size:
+            self.statements = PreparedStatements(statement_cache_size)
         self.pool = settings.get("pool")
         if self.pool is None:
-            self.pool = await aiopg.connect(
+            self.pool = await aiopg.create_pool(
+                dsn=settings.get("dsn"),
+                minsize=settings.get("minsize", 1),
+                maxsize=settings.get("maxsize", 10),
+                pool_recycle=settings.get("pool_recycle", -1),
                 user=settings.get("user"),
                 password=settings.get("password"),
                 database=settings.get("database"),
                 host=settings.get("host"),
+                port=settings.get("port"),
             )
         return self
 
     async def close(self):
-        await self.pool.close()
+        await self.projections.join()
+        if isinstance(self.pool, aiopg.Pool):
+            self.pool.close()
+            await self.pool.wait_closed()
+        else:
+            await self.pool.close()
 
-    async def create_keyspace(self, keyspace):
-        stmt = """
-        CREATE TABLE IF NOT EXISTS {keyspace} (
-            id varchar(255),
-            data jsonb NOT NULL,
-            created_at timestamp NOT NULL,
-            updated_at timestamp NOT NULL,
-            version bigserial NOT NULL
+    @async_contextmanager
+    async def acquire(self):
+        """
+        Acquires a connection from the pool for one unit of work. A single
+        connection given as ``pool`` is shared by every unit of work.
+        """
+        if not isinstance(self.pool, aiopg.Pool):
+            await yield_(self.pool)
+            return
+        connection = await asyncio.wait_for(
+            self.pool.acquire(), timeout=self.acquire_timeout
         )
+        try:
+            await yield_(connection)
+        finally:
+            await self.pool.release(connection)
+
+    @async_contextmanager
+    async def cursor(self):
+        async with self.acquire() as connection:
+            async with connection.cursor() as cursor:
+                try:
+                    await yield_(cursor)
+                except Exception as e:
+                    self._forget_layouts(e)
+                    raise
+
+    def _forget_layouts(self, error):
+        """
+        Forgets the layouts read when a statement fails as its keyspace was
+        migrated or dropped by another connection, so they are read again.
+        """
+        if getattr(error, "pgcode", None) in LAYOUT_ERRORS:
+            self._keyspaces.clear()
+
+    async def create_keyspace(
+        self, keyspace, layout=DOCUMENT_LAYOUT, serializer=None, partitions=None
+    ):
+        """
+        Creates the tables of a keyspace and records its layout and
+        serializer, so every connection decodes it the same way. The
+        serializer defaults to the one of the connection.
+
+        With ``partitions``, the keyspace is hash partitioned by stream id
+        in that many tables, named ``<keyspace>_p<remainder>``.
+        """
+        serializer = serializer or self.serializer
+        if layout not in EVENTSTORES:
+            raise LayoutError("The layout '{}' is not supported".format(layout))
+        EventStore = EVENTSTORES[layout]
+        column_type = get_serializer(serializer).column_type
+        if column_type not in EVENTSTORES[layout].column_types:
+            msg = "The layout '{}' cannot store the serializer '{}'".format(
+                layout, serializer
+            )
+            raise SerializerError(msg)
+        stmt_keyspaces = """
+        CREATE TABLE IF NOT EXISTS {keyspaces} (
+            keyspace varchar(255) PRIMARY KEY,
+            layout varchar(32) NOT NULL,
+            created_at timestamp NOT NULL
+        );
+        ALTER TABLE {keyspaces}
+        ADD COLUMN IF NOT EXISTS serializer varchar(32) NOT NULL DEFAULT 'json';
         """.format(
-            keyspace=keyspace
+            keyspaces=KEYSPACES_TABLE
         )
-        async with self.pool.cursor() as cursor:
+        stmt_register = """
+        INSERT INTO {keyspaces} (keyspace, layout, serializer, created_at)
+        VALUES (%(keyspace)s, %(layout)s, %(serializer)s, NOW())
+        ON CONFLICT (keyspace) DO NOTHING
+        """.format(
+            keyspaces=KEYSPACES_TABLE
+        )
+        async with self.cursor() as cursor:
+            await cursor.execute(stmt_keyspaces)
+            # the keyspaces of older versions are changed by upgrade_keyspace
+            if not await self._has_table(cursor, identifier(keyspace)):
+                await cursor.execute(
+                    EventStore.table_schema(
+                        keyspace,
+                        column_type,
+                        partition_by=""
+                        if partitions is None
+                        else "PARTITION BY HASH ({})".format(EventStore.primary_key[0]),
+                    )
+                )
+            for remainder in range(partitions or 0):
+                await cursor.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS {partition}
+                    PARTITION OF {keyspace}
+                    FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})
+                    """.format(
+                        partition=identifier("{}_p{}".format(keyspace, remainder)),
+                        keyspace=identifier(keyspace),
+                        partitions=partitions,
+                        remainder=remainder,
+                    )
+                )
+            await cursor.execute(
+                EventStore.snapshot_schema.format(
+                    snapshot=identifier("{}_snapshot".format(keyspace))
+                )
+            )
+            await cursor.execute(
+                stmt_register,
+                {"keyspace": keyspace, "layout": layout, "serializer": serializer},
+            )
+        if self.outbox:
+            await self.create_outbox()
+        self._keyspaces.pop(keyspace, None)
+
+    async def create_outbox(self):
+        """
+        Creates the outbox, where the appends record the streams to project
+        in the same transaction, and the checkpoints of its workers.
+        """
+        stmt = """
+        CREATE TABLE IF NOT EXISTS {outbox} (
+            position bigserial PRIMARY KEY,
+            keyspace varchar(255) NOT NULL,
+            stream_id varchar(255) NOT NULL,
+            initial_version bigint NOT NULL,
+            current_version bigint NOT NULL,
+            created_at timestamp NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS {checkpoints} (
+            worker varchar(255) PRIMARY KEY,
+            position bigint NOT NULL,
+            processed bigint NOT NULL,
+            updated_at timestamp NOT NULL
+        );
+        """.format(
+            outbox=OUTBOX_TABLE, checkpoints=CHECKPOINTS_TABLE
+        )
+        async with self.cursor() as cursor:
             await cursor.execute(stmt)
 
     async def drop_keyspace(self, keyspace):
         stmt = """
-        DROP TABLE {keyspace}
+        DROP TABLE {keyspace};
+        DROP TABLE IF EXISTS {snapshot};
+        """.format(
+            keyspace=identifier(keyspace),
+            snapshot=identifier("{}_snapshot".format(keyspace)),
+        )
+        stmt_unregister = """
+        DELETE FROM {keyspaces} WHERE keyspace = %(keyspace)s
+        """.format(
+            keyspaces=KEYSPACES_TABLE
+        )
+        async with self.cursor() as cursor:
+            await cursor.execute(stmt)
+            if await self._has_keyspaces_table(cursor):
+                await cursor.execute(stmt_unregister, {"keyspace": keyspace})
+        self._keyspaces.pop(keyspace, None)
+
+    async def migrate_keyspace(self, keyspace, layout=APPEND_ONLY_LAYOUT):
+        """
+        Rewrites a document keyspace as an append-only keyspace.
+
+        The events are copied on the server, inside one transaction, so the
+        keyspace is never seen half migrated.
+        """
+        if layout != APPEND_ONLY_LAYOUT:
+            raise LayoutError("The layout '{}' is not supported".format(layout))
+        migration = "{}_migration".format(keyspace)
+        stmt_copy = """
+        INSERT INTO {migration} (stream_id, version, data, created_at)
+        SELECT {keyspace}.id,
+               COALESCE(CAST(event.data->>'$version' AS bigint), event.position - 1),
+               event.data,
+               {keyspace}.created_at
+        FROM {keyspace},
+             jsonb_array_elements({keyspace}.data) WITH ORDINALITY AS event(data, position)
+        ORDER BY {keyspace}.created_at, {keyspace}.id, event.position
+        """.format(
+            keyspace=identifier(keyspace), migration=identifier(migration)
+        )
+        stmt_swap = """
+        DROP TABLE {keyspace};
+        ALTER TABLE {migration} RENAME TO {keyspace};
+        ALTER INDEX {migration_pkey} RENAME TO {pkey};
+        ALTER INDEX {migration_position_idx} RENAME TO {position_idx};
+        """.format(
+            keyspace=identifier(keyspace),
+            migration=identifier(migration),
+            migration_pkey=identifier("{}_pkey".format(migration)),
+            pkey=identifier("{}_pkey".format(keyspace)),
+            migration_position_idx=identifier("{}_position_idx".format(migration)),
+            position_idx=identifier("{}_position_idx".format(keyspace)),
+        )
+        stmt_register = """
+        UPDATE {keyspaces} SET layout = %(layout)s WHERE keyspace = %(keyspace)s
+        """.format(
+            keyspaces=KEYSPACES_TABLE
+        )
+        async with self.cursor() as cursor:
+            # another connection may have migrated it
+            self._keyspaces.pop(keyspace, None)
+            current_layout, serializer = await self._get_keyspace(cursor, keyspace)
+            if current_layout == layout:
+                return
+            async with transaction(cursor):
+                await cursor.execute(
+                    AppendOnlyEventStore.table_schema(migration, "jsonb")
+                )
+                await cursor.execute(stmt_copy)
+                await cursor.execute(stmt_swap)
+                await cursor.execute(
+                    stmt_register, {"keyspace": keyspace, "layout": layout}
+                )
+        self._keyspaces[keyspace] = (layout, serializer)
+
+    async def upgrade_keyspace(self, keyspace, batch_size=10000):
+        """
+        Adds the primary key, the global positions and the indexes of the
+        current schema to a keyspace created by an older version. The
+        indexes are built ``CONCURRENTLY``, so the keyspace is read and
+        written meanwhile, and then promoted to constraints, which only
+        locks it briefly. The positions of the stored events are set
+        ``batch_size`` at a time. An interrupted upgrade can be run again.
+
+        Raises :class:`IntegrityError` when the primary key is stored more
+        than once, before building its index.
+        """
+        async with self.cursor() as cursor:
+            self._keyspaces.pop(keyspace, None)
+            layout, _ = await self._get_keyspace(cursor, keyspace)
+            EventStore = EVENTSTORES[layout]
+            stmt_primary_key = """
+            SELECT 1 FROM pg_constraint
+            WHERE conrelid = %(table)s::regclass AND contype = 'p'
+            """
+            await cursor.execute(stmt_primary_key, {"table": identifier(keyspace)})
+            if await cursor.fetchone() is None:
+                await self._check_unique(cursor, keyspace, EventStore.primary_key)
+                index = "{}_pkey".format(keyspace)
+                await self._create_index(
+                    cursor, keyspace, index, EventStore.primary_key, unique=True
+                )
+                for column in EventStore.primary_key:
+                    await self._set_not_null(cursor, keyspace, column)
+                await cursor.execute(
+                    "ALTER TABLE {table} ADD CONSTRAINT {index} "
+                    "PRIMARY KEY USING INDEX {index}".format(
+                        table=identifier(keyspace), index=identifier(index)
+                    )
+                )
+            if EventStore.position_order:
+                await self._add_position(
+                    cursor,
+                    keyspace,
+                    EventStore.primary_key,
+                    EventStore.position_order,
+                    batch_size,
+                )
+            for name, columns in EventStore.indexes:
+                await self._create_index(
+                    cursor, keyspace, "{}_{}".format(keyspace, name), columns
+                )
+            for name in EventStore.replaced_constraints:
+                await cursor.execute(
+                    "ALTER TABLE {} DROP CONSTRAINT IF EXISTS {}".format(
+                        identifier(keyspace),
+                        identifier("{}_{}".format(keyspace, name)),
+                    )
+                )
+
+    async def _check_unique(self, cursor, table, columns, limit=10):
+        """
+        Raises :class:`IntegrityError` with the first ``limit`` values of
+        ``columns`` stored twice, which must be fixed before the unique index
+        is built, as the build would fail and leave an invalid index.
+        """
+        stmt = """
+        SELECT {columns} FROM {table}
+        GROUP BY {columns}
+        HAVING count(*) > 1
+        ORDER BY {columns}
+        LIMIT {limit}
+        """.format(
+            table=identifier(table), columns=", ".join(columns), limit=int(limit)
+        )
+        await cursor.execute(stmt)
+        duplicates = [tuple(row) for row in await cursor.fetchall()]
+        if duplicates:
+            msg = "The keyspace '{}' stores {} more than once: {}".format(
+                table, ", ".join(columns), duplicates
+            )
+            raise IntegrityError(msg)
+
+    async def _add_position(self, cursor, table, key, order, batch_size):
+        """
+        Adds the global positions without rewriting the table: the column is
+        added nullable and the stored events are numbered in ``order``, in
+        batches found by an index of the events not numbered yet. The
+        default is set once they are numbered, so the events appended
+        meanwhile are numbered after them.
+        """
+        stmt_column = """
+        SELECT attnotnull FROM pg_attribute
+        WHERE attrelid = %(table)s::regclass AND attname = 'position'
+        AND NOT attisdropped
+        """
+        await cursor.execute(stmt_column, {"table": identifier(table)})
+        row = await cursor.fetchone()
+        if row is not None and row[0]:
+            return
+        index = "{}_position_backfill_idx".format(table)
+        sequence = identifier("{}_position_seq".format(table))
+        next_position = "nextval('{}'::regclass)".format(sequence.replace("'", "''"))
+        stmt_backfill = """
+        WITH numbered AS (
+            UPDATE {table} SET position = batch.position
+            FROM (
+                SELECT {key}, {next_position} AS position
+                FROM {table}
+                WHERE position IS NULL
+                ORDER BY {order}
+                LIMIT {batch_size}
+            ) AS batch
+            WHERE {join}
+            RETURNING 1
+        )
+        SELECT count(*) FROM numbered
         """.format(
-            keyspace=keyspace
+            table=identifier(table),
+            key=", ".join(key),
+            next_position=next_position,
+            order=", ".join(order),
+            batch_size=int(batch_size),
+            join=" AND ".join(
+                "{table}.{column} = batch.{column}".format(
+                    table=identifier(table), column=column
+                )
+                for column in key
+            ),
         )
-        async with self.pool.cursor() as cursor:
+        await cursor.execute(
+            """
+            CREATE SEQUENCE IF NOT EXISTS {sequence};
+            ALTER TABLE {table} ADD COLUMN IF NOT EXISTS position bigint;
+            ALTER SEQUENCE {sequence} OWNED BY {table}.position;
+            """.format(
+                table=identifier(table), sequence=sequence
+            )
+        )
+        await self._create_index(cursor, table, index, order, where="position IS NULL")
+        await self._backfill(cursor, stmt_backfill, batch_size)
+        async with transaction(cursor):
+            # waits for the appends in progress, then numbers their events
+            await cursor.execute(
+                "ALTER TABLE {} ALTER COLUMN position SET DEFAULT {}".format(
+                    identifier(table), next_position
+                )
+            )
+            await self._backfill(cursor, stmt_backfill, batch_size)
+        await cursor.execute(
+            "DROP INDEX CONCURRENTLY IF EXISTS {}".format(identifier(index))
+        )
+        await self._set_not_null(cursor, table, "position")
+
+    async def _backfill(self, cursor, stmt, batch_size):
+        numbered = batch_size
+        while numbered == batch_size:
             await cursor.execute(stmt)
+            (numbered,) = await cursor.fetchone()
+
+    async def _create_index(
+        self, cursor, table, index, columns, unique=False, where=None
+    ):
+        # a failed concurrent build leaves an invalid index behind
+        stmt_invalid = """
+        SELECT 1 FROM pg_index
+        WHERE indexrelid = to_regclass(%(index)s) AND NOT indisvalid
+        """
+        await cursor.execute(stmt_invalid, {"index": identifier(index)})
+        if await cursor.fetchone() is not None:
+            await cursor.execute("DROP INDEX CONCURRENTLY {}".format(identifier(index)))
+        await cursor.execute(
+            "CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {index} "
+            "ON {table} ({columns}){where}".format(
+                unique="UNIQUE " if unique else "",
+                index=identifier(index),
+                table=identifier(table),
+                columns=", ".join(columns),
+                where="" if where is None else " WHERE {}".format(where),
+            )
+        )
+
+    async def _set_not_null(self, cursor, table, column):
+        """
+        Sets NOT NULL after validating an equivalent check, which does not
+        block the writes, so the table is not scanned under an exclusive lock.
+        """
+        stmt_nullable = """
+        SELECT 1 FROM pg_attribute
+        WHERE attrelid = %(table)s::regclass AND attname = %(column)s
+        AND NOT attnotnull
+        """
+        await cursor.execute(
+            stmt_nullable, {"table": identifier(table), "column": column}
+        )
+        if await cursor.fetchone() is None:
+            return
+        check = identifier("{}_{}_not_null".format(table, column))
+        table = identifier(table)
+        await cursor.execute(
+            """
+            ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {check};
+            ALTER TABLE {table} ADD CONSTRAINT {check}
+            CHECK ({column} IS NOT NULL) NOT VALID;
+            """.format(
+                table=table, check=check, column=column
+            )
+        )
+        await cursor.execute(
+            "ALTER TABLE {} VALIDATE CONSTRAINT {}".format(table, check)
+        )
+        await cursor.execute(
+            """
+            ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL;
+            ALTER TABLE {table} DROP CONSTRAINT {check};
+            """.format(
+                table=table, check=check, column=column
+            )
+        )
+
+    async def _has_keyspaces_table(self, cursor):
+        return await self._has_table(cursor, KEYSPACES_TABLE)
+
+    async def _has_table(self, cursor, table):
+        stmt = "SELECT to_regclass(%(table)s)"
+        await cursor.execute(stmt, {"table": table})
+        (table,) = await cursor.fetchone()
+        return table is not None
+
+    async def _get_keyspace(self, cursor, keyspace):
+        """
+        Returns the layout and the serializer recorded for the keyspace.
+        Keyspaces created before they were recorded are JSON documents.
+
+        They are read once per connection, and read again after the
+        keyspace is created, migrated or dropped, or a statement fails as
+        another connection changed its layout.
+        """
+        if keyspace not in self._keyspaces:
+            options = {"layout": DOCUMENT_LAYOUT, "serializer": JSON_SERIALIZER}
+            if await self._has_keyspaces_table(cursor):
+                stmt = """
+                SELECT * FROM {keyspaces} WHERE keyspace = %(keyspace)s
+                """.format(
+                    keyspaces=KEYSPACES_TABLE
+                )
+                await cursor.execute(stmt, {"keyspace": keyspace})
+                row = await cursor.fetchone()
+                if row is not None:
+                    columns = [column.name for column in cursor.description]
+                    options.update(zip(columns, row))
+            self._keyspaces[keyspace] = (options["layout"], options["serializer"])
+        return self._keyspaces[keyspace]
+
+    async def _get_eventstore(self, cursor, keyspace, projections=None):
+        layout, serializer = await self._get_keyspace(cursor, keyspace)
+        EventStore = EVENTSTORES[layout]
+        return EventStore(
+            cursor,
+            keyspace,
+            projections or self.projections,
+            get_serializer(serializer),
+            outbox=self.outbox,
+            statements=self.statements,
+        )
 
     @async_contextmanager
     async def open(self, keyspace):
-        async with self.pool.cursor() as cursor:
-            await yield_(EventStore(cursor, keyspace, self.projections))
+        async with self.cursor() as cursor:
+            await yield_(await self._get_eventstore(cursor, keyspace))
 
 
 class EventStore:
+    schema = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id varchar(255) NOT NULL,
+        data jsonb NOT NULL,
+        created_at timestamp NOT NULL,
+        updated_at timestamp NOT NULL,
+        version bigserial NOT NULL,
+        CONSTRAINT {pkey} PRIMARY KEY (id)
+    ) {partition_by};
+    """
+    column_types: Tuple[str, ...] = ("jsonb",)
+    primary_key: Tuple[str, ...] = ("id",)
+    indexes: Tuple[Tuple[str, Tuple[str, ...]], ...] = ()
+    replaced_constraints: Tuple[str, ...] = ()
+    # the order in which upgrade_keyspace numbers the events stored without
+    # a global position
+    position_order: Tuple[str, ...] = ()
+    snapshot_schema = """
+    CREATE TABLE IF NOT EXISTS {snapshot} (
+        id varchar(255) PRIMARY KEY,
+        version bigint NOT NULL,
+        data jsonb NOT NULL,
+        created_at timestamp NOT NULL
+    )
+    """
 
-    def __init__(self, cursor, keyspace, projections):
+    def __init__(
+        self,
+        cursor,
+        keyspace,
+        projections,
+        serializer=None,
+        outbox=False,
+        statements=None,
+    ):
         self.cursor = cursor
         self.keyspace = keyspace
         self.projections = projections
+        self.serializer = serializer or JSONSerializer()
+        self.outbox = outbox
+        self.statements = statements
+        self.deferred = None
 
-    async def get_stream(self, stream: str, start: int = 0, backward: bool = False):
-        stmt_select = """
-        SELECT {keyspace}.data
-        FROM {keyspace} WHERE {keyspace}.id = %(id)s
+    @classmethod
+    def table_schema(cls, table, column_type, partition_by=""):
+        """
+        Formats the schema of the layout for ``table``, quoting the names of
+        the table and of its indexes.
+        """
+        return cls.schema.format(
+            table=identifier(table),
+            pkey=identifier("{}_pkey".format(table)),
+            position_idx=identifier("{}_position_idx".format(table)),
+            column_type=column_type,
+            partition_by=partition_by,
+        )
+
+    def _statement(self, template, **fragments):
+        return keyspace_statement(
+            template,
+            self.keyspace,
+            self.serializer.column_type,
+            tuple(sorted(fragments.items())),
+        )
+
+    async def _execute(self, statement, params, then=None):
+        """
+        Executes a statement built by :meth:`_statement`, prepared on the
+        connection unless the prepared statements are disabled, and then
+        the ``then`` statement, without parameters, in the same round trip.
+        """
+        if self.statements is None:
+            query = statement.query
+            if then is not None:
+                query = "{};\n{}".format(query, then)
+            await self.cursor.execute(query, params)
+        else:
+            await self.statements.execute(self.cursor, statement, params, then)
+
+    @async_contextmanager
+    async def _writing(self):
+        """
+        Groups a write with its outbox record in one transaction.
+        """
+        if self.outbox:
+            async with transaction(self.cursor):
+                await yield_(self.cursor)
+        else:
+            await yield_(self.cursor)
+
+    async def _record(self, versions):
+        """
+        Records in the outbox the streams written in the current transaction,
+        as ``(stream, version before the append, version after the append)``.
+        """
+        if not self.outbox or not versions:
+            return
+        params = {"keyspace": self.keyspace}
+        values = []
+        for index, (stream, initial_version, current_version) in enumerate(versions):
+            params["id_{}".format(index)] = str(stream)
+            params["initial_version_{}".format(index)] = initial_version
+            params["current_version_{}".format(index)] = current_version
+            values.append(
+                "(%(keyspace)s, %(id_{0})s, %(initial_version_{0})s, "
+                "%(current_version_{0})s, NOW())".format(index)
+            )
+        stmt_insert = """
+        INSERT INTO {outbox}
+        (keyspace, stream_id, initial_version, current_version, created_at)
+        VALUES {values}
         """.format(
-            keyspace=self.keyspace
+            outbox=OUTBOX_TABLE, values=", ".join(values)
         )
-        if backward:
-            stmt_select += " AND CAST(data ? '$version' AS INTEGER) <= %(version)s"
+        await self.cursor.execute(stmt_insert, params)
+
+    async def _notify(self, stream, eventstream, created=False):
+        """
+        Notifies the projections right after the write, unless an outbox
+        worker delivers them. While ``deferred`` is a list, the
+        notifications are kept there until :meth:`flush_notifications`.
+        """
+        if self.outbox:
+            return
+        if self.deferred is not None:
+            self.deferred.append((stream, eventstream, created))
+            return
+        await self._deliver(stream, eventstream, created)
+
+    async def flush_notifications(self):
+        deferred, self.deferred = self.deferred or [], []
+        for stream, eventstream, created in deferred:
+            await self._deliver(stream, eventstream, created)
+
+    async def _deliver(self, stream, eventstream, created):
+        if created:
+            await self.projections.notify_create(self.keyspace, stream, eventstream)
         else:
-            stmt_select += " AND CAST(data ? '$version' AS INTEGER) >= %(version)s"
-        await self.cursor.execute(stmt_select, {"id": str(stream), "version": start})
+            await self.projections.notify_update(self.keyspace, stream, eventstream)
+
+    async def get_stream(
+        self,
+        stream: str,
+        start: int = None,
+        backward: bool = False,
+        end: int = None,
+        limit: int = None,
+    ):
+        """
+        Reads a stream, or the slice of it selected by the version range.
+
+        Forward reads return the versions from ``start`` (inclusive) up to
+        ``end`` (exclusive). Backward reads begin at ``start``, or at the
+        newest event, and go down to ``end`` (exclusive). ``limit`` keeps only
+        the first events found in the reading direction. The range is
+        filtered by the database, so only the slice is transferred and
+        decoded. Events are always returned in version order.
+        """
+        conditions = version_conditions("event.version", start, end, backward)
+        if not conditions and limit is None:
+            stmt_select = self._statement(
+                """
+                SELECT {keyspace}.data, jsonb_array_length({keyspace}.data) - 1
+                FROM {keyspace} WHERE {keyspace}.id = %(id)s
+                """
+            )
+        else:
+            stmt_select = self._statement(
+                """
+            SELECT (
+                SELECT COALESCE(jsonb_agg(slice.data ORDER BY slice.version), '[]')
+                FROM (
+                    SELECT event.data, event.version
+                    FROM (
+                        SELECT element.data, COALESCE(
+                            CAST(element.data->>'$version' AS bigint),
+                            element.position - 1
+                        ) AS version
+                        FROM jsonb_array_elements({keyspace}.data)
+                        WITH ORDINALITY AS element(data, position)
+                    ) AS event
+                    WHERE {conditions}
+                    ORDER BY event.version {order}
+                    LIMIT %(limit)s
+                ) AS slice
+            ), jsonb_array_length({keyspace}.data) - 1
+            FROM {keyspace} WHERE {keyspace}.id = %(id)s
+            """,
+                conditions=" AND ".join(conditions) or "TRUE",
+                order="DESC" if backward else "ASC",
+            )
+        await self._execute(
+            stmt_select,
+            {"id": str(stream), "start": start, "end": end, "limit": limit},
+        )
         eventstore_stream = await self.cursor.fetchone()
         if not eventstore_stream:
             raise StreamDoesNotExist(stream)
-        return EventStream.make(eventstore_stream[0])
+        return EventStream.make(eventstore_stream[0], version=eventstore_stream[1])
+
+    async def get_version(self, stream: str):
+        """
+        Returns the current version of the stream, or -1 when it does not
+        exist, without reading its events.
+        """
+        stmt_select = self._statement(
+            """
+            SELECT version FROM {keyspace} WHERE id = %(id)s
+            """
+        )
+        await self._execute(stmt_select, {"id": str(stream)})
+        version = await self.cursor.fetchone()
+        return -1 if version is None else version[0]
 
     @async_generator
-    async def all_streams(self, start: int = 0, end: int = -1):
+    async def all_streams(
+        self,
+        start: int = 0,
+        end: int = -1,
+        after_id: str = None,
+        fetch_size: int = 100,
+    ):
+        """
+        Walks the keyspace in stream id order, ``fetch_size`` streams at a
+        time. Each batch resumes after the last id read (or ``after_id``),
+        so memory stays constant and no OFFSET is paid past the first batch.
+        """
+        offset = start
+        remaining = end
+        while remaining != 0:
+            limit = fetch_size if remaining < 0 else min(fetch_size, remaining)
+            streams = await self._fetch_streams(after_id, offset, limit)
+            for stream_id, stream in streams:
+                await yield_(EventStream.make(stream))
+            if len(streams) < limit:
+                break
+            after_id = streams[-1][0]
+            offset = 0
+            if remaining > 0:
+                remaining -= len(streams)
+
+    async def _fetch_streams(
+        self, after_id, offset, limit, partition=None, changed_since=None
+    ):
+        """
+        Reads a batch of ``(stream id, decoded events)``. ``partition`` is
+        ``(index, count)`` of a split of the streams by a hash of their id
+        and ``changed_since`` keeps the streams written since a timestamp.
+        """
+        conditions = stream_conditions("id", after_id, partition)
+        if changed_since is not None:
+            conditions.append("updated_at >= %(changed_since)s")
+        stmt_select = self._statement(
+            """
+            SELECT {keyspace}.id, {keyspace}.data
+            FROM {keyspace} {where}
+            ORDER BY id
+            OFFSET %(offset)s LIMIT %(limit)s
+            """,
+            where="WHERE " + " AND ".join(conditions) if conditions else "",
+        )
+        await self._execute(
+            stmt_select,
+            self._stream_params(after_id, offset, limit, partition, changed_since),
+        )
+        return await self.cursor.fetchall()
+
+    def _stream_params(self, after_id, offset, limit, partition, changed_since):
+        params = {
+            "after_id": after_id,
+            "offset": offset,
+            "limit": limit,
+            "changed_since": changed_since,
+        }
+        if partition is not None:
+            params["partition"], params["partitions"] = partition
+        return params
+
+    @async_generator
+    async def subscribe(self, from_position: int = 1, **options):
+        raise LayoutError(
+            "The layout '{}' has no global position".format(DOCUMENT_LAYOUT)
+        )
+
+    async def get_snapshot(self, stream: str):
+        stmt_select = self._statement(
+            """
+            SELECT version, data FROM {snapshot} WHERE id = %(id)s
+            """
+        )
+        await self._execute(stmt_select, {"id": str(stream)})
+        snapshot = await self.cursor.fetchone()
+        if snapshot is None:
+            return None
+        return Snapshot(version=snapshot[0], data=snapshot[1])
+
+    async def save_snapshot(self, stream: str, snapshot: Snapshot):
+        stmt_upsert = """
+        INSERT INTO {snapshot} (id, version, data, created_at)
+        VALUES (%(id)s, %(version)s, %(data)s, NOW())
+        ON CONFLICT (id) DO UPDATE
+        SET version = EXCLUDED.version, data = EXCLUDED.data,
+            created_at = EXCLUDED.created_at
+        WHERE {snapshot}.version < EXCLUDED.version
+        """.format(
+            snapshot=identifier("{}_snapshot".format(self.keyspace))
+        )
+        await self.cursor.execute(
+            stmt_upsert,
+            {
+                "id": str(stream),
+                "version": snapshot.version,
+                "data": json.dumps(snapshot.data, sort_keys=True),
+            },
+        )
+
+    def _appended(self, stored_version, events):
+        """
+        Returns the appended events as a stream starting after the stored
+        version, which is what the projections need to update a read model.
+        """
+        return EventStream.trusted(events, initial_version=stored_version)
+
+    async def _get_event_names(self, stream, event_names):
         stmt_select = """
-        SELECT {keyspace}.data
-        FROM {keyspace}
-        ORDER BY id
+        SELECT DISTINCT event.data->>'$type'
+        FROM {keyspace}, jsonb_array_elements({keyspace}.data) AS event(data)
+        WHERE {keyspace}.id = %(id)s AND event.data->>'$type' = ANY(%(event_names)s)
         """.format(
-            keyspace=self.keyspace
+            keyspace=identifier(self.keyspace)
+        )
+        await self.cursor.execute(
+            stmt_select, {"id": str(stream), "event_names": list(event_names)}
         )
-        if start > 0:
-            stmt_select += " OFFSET {}".format(start)
-        if end > -1:
-            stmt_select += " LIMIT {}".format(end)
-        await self.cursor.execute(stmt_select)
-        eventstore = await self.cursor.fetchall()
-        for stream in eventstore:
-            await yield_(EventStream.make(stream[0]))
+        return {event_name for (event_name,) in await self.cursor.fetchall()}
+
+    async def _conflict_resolution(self, stream, stored_version, events):
+        event_names = set()
+        stored_dependencies = set()
+        for event in events:
+            stored_dependencies.update(
+                dependency
+                for dependency in event.get_dependencies()
+                if dependency not in event_names
+            )
+            event_names.add(event.__event_type__)
+        event_names = set()
+        if stored_version > -1 and stored_dependencies:
+            event_names = await self._get_event_names(stream, stored_dependencies)
+        for index, event in enumerate(events):
+            if event.__empty_stream__ and (stored_version > -1 or index > 0):
+                raise StreamExists(event)
+            not_found = [
+                dependency
+                for dependency in event.get_dependencies()
+                if dependency not in event_names
+            ]
+            if len(not_found) > 0:
+                raise DependencyDoesNotExist(event, not_found)
+            event_names.add(event.__event_type__)
 
     async def append_to_stream(
         self, stream: str, eventstream: EventStream, on_save=None
     ):
-        try:
-            stored_eventstream = await self.get_stream(stream)
+        """
+        Appends only the new events, in one statement. They are concatenated
+        to the stored document, numbered after its version, unless it is
+        newer than the ``initial_version`` of the stream. A new stream is
+        inserted, unless a document was created concurrently. A statement
+        that changes no row raises :class:`VersionError`.
+        """
+        initial_version = eventstream.initial_version
+        events = list(eventstream)
+        created = initial_version == -1 or (events and events[0].__empty_stream__)
+        await self._conflict_resolution(
+            stream, -1 if created else initial_version, events
+        )
+        async with self._writing():
+            stored_version = None
+            if not created:
+                stored_version = await self._concat(stream, initial_version, events)
+            if stored_version is None:
+                stored_version = await self._insert(stream, initial_version, events)
+            current_version = stored_version + len(events)
+            await self._record([(stream, stored_version, current_version)])
+        if stored_version == -1:
+            await self._notify(stream, eventstream, created=True)
+        else:
+            await self._notify(stream, self._appended(stored_version, events))
+        if on_save is not None:
+            on_save(current_version)
 
-            if stored_eventstream.current_version > eventstream.initial_version:
+    async def _concat(self, stream, initial_version, events):
+        """
+        Concatenates the events to the document, renumbering them after its
+        version on the server, and returns the version before them, or
+        ``None`` when the stream does not exist.
+        """
+        stmt_update = self._statement(
+            """
+            UPDATE {keyspace}
+            SET data = {keyspace}.data || COALESCE((
+                    SELECT jsonb_agg(
+                        jsonb_set(event.data, '{{$version}}',
+                                  to_jsonb({keyspace}.version + event.position))
+                        ORDER BY event.position
+                    )
+                    FROM jsonb_array_elements(%(data)s::jsonb)
+                    WITH ORDINALITY AS event(data, position)
+                ), '[]'),
+                version = {keyspace}.version + %(count)s::bigint,
+                updated_at = NOW()
+            WHERE id = %(id)s AND version <= %(initial_version)s
+            RETURNING version
+            """
+        )
+        await self._execute(
+            stmt_update,
+            {
+                "id": str(stream),
+                "initial_version": initial_version,
+                "count": len(events),
+                "data": self.serializer.dumps([event.decode() for event in events]),
+            },
+        )
+        row = await self.cursor.fetchone()
+        if row is None:
+            if await self.get_version(stream) > -1:
                 message = "The version '{0}' was expected in '{1}'".format(
-                    eventstream.initial_version, stored_eventstream
+                    initial_version, stream
                 )
                 raise VersionError(message)
+            return None
+        stored_version = row[0] - len(events)
+        for index, event in enumerate(events):
+            event.version = stored_version + index + 1
+        return stored_version
 
-            stored_eventstream += eventstream
+    async def _insert(self, stream, initial_version, events):
+        stmt_insert = self._statement(
+            """
+            INSERT INTO {keyspace} (id, version, data, created_at, updated_at)
+            SELECT %(id)s::varchar, %(version)s::bigint, %(data)s::jsonb, NOW(), NOW()
+            WHERE NOT EXISTS (SELECT 1 FROM {keyspace} WHERE id = %(id)s)
+            ON CONFLICT DO NOTHING
+            RETURNING version
+            """
+        )
+        for index, event in enumerate(events):
+            event.version = index
+        await self._execute(
+            stmt_insert,
+            {
+                "id": str(stream),
+                "version": len(events) - 1,
+                "data": self.serializer.dumps([event.decode() for event in events]),
+            },
+        )
+        if await self.cursor.fetchone() is None:
+            if initial_version > -1:
+                if await self.get_version(stream) <= initial_version:
+                    raise StreamExists(events[0])
+            message = "The version '{0}' was expected in '{1}'".format(
+                initial_version, stream
+            )
+            raise VersionError(message)
+        return -1
 
-            stmt_update = """
-            UPDATE {keyspace} SET data=%(data)s, updated_at=NOW(), version=%(current_version)s
-            WHERE id = %(id)s AND version = %(initial_version)s;
-            """.format(
-                keyspace=self.keyspace
-            )
-            await self.cursor.execute(
-                stmt_update,
-                {
-                    "id": str(stream),
-                    "initial_version": stored_eventstream.initial_version,
-                    "current_version": stored_eventstream.current_version,
-                    "data": stored_eventstream.json(),
-                },
-            )
-            if self.cursor.rowcount < 1:
-                message = "The version '{0}' was expected in '{1}'".format(
-                    eventstream.initial_version, stored_eventstream
-                )
-                raise VersionError(message)
-            await self.projections.notify_update(
-                self.keyspace, stream, stored_eventstream
+    async def append_to_streams(self, eventstreams: dict, on_save: dict = None):
+        """
+        Appends to many streams in one transaction. As in
+        :meth:`append_to_stream`, the new events are concatenated to the
+        stored documents and the new streams are inserted, and a
+        :class:`VersionConflict` lists every stream that was changed, or
+        created, concurrently. ``on_save`` maps a stream to its save callback.
+        """
+        on_save = on_save or {}
+        streams = {str(stream): stream for stream in eventstreams}
+        events = {}
+        appends = {}
+        for stream_id, stream in streams.items():
+            initial_version = eventstreams[stream].initial_version
+            events[stream_id] = list(eventstreams[stream])
+            created = initial_version == -1 or (
+                events[stream_id] and events[stream_id][0].__empty_stream__
             )
-            if on_save is not None:
-                on_save(stored_eventstream.current_version)
-        except StreamDoesNotExist:
-            stmt_insert = """
+            if not created:
+                appends[stream_id] = (initial_version, events[stream_id])
+        async with transaction(self.cursor):
+            stored_versions = {}
+            if appends:
+                stored_versions = await self._concat_many(appends)
+            inserts = {
+                stream_id: stream_events
+                for stream_id, stream_events in events.items()
+                if stream_id not in stored_versions
+            }
+            if inserts:
+                inserted = await self._insert_many(inserts)
+                stored_versions.update(dict.fromkeys(inserted, -1))
+            conflicts = [
+                stream
+                for stream_id, stream in streams.items()
+                if stream_id not in stored_versions
+            ]
+            if conflicts:
+                raise VersionConflict(conflicts)
+            versions = [
+                (
+                    stream,
+                    stored_versions[stream_id],
+                    stored_versions[stream_id] + len(events[stream_id]),
+                )
+                for stream_id, stream in streams.items()
+            ]
+            await self._record(versions)
+
+        for stream, stored_version, current_version in versions:
+            if stored_version == -1:
+                await self._notify(stream, eventstreams[stream], created=True)
+            else:
+                await self._notify(
+                    stream, self._appended(stored_version, events[str(stream)])
+                )
+            if stream in on_save:
+                on_save[stream](current_version)
+
+    async def _concat_many(self, appends):
+        """
+        Concatenates the events of many streams to their documents, as
+        :meth:`_concat` does, and returns the version before the events of
+        each stream changed. ``appends`` maps a stream to its initial version
+        and its events.
+        """
+        stmt_update = self._statement(
+            """
+            UPDATE {keyspace}
+            SET data = {keyspace}.data || COALESCE((
+                    SELECT jsonb_agg(
+                        jsonb_set(event.data, '{{$version}}',
+                                  to_jsonb({keyspace}.version + event.position))
+                        ORDER BY event.position
+                    )
+                    FROM jsonb_array_elements(batch.data)
+                    WITH ORDINALITY AS event(data, position)
+                ), '[]'),
+                version = {keyspace}.version + batch.count,
+                updated_at = NOW()
+            FROM unnest(
+                %(ids)s::varchar[],
+                %(initial_versions)s::bigint[],
+                %(counts)s::bigint[],
+                %(data)s::jsonb[]
+            ) AS batch(id, initial_version, count, data)
+            WHERE {keyspace}.id = batch.id
+            AND {keyspace}.version <= batch.initial_version
+            RETURNING {keyspace}.id, {keyspace}.version - batch.count
+            """
+        )
+        await self._execute(
+            stmt_update,
+            {
+                "ids": list(appends),
+                "initial_versions": [version for version, _ in appends.values()],
+                "counts": [len(events) for _, events in appends.values()],
+                "data": [
+                    self.serializer.dumps([event.decode() for event in events])
+                    for _, events in appends.values()
+                ],
+            },
+        )
+        stored_versions = dict(await self.cursor.fetchall())
+        for stream_id, stored_version in stored_versions.items():
+            for index, event in enumerate(appends[stream_id][1]):
+                event.version = stored_version + index + 1
+        return stored_versions
+
+    async def _insert_many(self, inserts):
+        """
+        Inserts many new streams, as :meth:`_insert` does, and returns the
+        streams inserted, leaving out those that already exist. It does not
+        rely on the primary key, which the keyspaces created by older
+        versions lack until :meth:`upgrade_keyspace`. ``inserts`` maps a
+        stream to its events.
+        """
+        stmt_insert = self._statement(
+            """
             INSERT INTO {keyspace} (id, version, data, created_at, updated_at)
-            VALUES (%(id)s, %(version)s, %(data)s, NOW(), NOW())
+            SELECT batch.id, batch.version, batch.data, NOW(), NOW()
+            FROM unnest(
+                %(ids)s::varchar[], %(versions)s::bigint[], %(data)s::jsonb[]
+            ) AS batch(id, version, data)
+            WHERE NOT EXISTS (SELECT 1 FROM {keyspace} WHERE id = batch.id)
+            ON CONFLICT DO NOTHING
+            RETURNING id
+            """
+        )
+        for events in inserts.values():
+            for index, event in enumerate(events):
+                event.version = index
+        await self._execute(
+            stmt_insert,
+            {
+                "ids": list(inserts),
+                "versions": [len(events) - 1 for events in inserts.values()],
+                "data": [
+                    self.serializer.dumps([event.decode() for event in events])
+                    for events in inserts.values()
+                ],
+            },
+        )
+        return {stream_id for (stream_id,) in await self.cursor.fetchall()}
+
+
+class AppendOnlyEventStore(EventStore):
+    """
+    Stores one row per event, so an append only writes the new events
+    instead of rewriting the whole stream.
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        stream_id varchar(255) NOT NULL,
+        version bigint NOT NULL,
+        data {column_type} NOT NULL,
+        created_at timestamp NOT NULL,
+        position bigserial NOT NULL,
+        CONSTRAINT {pkey} PRIMARY KEY (stream_id, version)
+    ) {partition_by};
+    CREATE INDEX IF NOT EXISTS {position_idx} ON {table} (position);
+    """
+    column_types = ("jsonb", "bytea")
+    primary_key = ("stream_id", "version")
+    # raised by a concurrent append of the same versions
+    integrity_errors: Tuple[Type[Exception], ...] = (psycopg2.IntegrityError,)
+    indexes = (("position_idx", ("position",)),)
+    position_order = ("created_at", "stream_id", "version")
+    # the unique constraint of the keyspaces created before the primary key
+    replaced_constraints = ("stream_id_version_key",)
+
+    @property
+    def channel(self):
+        """
+        The channel notified, on commit, of the appends to the keyspace.
+        """
+        return "kant_{}".format(self.keyspace.lower())
+
+    async def get_stream(
+        self,
+        stream: str,
+        start: int = None,
+        backward: bool = False,
+        end: int = None,
+        limit: int = None,
+    ):
+        conditions = version_conditions("version", start, end, backward)
+        stmt_select = self._statement(
+            """
+            SELECT {keyspace}.data
+            FROM {keyspace} WHERE {keyspace}.stream_id = %(id)s {conditions}
+            ORDER BY version {order}
+            LIMIT %(limit)s
+            """,
+            conditions="".join(" AND " + condition for condition in conditions),
+            order="DESC" if backward else "ASC",
+        )
+        await self._execute(
+            stmt_select,
+            {"id": str(stream), "start": start, "end": end, "limit": limit},
+        )
+        events = await self.cursor.fetchall()
+        if events:
+            return EventStream.make(self.serializer.loads(data) for (data,) in events)
+        version = await self._get_version(stream)
+        if version == -1:
+            raise StreamDoesNotExist(stream)
+        return EventStream(initial_version=version)
+
+    async def _fetch_streams(
+        self, after_id, offset, limit, partition=None, changed_since=None
+    ):
+        conditions = stream_conditions("stream_id", after_id, partition)
+        stmt_select = self._statement(
+            """
+            SELECT stream_id, array_agg({keyspace}.data ORDER BY {keyspace}.version)
+            FROM {keyspace} {where}
+            GROUP BY stream_id {having}
+            ORDER BY stream_id
+            OFFSET %(offset)s LIMIT %(limit)s
+            """,
+            where="WHERE " + " AND ".join(conditions) if conditions else "",
+            having=""
+            if changed_since is None
+            else "HAVING max(created_at) >= %(changed_since)s",
+        )
+        await self._execute(
+            stmt_select,
+            self._stream_params(after_id, offset, limit, partition, changed_since),
+        )
+        loads = self.serializer.loads
+        return [
+            (stream_id, [loads(data) for data in stream])
+            for stream_id, stream in await self.cursor.fetchall()
+        ]
+
+    @async_generator
+    async def subscribe(
+        self,
+        from_position: int = 1,
+        fetch_size: int = 100,
+        gap_timeout: float = 1.0,
+        idle_timeout: float = 10.0,
+    ):
+        """
+        Follows the keyspace in global position order, yielding a
+        :class:`RecordedEvent` for every event from ``from_position``
+        (inclusive). The stored events are read ``fetch_size`` at a time,
+        then the subscription listens to :attr:`channel` on the connection of
+        this event store and reads the new events when an append commits, or
+        after ``idle_timeout`` seconds. Resume from the last position + 1.
+
+        Positions are taken when the events are inserted, not when they are
+        committed, so a missing position may still be committed by a
+        concurrent append. The subscription waits for it until the events
+        after it are ``gap_timeout`` seconds old, then skips it, as the
+        positions of rolled back appends are never used. ``gap_timeout``
+        must be longer than the append transactions.
+
+        The keyspaces created before the global positions must be upgraded
+        by :meth:`EventStoreConnection.upgrade_keyspace` first.
+        """
+        async with self._listen() as notifies:
+            position = from_position
+            while True:
+                while not notifies.empty():
+                    notifies.get_nowait()
+                events, gap = await self._fetch_positions(
+                    position, fetch_size, gap_timeout
+                )
+                for recorded in events:
+                    await yield_(recorded)
+                if events:
+                    position = events[-1].position + 1
+                if len(events) == fetch_size:
+                    continue
+                try:
+                    await asyncio.wait_for(
+                        notifies.get(), gap_timeout if gap else idle_timeout
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+    @async_contextmanager
+    async def _listen(self):
+        """
+        Listens to :attr:`channel` and yields the queue of its notifications.
+        """
+        await self.cursor.execute("LISTEN {}".format(identifier(self.channel)))
+        try:
+            await yield_(self.cursor.connection.notifies)
+        finally:
+            await self.cursor.execute("UNLISTEN {}".format(identifier(self.channel)))
+
+    async def _fetch_positions(self, position, limit, gap_timeout):
+        """
+        Reads the events from the position, stopping before a gap that is
+        younger than ``gap_timeout``. Returns them and whether it stopped.
+        """
+        stmt_select = """
+        SELECT position, stream_id, data,
+               created_at < NOW() - %(gap_timeout)s * interval '1 second'
+        FROM {keyspace}
+        WHERE position >= %(position)s
+        ORDER BY position
+        LIMIT %(limit)s
+        """.format(
+            keyspace=identifier(self.keyspace)
+        )
+        await self.cursor.execute(
+            stmt_select,
+            {"position": position, "limit": limit, "gap_timeout": gap_timeout},
+        )
+        events = []
+        for event_position, stream_id, data, settled in await self.cursor.fetchall():
+            if event_position != position and not settled:
+                return events, True
+            event = Event.make(self.serializer.loads(data))
+            events.append(RecordedEvent(event_position, stream_id, event))
+            position = event_position + 1
+        return events, False
+
+    async def get_version(self, stream: str):
+        return await self._get_version(stream)
+
+    async def _get_version(self, stream):
+        stmt_select = self._statement(
+            """
+            SELECT max(version) FROM {keyspace} WHERE stream_id = %(id)s
+            """
+        )
+        await self._execute(stmt_select, {"id": str(stream)})
+        (version,) = await self.cursor.fetchone()
+        return -1 if version is None else version
+
+    async def _get_event_names(self, stream, event_names):
+        if not self.serializer.queryable:
+            stmt_select = """
+            SELECT data FROM {keyspace} WHERE stream_id = %(id)s
             """.format(
-                keyspace=self.keyspace
+                keyspace=identifier(self.keyspace)
             )
-            await self.cursor.execute(
-                stmt_insert,
-                {
-                    "id": str(stream),
-                    "version": eventstream.current_version,
-                    "data": eventstream.json(),
-                },
+            await self.cursor.execute(stmt_select, {"id": str(stream)})
+            stored_names = {
+                self.serializer.loads(data)[Event.EVENT_JSON_COLUMN]
+                for (data,) in await self.cursor.fetchall()
+            }
+            return stored_names & set(event_names)
+        stmt_select = """
+        SELECT DISTINCT data->>'$type' FROM {keyspace}
+        WHERE stream_id = %(id)s AND data->>'$type' = ANY(%(event_names)s)
+        """.format(
+            keyspace=identifier(self.keyspace)
+        )
+        await self.cursor.execute(
+            stmt_select, {"id": str(stream), "event_names": list(event_names)}
+        )
+        return {event_name for (event_name,) in await self.cursor.fetchall()}
+
+    async def append_to_stream(
+        self, stream: str, eventstream: EventStream, on_save=None
+    ):
+        stored_version = await self._get_version(stream)
+        if stored_version > eventstream.initial_version:
+            message = "The version '{0}' was expected in '{1}'".format(
+                eventstream.initial_version, stream
             )
-            await self.projections.notify_create(self.keyspace, stream, eventstream)
-            if on_save is not None:
-                on_save(eventstream.current_version)
+            raise VersionError(message)
+
+        events = list(eventstream)
+        await self._conflict_resolution(stream, stored_version, events)
+        for index, event in enumerate(events):
+            event.version = stored_version + index + 1
+        current_version = stored_version + len(events)
+        if events:
+            # one statement for any number of events, so it is prepared once
+            stmt_insert = self._statement(
+                """
+                INSERT INTO {keyspace} (stream_id, version, data, created_at)
+                SELECT %(id)s::varchar, event.version, event.data, NOW()
+                FROM unnest(%(versions)s::bigint[], %(data)s::{column_type}[])
+                WITH ORDINALITY AS event(version, data, position)
+                ORDER BY event.position
+                """
+            )
+            params = {
+                "id": str(stream),
+                "versions": [event.version for event in events],
+                "data": [self.serializer.dumps(event.decode()) for event in events],
+            }
+            async with self._writing():
+                try:
+                    await self._execute(
+                        stmt_insert,
+                        params,
+                        "NOTIFY {}".format(identifier(self.channel)),
+                    )
+                except self.integrity_errors:
+                    message = "The version '{0}' was expected in '{1}'".format(
+                        stored_version, stream
+                    )
+                    raise VersionError(message)
+                await self._record([(stream, stored_version, current_version)])
+
+        if stored_version == -1:
+            await self._notify(stream, eventstream, created=True)
+        else:
+            await self._notify(stream, self._appended(stored_version, events))
+        if on_save is not None:
+            on_save(current_version)
+
+    async def append_to_streams(self, eventstreams: dict, on_save: dict = None):
+        on_save = on_save or {}
+        streams = {str(stream): stream for stream in eventstreams}
+        stmt_select = """
+        SELECT stream_id, max(version) FROM {keyspace}
+        WHERE stream_id = ANY(%(ids)s)
+        GROUP BY stream_id
+        """.format(
+            keyspace=identifier(self.keyspace)
+        )
+        async with transaction(self.cursor):
+            await self.cursor.execute(stmt_select, {"ids": list(streams)})
+            stored_versions = dict(await self.cursor.fetchall())
+            conflicts = [
+                streams[stream_id]
+                for stream_id, stored_version in stored_versions.items()
+                if stored_version > eventstreams[streams[stream_id]].initial_version
+            ]
+            if conflicts:
+                raise VersionConflict(conflicts)
+
+            params = {}
+            values = []
+            saved_versions = {}
+            for stream_index, (stream_id, stream) in enumerate(streams.items()):
+                stored_version = stored_versions.get(stream_id, -1)
+                events = list(eventstreams[stream])
+                await self._conflict_resolution(stream_id, stored_version, events)
+                params["id_{}".format(stream_index)] = stream_id
+                for index, event in enumerate(events):
+                    event.version = stored_version + index + 1
+                    key = "{}_{}".format(stream_index, index)
+                    params["version_" + key] = event.version
+                    params["data_" + key] = self.serializer.dumps(event.decode())
+                    values.append(
+                        "(%(id_{0})s, %(version_{1})s, %(data_{1})s, NOW())".format(
+                            stream_index, key
+                        )
+                    )
+                saved_versions[stream] = (stored_version, stored_version + len(events))
+
+            if values:
+                stmt_insert = """
+                INSERT INTO {keyspace} (stream_id, version, data, created_at)
+                VALUES {values}
+                ON CONFLICT (stream_id, version) DO NOTHING
+                RETURNING stream_id
+                """.format(
+                    keyspace=identifier(self.keyspace), values=", ".join(values)
+                )
+                await self.cursor.execute(stmt_insert, params)
+                inserted = Counter(
+                    stream_id for (stream_id,) in await self.cursor.fetchall()
+                )
+                conflicts = [
+                    stream
+                    for stream, versions in saved_versions.items()
+                    if inserted[str(stream)] < versions[1] - versions[0]
+                ]
+                if conflicts:
+                    raise VersionConflict(conflicts)
+                await self.cursor.execute("NOTIFY {}".format(identifier(self.channel)))
+            await self._record(
+                [
+                    (stream,) + versions
+                    for stream, versions in saved_versions.items()
+                    if versions[1] > versions[0]
+                ]
+            )
+
+        for stream, (stored_version, current_version) in saved_versions.items():
+            if stored_version == -1:
+                await self._notify(stream, eventstreams[stream], created=True)
+            else:
+                await self._notify(
+                    stream, self._appended(stored_version, eventstreams[stream])
+                )
+            if stream in on_save:
+                on_save[stream](current_version)
+
+
+EVENTSTORES = {DOCUMENT_LAYOUT: EventStore, APPEND_ONLY_LAYOUT: AppendOnlyEventStore}
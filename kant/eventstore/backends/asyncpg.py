@@ -0,0 +1,200 @@
+"""
+Runs the event stores on asyncpg connections.
+
+asyncpg speaks the binary protocol, prepares every statement once per
+connection in its statement cache and decodes the rows faster than
+psycopg2, which pays off on read-heavy keyspaces. The keyspaces are the
+same as those of the aiopg backend, so both can be used on one database::
+
+    connection = await connect(dsn="dbname=kant", backend=ASYNCPG_BACKEND)
+
+It requires asyncpg, installed with ``pip install kant[asyncpg]``.
+"""
+import asyncio
+import json
+from collections import deque, namedtuple
+
+from async_generator import yield_
+from asyncio_extras.contextmanager import async_contextmanager
+
+from ..exceptions import BackendError
+from ..layouts import APPEND_ONLY_LAYOUT, DOCUMENT_LAYOUT
+from ..serializers import JSON_SERIALIZER, get_serializer
+from . import ASYNCPG_BACKEND
+from .aiopg import AppendOnlyEventStore as AiopgAppendOnlyEventStore
+from .aiopg import EventStore as AiopgEventStore
+from .aiopg import EventStoreConnection as AiopgEventStoreConnection
+from .aiopg import LAYOUT_ERRORS, build_statement
+
+try:
+    import asyncpg
+except ImportError:  # pragma: no cover
+    asyncpg = None
+
+Column = namedtuple("Column", ["name"])
+
+
+async def init_connection(connection):
+    """
+    Decodes the jsonb columns, as psycopg2 does. The values written are
+    already encoded by the serializers. An asyncpg pool given to
+    :func:`kant.eventstore.connect` must be created with
+    ``init=init_connection``.
+    """
+    await connection.set_type_codec(
+        "jsonb", encoder=str, decoder=json.loads, schema="pg_catalog"
+    )
+
+
+class Cursor:
+    """
+    Runs the queries of the event stores, written for DB-API cursors, on an
+    asyncpg connection. The ``%(name)s`` parameters are sent as ``$n``
+    arguments, so every statement is prepared and cached by asyncpg.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self._rows = deque()
+
+    @property
+    def in_transaction(self):
+        return self.connection.is_in_transaction()
+
+    async def execute(self, query, params=None):
+        if params:
+            statement = build_statement(query)
+            rows = await self.connection.fetch(
+                statement.text, *[params[name] for name in statement.parameters]
+            )
+        elif ";" in query.strip().rstrip(";"):
+            # the scripts run in the simple protocol, which returns no rows
+            await self.connection.execute(query)
+            rows = []
+        else:
+            rows = await self.connection.fetch(query)
+        self.description = None
+        if rows:
+            self.description = [Column(name) for name in rows[0].keys()]
+        self._rows = deque(rows)
+
+    async def fetchone(self):
+        if not self._rows:
+            return None
+        return self._rows.popleft()
+
+    async def fetchall(self):
+        rows = list(self._rows)
+        self._rows.clear()
+        return rows
+
+
+class EventStoreConnection(AiopgEventStoreConnection):
+    """
+    The connection of the asyncpg backend. ``pool`` is an asyncpg pool, or
+    a single connection shared by every unit of work, used instead of
+    creating a pool, and ``statement_cache_size`` sizes the statement cache
+    of the connections of the pool.
+    """
+
+    @classmethod
+    async def create(cls, settings):
+        if asyncpg is None:
+            raise BackendError(
+                "The backend '{}' requires asyncpg".format(ASYNCPG_BACKEND)
+            )
+        self = cls()
+        self.settings = settings
+        self.acquire_timeout = settings.get("acquire_timeout")
+        self.serializer = settings.get("serializer", JSON_SERIALIZER)
+        self.outbox = settings.get("outbox", False)
+        # asyncpg prepares and caches the statements itself
+        self.statements = None
+        self.pool = settings.get("pool")
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(
+                dsn=settings.get("dsn"),
+                min_size=settings.get("minsize", 1),
+                max_size=settings.get("maxsize", 10),
+                statement_cache_size=settings.get("statement_cache_size", 256),
+                init=init_connection,
+                user=settings.get("user"),
+                password=settings.get("password"),
+                database=settings.get("database"),
+                host=settings.get("host"),
+                port=settings.get("port"),
+            )
+        elif not isinstance(self.pool, asyncpg.Pool):
+            await init_connection(self.pool)
+        return self
+
+    async def close(self):
+        await self.projections.join()
+        await self.pool.close()
+
+    @async_contextmanager
+    async def acquire(self):
+        if not isinstance(self.pool, asyncpg.Pool):
+            await yield_(self.pool)
+            return
+        connection = await self.pool.acquire(timeout=self.acquire_timeout)
+        try:
+            await yield_(connection)
+        finally:
+            await self.pool.release(connection)
+
+    @async_contextmanager
+    async def cursor(self):
+        async with self.acquire() as connection:
+            try:
+                await yield_(Cursor(connection))
+            except Exception as e:
+                self._forget_layouts(e)
+                raise
+
+    def _forget_layouts(self, error):
+        if getattr(error, "sqlstate", None) in LAYOUT_ERRORS:
+            self._keyspaces.clear()
+
+    async def _get_eventstore(self, cursor, keyspace, projections=None):
+        layout, serializer = await self._get_keyspace(cursor, keyspace)
+        EventStore = EVENTSTORES[layout]
+        return EventStore(
+            cursor,
+            keyspace,
+            projections or self.projections,
+            get_serializer(serializer),
+            outbox=self.outbox,
+        )
+
+
+class EventStore(AiopgEventStore):
+
+    async def _execute(self, statement, params, then=None):
+        # asyncpg sends the statements with arguments one at a time
+        await self.cursor.execute(statement.query, params)
+        if then is not None:
+            await self.cursor.execute(then)
+
+
+class AppendOnlyEventStore(AiopgAppendOnlyEventStore, EventStore):
+    integrity_errors = (
+        () if asyncpg is None else (asyncpg.IntegrityConstraintViolationError,)
+    )
+
+    @async_contextmanager
+    async def _listen(self):
+        notifies = asyncio.Queue()
+
+        def notify(connection, pid, channel, payload):
+            notifies.put_nowait(payload)
+
+        await self.cursor.connection.add_listener(self.channel, notify)
+        try:
+            await yield_(notifies)
+        finally:
+            await self.cursor.connection.remove_listener(self.channel, notify)
+
+
+EVENTSTORES = {DOCUMENT_LAYOUT: EventStore, APPEND_ONLY_LAYOUT: AppendOnlyEventStore}
@@ -1,21 +1,59 @@
+from .backends import AIOPG_BACKEND, ASYNCPG_BACKEND
+from .backends import asyncpg as asyncpg_backend
 from .backends.aiopg import EventStoreConnection
+from .exceptions import BackendError
+from .serializers import JSON_SERIALIZER
+
+CONNECTIONS = {
+    AIOPG_BACKEND: EventStoreConnection,
+    ASYNCPG_BACKEND: asyncpg_backend.EventStoreConnection,
+}
 
 _connection = None
 
 
 async def connect(
-    dsn=None, user=None, password=None, host=None, database=None, *, pool=None
+    dsn=None,
+    user=None,
+    password=None,
+    host=None,
+    database=None,
+    *,
+    port=None,
+    pool=None,
+    minsize=1,
+    maxsize=10,
+    acquire_timeout=None,
+    pool_recycle=-1,
+    serializer=JSON_SERIALIZER,
+    outbox=False,
+    statement_cache_size=256,
+    backend=AIOPG_BACKEND
 ):
+    """
+    Connects the default event store connection through the ``backend``,
+    ``aiopg`` or ``asyncpg``.
+    """
     global _connection
+    if backend not in CONNECTIONS:
+        raise BackendError("The backend '{}' is not supported".format(backend))
     settings = {
         "dsn": dsn,
         "user": user,
         "password": password,
         "host": host,
+        "port": port,
         "database": database,
         "pool": pool,
+        "minsize": minsize,
+        "maxsize": maxsize,
+        "acquire_timeout": acquire_timeout,
+        "pool_recycle": pool_recycle,
+        "serializer": serializer,
+        "outbox": outbox,
+        "statement_cache_size": statement_cache_size,
     }
-    _connection = await EventStoreConnection.create(settings)
+    _connection = await CONNECTIONS[backend].create(settings)
     return _connection
 
 
@@ -30,3 +30,23 @@ class IntegrityError(DatabaseError):
 
 class StreamDoesNotExist(DatabaseError):
     pass
+
+
+class LayoutError(Exception):
+    pass
+
+
+class VersionConflict(VersionError):
+
+    def __init__(self, streams, *args, **kwargs):
+        self.streams = streams
+        message = "The streams {} were changed concurrently.".format(streams)
+        super().__init__(message, *args, **kwargs)
+
+
+class SerializerError(Exception):
+    pass
+
+
+class BackendError(Exception):
+    pass
@@ -0,0 +1,4 @@
+DOCUMENT_LAYOUT = "document"
+APPEND_ONLY_LAYOUT = "append_only"
+
+LAYOUTS = (DOCUMENT_LAYOUT, APPEND_ONLY_LAYOUT)
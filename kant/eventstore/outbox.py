@@ -0,0 +1,257 @@
+"""
+Delivers the outbox to the projection adapters.
+
+The appends of a connection created with ``outbox=True`` record the
+streams they wrote in the outbox, in the same transaction, instead of
+notifying the projections. An :class:`OutboxWorker` drains the outbox in
+batches and notifies the adapters bound to its :class:`ProjectionManager`,
+so the cost of the read models is not paid by the commands and nothing is
+lost when a process stops between the append and the projection.
+
+The worker can run in its own process::
+
+    $ python -m kant.eventstore.outbox --dsn "dbname=kant" myapp.projections:bind
+
+where ``bind(connection)`` binds the adapters to ``connection.projections``.
+Delivery is at least once: a batch that fails is retried whole, so the
+adapters should be idempotent, as projections with ``__version_field__``
+are. Many workers can drain the same outbox. The entries of a stream are
+still delivered in order, as a worker skips a stream while an earlier
+entry of it is being delivered by another worker.
+"""
+import argparse
+import asyncio
+import importlib
+import logging
+import signal
+
+from .backends.aiopg import CHECKPOINTS_TABLE, OUTBOX_TABLE, transaction
+from .connection import connect
+from .stream import EventStream
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxWorker:
+
+    def __init__(
+        self,
+        connection,
+        projections=None,
+        name="default",
+        batch_size=100,
+        poll_interval=1.0,
+        min_backoff=0.1,
+        max_backoff=60.0,
+    ):
+        self.connection = connection
+        self.projections = projections or connection.projections
+        self.name = name
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.processed = 0
+        self.failures = 0
+        self.checkpoint = None
+        self._stopped = None
+
+    async def run(self):
+        """
+        Drains the outbox until :meth:`stop` is called, waiting
+        ``poll_interval`` when it is empty and backing off exponentially,
+        from ``min_backoff`` up to ``max_backoff``, while a batch fails.
+        """
+        self._stopped = asyncio.Event()
+        retries = 0
+        while not self._stopped.is_set():
+            try:
+                delivered = await self.drain()
+            except Exception:
+                self.failures += 1
+                retries += 1
+                logger.exception("The outbox worker '%s' failed", self.name)
+                delay = min(self.max_backoff, self.min_backoff * 2 ** (retries - 1))
+                await self._sleep(delay)
+                continue
+            retries = 0
+            if delivered < self.batch_size:
+                await self._sleep(self.poll_interval)
+
+    def stop(self):
+        if self._stopped is not None:
+            self._stopped.set()
+
+    async def _sleep(self, delay):
+        try:
+            await asyncio.wait_for(self._stopped.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def drain(self):
+        """
+        Delivers one batch of the outbox and returns the number of entries
+        delivered. The batch is removed from the outbox and the checkpoint is
+        moved only when every adapter handled it. The entries of the streams
+        with an earlier entry outside the batch are left for a later batch.
+        """
+        stmt_select = """
+        SELECT position, keyspace, stream_id, initial_version, current_version
+        FROM {outbox}
+        ORDER BY position
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+        """.format(
+            outbox=OUTBOX_TABLE
+        )
+        stmt_blocked = """
+        SELECT DISTINCT earlier.keyspace, earlier.stream_id
+        FROM {outbox} AS earlier
+        JOIN unnest(
+            %(keyspaces)s::varchar[], %(streams)s::varchar[], %(positions)s::bigint[]
+        ) AS entry(keyspace, stream_id, position)
+        ON earlier.keyspace = entry.keyspace AND earlier.stream_id = entry.stream_id
+        WHERE earlier.position < entry.position
+        AND NOT earlier.position = ANY(%(positions)s)
+        """.format(
+            outbox=OUTBOX_TABLE
+        )
+        stmt_delete = """
+        DELETE FROM {outbox} WHERE position = ANY(%(positions)s)
+        """.format(
+            outbox=OUTBOX_TABLE
+        )
+        stmt_checkpoint = """
+        INSERT INTO {checkpoints} (worker, position, processed, updated_at)
+        VALUES (%(worker)s, %(position)s, %(processed)s, NOW())
+        ON CONFLICT (worker) DO UPDATE
+        SET position = GREATEST({checkpoints}.position, EXCLUDED.position),
+            processed = {checkpoints}.processed + EXCLUDED.processed,
+            updated_at = EXCLUDED.updated_at
+        """.format(
+            checkpoints=CHECKPOINTS_TABLE
+        )
+        async with self.connection.cursor() as cursor:
+            async with transaction(cursor):
+                await cursor.execute(stmt_select, {"limit": self.batch_size})
+                entries = await cursor.fetchall()
+                if entries:
+                    # the earlier entries are locked by the other workers
+                    await cursor.execute(
+                        stmt_blocked,
+                        {
+                            "keyspaces": [entry[1] for entry in entries],
+                            "streams": [entry[2] for entry in entries],
+                            "positions": [entry[0] for entry in entries],
+                        },
+                    )
+                    blocked = set(await cursor.fetchall())
+                    entries = [
+                        entry for entry in entries if tuple(entry[1:3]) not in blocked
+                    ]
+                for entry in entries:
+                    await self._deliver(cursor, *entry[1:])
+                if entries:
+                    positions = [entry[0] for entry in entries]
+                    await cursor.execute(stmt_delete, {"positions": positions})
+                    await cursor.execute(
+                        stmt_checkpoint,
+                        {
+                            "worker": self.name,
+                            "position": positions[-1],
+                            "processed": len(positions),
+                        },
+                    )
+        if entries:
+            self.processed += len(entries)
+            self.checkpoint = entries[-1][0]
+        return len(entries)
+
+    async def _deliver(self, cursor, keyspace, stream, initial_version, version):
+        eventstore = await self.connection._get_eventstore(
+            cursor, keyspace, self.projections
+        )
+        events = await eventstore.get_stream(
+            stream, start=initial_version + 1, end=version + 1
+        )
+        eventstream = EventStream.trusted(events, initial_version=initial_version)
+        if initial_version == -1:
+            await self.projections.notify_create(keyspace, stream, eventstream)
+        else:
+            await self.projections.notify_update(keyspace, stream, eventstream)
+
+    async def lag(self):
+        """
+        Returns the number of entries waiting in the outbox and the age, in
+        seconds, of the oldest one, with the counters of this worker.
+        """
+        stmt_select = """
+        SELECT count(*), EXTRACT(EPOCH FROM NOW() - min(created_at))
+        FROM {outbox}
+        """.format(
+            outbox=OUTBOX_TABLE
+        )
+        async with self.connection.cursor() as cursor:
+            await cursor.execute(stmt_select)
+            pending, oldest = await cursor.fetchone()
+        return {
+            "pending": pending,
+            "oldest": float(oldest or 0),
+            "processed": self.processed,
+            "failures": self.failures,
+            "checkpoint": self.checkpoint,
+        }
+
+
+async def serve(options, setup):
+    connection = await connect(
+        dsn=options.dsn,
+        user=options.user,
+        password=options.password,
+        host=options.host,
+        database=options.database,
+        port=options.port,
+    )
+    worker = OutboxWorker(
+        connection,
+        name=options.name,
+        batch_size=options.batch_size,
+        poll_interval=options.poll_interval,
+    )
+    binding = setup(connection)
+    if asyncio.iscoroutine(binding):
+        await binding
+    loop = asyncio.get_event_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, worker.stop)
+    try:
+        await worker.run()
+    finally:
+        await connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m kant.eventstore.outbox",
+        description="Delivers the outbox to the projection adapters.",
+    )
+    parser.add_argument("setup", help="module:function binding the adapters")
+    parser.add_argument("--dsn")
+    parser.add_argument("--user")
+    parser.add_argument("--password")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--database")
+    parser.add_argument("--name", default="default")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    options = parser.parse_args(argv)
+    module_name, function_name = options.setup.split(":")
+    setup = getattr(importlib.import_module(module_name), function_name)
+    logging.basicConfig(level=logging.INFO)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(serve(options, setup))
+
+
+if __name__ == "__main__":
+    main()
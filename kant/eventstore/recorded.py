@@ -0,0 +1,3 @@
+from collections import namedtuple
+
+RecordedEvent = namedtuple("RecordedEvent", ["position", "stream", "event"])
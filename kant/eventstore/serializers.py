@@ -0,0 +1,88 @@
+import json
+from typing import Optional
+
+from .exceptions import SerializerError
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+JSON_SERIALIZER = "json"
+MSGPACK_SERIALIZER = "msgpack"
+
+
+class Serializer:
+    """
+    Encodes the decoded events of a keyspace into the value of its ``data``
+    column and back. ``queryable`` tells whether the database can read the
+    stored value, as the jsonb operators do.
+    """
+
+    name: Optional[str] = None
+    column_type: Optional[str] = None
+    queryable = False
+
+    def dumps(self, obj):
+        raise NotImplementedError()
+
+    def loads(self, data):
+        raise NotImplementedError()
+
+
+class JSONSerializer(Serializer):
+    """
+    >>> serializer = JSONSerializer()
+    >>> serializer.dumps({"$type": "FoundAdded", "amount": 10})
+    '{"$type":"FoundAdded","amount":10}'
+    """
+
+    name = JSON_SERIALIZER
+    column_type = "jsonb"
+    queryable = True
+
+    def dumps(self, obj):
+        # jsonb normalizes the keys, so they are not sorted here
+        return json.dumps(obj, separators=(",", ":"))
+
+    def loads(self, data):
+        # psycopg2 already decodes jsonb columns
+        if isinstance(data, str):
+            return json.loads(data)
+        return data
+
+
+class MsgPackSerializer(Serializer):
+    """
+    >>> serializer = MsgPackSerializer()
+    >>> data = serializer.dumps({"$type": "FoundAdded", "amount": 10})
+    >>> serializer.loads(memoryview(data))
+    {'$type': 'FoundAdded', 'amount': 10}
+    """
+
+    name = MSGPACK_SERIALIZER
+    column_type = "bytea"
+
+    def __init__(self):
+        if msgpack is None:
+            raise SerializerError(
+                "The serializer '{}' requires msgpack".format(self.name)
+            )
+
+    def dumps(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(bytes(data), raw=False)
+
+
+SERIALIZERS = {
+    JSON_SERIALIZER: JSONSerializer,
+    MSGPACK_SERIALIZER: MsgPackSerializer,
+}
+
+
+def get_serializer(name):
+    if name not in SERIALIZERS:
+        raise SerializerError("The serializer '{}' is not supported".format(name))
+    return SERIALIZERS[name]()
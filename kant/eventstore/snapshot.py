@@ -0,0 +1,3 @@
+from collections import namedtuple
+
+Snapshot = namedtuple("Snapshot", ["version", "data"])
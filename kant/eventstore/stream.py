@@ -7,15 +7,22 @@ from .exceptions import DependencyDoesNotExist, StreamExists
 
 
 class EventStream:
-
-    def __init__(self, events=None):
-        self.initial_version = -1
-        self.current_version = -1
-        self._events = set()
+    """
+    An ordered stream of events. Copies share the events and their indexes
+    until one of the streams is changed, so the views of an aggregate do not
+    clone its history. The events are shared, never copied.
+    """
+
+    def __init__(self, events=None, initial_version=-1):
+        self.initial_version = initial_version
+        self.current_version = initial_version
+        self._events = []
+        self._members = set()
+        self._event_types = set()
+        self._shared = False
         if events is not None:
-            for event in list(events):
-                self.initial_version += 1
-                self.add(event)
+            self.extend(events)
+            self.initial_version = self.current_version
 
     def __eq__(self, event_stream):
         return self.current_version == event_stream.current_version
@@ -39,45 +46,103 @@ class EventStream:
         return len(self._events)
 
     def __add__(self, event_stream):
-        for event in event_stream:
-            self.add(event)
+        self.extend(event_stream)
         return self
 
     def __iter__(self):
-        return iter(sorted(self._events, key=attrgetter("version")))
+        return iter(self._events)
 
     def __repr__(self):
         return str(list(self))
 
-    def _valid_empty_stream(self, event):
-        if event.__empty_stream__ and len(self._events) > 0:
-            raise StreamExists(event)
-
-    def _valid_dependencies(self, event):
-        event_names = [event.__class__.__name__ for event in self._events]
-        not_found = [
-            event for event in event.__dependencies__ if event not in event_names
-        ]
-        if len(not_found) > 0:
-            raise DependencyDoesNotExist(event, not_found)
+    def _conflict_resolution(self, events):
+        """
+        Validates a batch of events against the stream and the events before
+        them in the batch, returning the events not yet in the stream.
+        """
+        accepted = []
+        seen = set()
+        event_types = set(self._event_types)
+        has_events = len(self._events) > 0
+        for event in events:
+            if event in self._members or event in seen:
+                continue
+            if event.__empty_stream__ and has_events:
+                raise StreamExists(event)
+            not_found = [
+                dependency
+                for dependency in event.get_dependencies()
+                if dependency not in event_types
+            ]
+            if len(not_found) > 0:
+                raise DependencyDoesNotExist(event, not_found)
+            seen.add(event)
+            event_types.add(event.__event_type__)
+            has_events = True
+            accepted.append(event)
+        return accepted
 
-    def _conflict_resolution(self, event):
-        self._valid_empty_stream(event)
-        self._valid_dependencies(event)
-        return event
+    @classmethod
+    def trusted(cls, events, initial_version=-1):
+        """
+        Builds a stream of events that were already validated, keeping their
+        versions. The events read from the store are not checked again, as
+        a slice of a stream misses the events its dependencies refer to.
+
+        >>> stream = EventStream.trusted([], initial_version=3)
+        >>> stream.initial_version, stream.current_version
+        (3, 3)
+        """
+        eventstream = cls(initial_version=initial_version)
+        eventstream._events = list(events)
+        eventstream._members = set(eventstream._events)
+        eventstream._event_types = {
+            event.__event_type__ for event in eventstream._events
+        }
+        if eventstream._events:
+            eventstream.current_version = eventstream._events[-1].version
+        return eventstream
 
     def exists(self):
         return self.initial_version != -1
 
     def clear(self):
-        self._events = set()
+        self._events = []
+        self._members = set()
+        self._event_types = set()
+        self._shared = False
+
+    def copy(self):
+        eventstream = self.__class__.__new__(self.__class__)
+        eventstream.__dict__.update(self.__dict__)
+        eventstream._shared = self._shared = True
+        return eventstream
+
+    __copy__ = copy
+
+    def _unshare(self):
+        self._events = list(self._events)
+        self._members = set(self._members)
+        self._event_types = set(self._event_types)
+        self._shared = False
 
     def add(self, event):
-        if event not in self._events:
-            event = self._conflict_resolution(event)
+        self.extend((event,))
+
+    def extend(self, events):
+        """
+        Appends a batch of events in order. The whole batch is validated
+        before any event is appended, so a conflict leaves the stream as is.
+        """
+        events = self._conflict_resolution(events)
+        if events and self._shared:
+            self._unshare()
+        for event in events:
             self.current_version += 1
             event.version = self.current_version
-            self._events.add(event)
+            self._events.append(event)
+            self._members.add(event)
+            self._event_types.add(event.__event_type__)
 
     def decode(self):
         return [event.decode() for event in self._events]
@@ -86,5 +151,23 @@ class EventStream:
         return json.dumps(self.decode(), sort_keys=True)
 
     @classmethod
-    def make(self, obj):
-        return EventStream([Event.make(event) for event in obj])
+    def make(self, obj, version=-1):
+        """
+        Decodes a stream, or a slice of it, keeping the stored versions.
+        The ``version`` is used when there is no event to decode.
+
+        >>> stream = EventStream.make([
+        ...     {"$type": "FoundAdded", "$version": 6, "amount": 10},
+        ...     {"$type": "FoundAdded", "$version": 5, "amount": 20},
+        ... ])
+        >>> [event.version for event in stream]
+        [5, 6]
+        >>> stream.initial_version, stream.current_version
+        (6, 6)
+        >>> EventStream.make([], version=6).current_version
+        6
+        """
+        events = sorted((Event.make(event) for event in obj), key=attrgetter("version"))
+        if events:
+            return EventStream.trusted(events, initial_version=events[-1].version)
+        return EventStream(initial_version=version)
@@ -1,42 +1,153 @@
-from copy import deepcopy
+import asyncio
+import logging
 
-from inflection import underscore
 from kant.datamapper.base import FieldMapping, ModelMeta
 from kant.datamapper.fields import *  # NOQA
+from kant.events.handlers import HandlerTable
 from kant.eventstore.stream import EventStream
 
+from .exceptions import ProjectionDoesNotExist, ProjectionError
+
+logger = logging.getLogger(__name__)
+
 
 class ProjectionManager:
+    """
+    Notifies the bound adapters concurrently.
 
-    def __init__(self):
-        self._adapters = set()
+    A required adapter is awaited by the write and its error is raised to
+    the caller. A best-effort adapter runs in the background: its errors
+    and timeouts are logged and given to ``on_error(adapter, exception)``,
+    and :meth:`join` waits for the pending notifications.
+    """
+
+    def __init__(self, on_error=None):
+        self._adapters = {}
+        self._pending = set()
+        self.on_error = on_error
+
+    def __len__(self):
+        return len(self._adapters)
 
-    def bind(self, adapter):
-        self._adapters.add(adapter)
+    def bind(self, adapter, required=True, timeout=None):
+        self._adapters[adapter] = (required, timeout)
 
     async def notify_create(self, *args, **kwargs):
-        for adapter in self._adapters:
-            await adapter.handle_create(*args, **kwargs)
+        await self._notify("handle_create", args, kwargs)
 
     async def notify_update(self, *args, **kwargs):
-        for adapter in self._adapters:
-            await adapter.handle_update(*args, **kwargs)
+        """
+        The stream holds at least the events appended after its
+        ``initial_version``, which is the version before the append.
+        """
+        await self._notify("handle_update", args, kwargs)
+
+    async def join(self):
+        while self._pending:
+            await asyncio.wait(list(self._pending))
+
+    async def _notify(self, handler_name, args, kwargs):
+        required = []
+        for adapter, (is_required, timeout) in self._adapters.items():
+            if is_required:
+                required.append(
+                    asyncio.wait_for(
+                        getattr(adapter, handler_name)(*args, **kwargs), timeout
+                    )
+                )
+            else:
+                # the caller may change its streams once the write returns
+                notification = asyncio.wait_for(
+                    getattr(adapter, handler_name)(
+                        *self._detach(args), **self._detach(kwargs)
+                    ),
+                    timeout,
+                )
+                task = asyncio.ensure_future(self._isolate(adapter, notification))
+                self._pending.add(task)
+                task.add_done_callback(self._pending.discard)
+        if len(required) == 1:
+            await required[0]
+        elif required:
+            results = await asyncio.gather(*required, return_exceptions=True)
+            errors = [result for result in results if isinstance(result, Exception)]
+            for error in errors[1:]:
+                logger.error("A projection adapter failed", exc_info=error)
+            if errors:
+                raise errors[0]
+
+    def _detach(self, args):
+        """
+        Copies the streams given to a background notification, which share
+        the events with the caller until one of the streams is changed.
+        """
+        if isinstance(args, dict):
+            return {key: self._detach((arg,))[0] for key, arg in args.items()}
+        return tuple(
+            arg.copy() if isinstance(arg, EventStream) else arg for arg in args
+        )
+
+    async def _isolate(self, adapter, notification):
+        try:
+            await notification
+        except Exception as e:
+            logger.exception("The projection adapter %r failed", adapter)
+            if self.on_error is not None:
+                self.on_error(adapter, e)
+
+
+class ProjectionMeta(ModelMeta):
+
+    def __new__(mcs, class_name, bases, attrs):
+        cls = ModelMeta.__new__(mcs, class_name, bases, attrs)
+        cls._handlers = HandlerTable(cls, "when_")
+        return cls
 
 
-class Projection(FieldMapping, metaclass=ModelMeta):
+class Projection(FieldMapping, metaclass=ProjectionMeta):
+    """
+    Events without a handler are skipped, unless ``__strict__`` is set.
 
-    def fetch_events(self, eventstream):
+    ``__version_field__`` names an optional field keeping the version of
+    the last event applied, so updates apply each event only once.
+    """
+
+    __strict__ = False
+    __version_field__ = None
+
+    @classmethod
+    def make(cls, obj):
+        json_columns = cls._json_columns
+        self = cls()
+        for column, value in obj.items():
+            if column in json_columns and value is not None:
+                self[json_columns[column]] = value
+        return self
+
+    def applied_version(self, default=-1):
+        if self.__version_field__ is None:
+            return default
+        return self.get(self.__version_field__, default)
+
+    def fetch_events(self, eventstream, after_version=-1):
+        last_version = None
         for event in eventstream:
-            self.when(event)
+            if event.version > after_version:
+                self.when(event)
+                last_version = event.version
+        if self.__version_field__ is not None and last_version is not None:
+            self[self.__version_field__] = last_version
 
     def when(self, event):
-        event_name = underscore(event.__class__.__name__)
-        method_name = "when_{0}".format(event_name)
-        try:
-            method = getattr(self, method_name)
-            method(event)
-        except AttributeError:
-            pass
+        handler = self._handlers.get(event.__class__)
+        if handler is None:
+            if self.__strict__:
+                msg = "The handler for '{}' is not defined in '{}'".format(
+                    event.__class__.__name__, self.__class__.__name__
+                )
+                raise ProjectionError(msg)
+            return
+        handler(self, event)
 
 
 class ProjectionRouter:
@@ -49,10 +160,13 @@ class ProjectionRouter:
         self._models[keyspace] = model
         self._projections[keyspace] = projection
 
-    def get_projection(self, keyspace, eventstream):
+    def get_projection_class(self, keyspace):
         if keyspace not in self._projections:
             raise ProjectionDoesNotExist(keyspace)
-        Projection = self._projections[keyspace]
+        return self._projections[keyspace]
+
+    def get_projection(self, keyspace, eventstream):
+        Projection = self.get_projection_class(keyspace)
         projection = Projection()
         projection.fetch_events(eventstream)
         return projection
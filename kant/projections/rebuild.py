@@ -0,0 +1,391 @@
+"""
+Rebuilds the read model of a keyspace without taking it offline.
+
+The streams are split in ``partitions`` by a hash of their id and the
+partitions are replayed by a pool of ``processes``, each one reading its
+streams in batches, projecting them and writing the rows to a shadow
+table. Every batch is committed with the checkpoint of its partition, so
+an interrupted rebuild resumes where it stopped. When every partition is
+done, the streams written since the rebuild started are projected again
+and the shadow table replaces the read model in one transaction::
+
+    $ python -m kant.projections.rebuild --dsn "dbname=kant" event_store \\
+        myapp.projections:get_router
+
+where ``get_router()`` returns the :class:`ProjectionRouter` of the read
+model. The adapters keep updating the read model during the rebuild and
+are only blocked while the tables are swapped.
+"""
+import argparse
+import asyncio
+import importlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from aiopg.sa import create_engine
+from kant.eventstore.backends.aiopg import EventStoreConnection
+from kant.eventstore.stream import EventStream
+from sqlalchemy import column, table
+
+from .sa import upsert
+
+logger = logging.getLogger(__name__)
+
+REBUILDS_TABLE = "kant_rebuilds"
+CONNECTION_SETTINGS = ("dsn", "user", "password", "host", "port", "database")
+
+
+def load(setup):
+    if callable(setup):
+        return setup
+    module_name, function_name = setup.split(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def rebuild_partition(rebuild, partition):
+    """
+    Rebuilds one partition in a new event loop, as the processes of the
+    pool do, and returns the number of streams projected.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(rebuild.rebuild_partition(partition))
+    finally:
+        loop.close()
+
+
+class ProjectionRebuild:
+    """
+    ``setup`` is a function returning the router, or its ``module:function``
+    path. ``settings`` are the connection settings of the event store and
+    ``projection_settings`` those of the read model, the same by default.
+    ``processes=0`` rebuilds the partitions in the current process.
+    """
+
+    def __init__(
+        self,
+        keyspace,
+        setup,
+        settings,
+        projection_settings=None,
+        name=None,
+        partitions=8,
+        processes=None,
+        fetch_size=500,
+        margin=60.0,
+    ):
+        self.keyspace = keyspace
+        self.setup = setup
+        self.settings = {
+            key: value for key, value in settings.items() if key in CONNECTION_SETTINGS
+        }
+        self.projection_settings = {
+            key: value
+            for key, value in (projection_settings or settings).items()
+            if key in CONNECTION_SETTINGS
+        }
+        self.name = name
+        self.partitions = partitions
+        self.processes = processes
+        self.fetch_size = fetch_size
+        self.margin = margin
+
+    @property
+    def table(self):
+        return load(self.setup)().get_model(self.keyspace).name
+
+    @property
+    def shadow(self):
+        return "{}_rebuild".format(self.table)
+
+    async def run(self):
+        """
+        Rebuilds the pending partitions and swaps the tables. Returns the
+        number of streams projected.
+        """
+        self.name = self.name or self.table
+        pending = await self._prepare()
+        projected = 0
+        if pending and self.processes == 0:
+            for partition in pending:
+                projected += await self.rebuild_partition(partition)
+        elif pending:
+            # the connections of this process are closed before forking
+            loop = asyncio.get_event_loop()
+            with ProcessPoolExecutor(self.processes) as executor:
+                results = await asyncio.gather(
+                    *[
+                        loop.run_in_executor(
+                            executor, rebuild_partition, self, partition
+                        )
+                        for partition in pending
+                    ]
+                )
+            projected += sum(results)
+        return projected + await self._swap()
+
+    async def _connect(self):
+        connection = await EventStoreConnection.create(
+            dict(self.settings, minsize=1, maxsize=1)
+        )
+        engine = await create_engine(minsize=1, maxsize=1, **self.projection_settings)
+        return connection, engine
+
+    async def _close(self, connection, engine):
+        await connection.close()
+        engine.close()
+        await engine.wait_closed()
+
+    async def _prepare(self):
+        """
+        Creates the shadow table and the checkpoints of a new rebuild, or
+        reads those of an interrupted one, and returns the pending partitions.
+        """
+        stmt_create = """
+        CREATE TABLE IF NOT EXISTS {rebuilds} (
+            rebuild varchar(255) NOT NULL,
+            partition integer NOT NULL,
+            partitions integer NOT NULL,
+            after_id varchar(255),
+            done boolean NOT NULL,
+            projected bigint NOT NULL,
+            started_at timestamp NOT NULL,
+            updated_at timestamp NOT NULL,
+            PRIMARY KEY (rebuild, partition)
+        );
+        CREATE TABLE IF NOT EXISTS {shadow} (LIKE {table} INCLUDING ALL);
+        """.format(
+            rebuilds=REBUILDS_TABLE, shadow=self.shadow, table=self.table
+        )
+        stmt_select = """
+        SELECT partition, partitions, done FROM {rebuilds}
+        WHERE rebuild = %(rebuild)s ORDER BY partition
+        """.format(
+            rebuilds=REBUILDS_TABLE
+        )
+        stmt_insert = """
+        INSERT INTO {rebuilds}
+        (rebuild, partition, partitions, done, projected, started_at, updated_at)
+        SELECT %(rebuild)s, partition, %(partitions)s, FALSE, 0, %(started_at)s, NOW()
+        FROM generate_series(0, %(partitions)s - 1) AS partition
+        """.format(
+            rebuilds=REBUILDS_TABLE
+        )
+        connection, engine = await self._connect()
+        try:
+            async with engine.acquire() as saconnection:
+                await saconnection.execute(stmt_create)
+                result = await saconnection.execute(
+                    stmt_select, {"rebuild": self.name}
+                )
+                checkpoints = await result.fetchall()
+                if checkpoints:
+                    self.partitions = checkpoints[0].partitions
+                    return [row.partition for row in checkpoints if not row.done]
+                await saconnection.execute(
+                    stmt_insert,
+                    {
+                        "rebuild": self.name,
+                        "partitions": self.partitions,
+                        "started_at": await self._now(connection),
+                    },
+                )
+                return list(range(self.partitions))
+        finally:
+            await self._close(connection, engine)
+
+    async def _now(self, connection):
+        async with connection.cursor() as cursor:
+            await cursor.execute("SELECT LOCALTIMESTAMP")
+            (now,) = await cursor.fetchone()
+        return now
+
+    async def rebuild_partition(self, partition):
+        stmt_checkpoint = """
+        UPDATE {rebuilds}
+        SET after_id = %(after_id)s, done = %(done)s,
+            projected = projected + %(projected)s, updated_at = NOW()
+        WHERE rebuild = %(rebuild)s AND partition = %(partition)s
+        RETURNING after_id
+        """.format(
+            rebuilds=REBUILDS_TABLE
+        )
+        stmt_select = """
+        SELECT after_id FROM {rebuilds}
+        WHERE rebuild = %(rebuild)s AND partition = %(partition)s
+        """.format(
+            rebuilds=REBUILDS_TABLE
+        )
+        router = load(self.setup)()
+        connection, engine = await self._connect()
+        projected = 0
+        try:
+            async with engine.acquire() as saconnection:
+                result = await saconnection.execute(
+                    stmt_select, {"rebuild": self.name, "partition": partition}
+                )
+                after_id = await result.scalar()
+                async with connection.cursor() as cursor:
+                    eventstore = await connection._get_eventstore(cursor, self.keyspace)
+                    done = False
+                    while not done:
+                        streams = await eventstore._fetch_streams(
+                            after_id,
+                            0,
+                            self.fetch_size,
+                            partition=(partition, self.partitions),
+                        )
+                        done = len(streams) < self.fetch_size
+                        if streams:
+                            after_id = streams[-1][0]
+                        async with saconnection.begin():
+                            await self._write(saconnection, router, streams)
+                            await saconnection.execute(
+                                stmt_checkpoint,
+                                {
+                                    "rebuild": self.name,
+                                    "partition": partition,
+                                    "after_id": after_id,
+                                    "done": done,
+                                    "projected": len(streams),
+                                },
+                            )
+                        projected += len(streams)
+        finally:
+            await self._close(connection, engine)
+        logger.info(
+            "The partition %s of '%s' projected %s streams",
+            partition,
+            self.name,
+            projected,
+        )
+        return projected
+
+    async def _write(self, saconnection, router, streams):
+        if not streams:
+            return
+        model = router.get_model(self.keyspace)
+        rows = [
+            router.get_projection(self.keyspace, EventStream.make(events)).decode()
+            for _, events in streams
+        ]
+        shadow = table(self.shadow, *[column(c.name) for c in model.columns])
+        primary_keys = [c.name for c in model.primary_key.columns]
+        await saconnection.execute(upsert(shadow, rows, primary_keys))
+
+    async def _catch_up(self, connection, saconnection, router, changed_since):
+        """
+        Projects again the streams written since ``changed_since``, less the
+        ``margin`` covering the appends that were still being committed.
+        """
+        changed_since -= timedelta(seconds=self.margin)
+        projected = 0
+        async with connection.cursor() as cursor:
+            eventstore = await connection._get_eventstore(cursor, self.keyspace)
+            after_id = None
+            while True:
+                streams = await eventstore._fetch_streams(
+                    after_id, 0, self.fetch_size, changed_since=changed_since
+                )
+                await self._write(saconnection, router, streams)
+                projected += len(streams)
+                if len(streams) < self.fetch_size:
+                    return projected
+                after_id = streams[-1][0]
+
+    async def _swap(self):
+        """
+        Catches up with the streams written during the rebuild, then again
+        while the read model is locked against writes, and replaces it with
+        the shadow table.
+        """
+        stmt_started = """
+        SELECT min(started_at) FROM {rebuilds} WHERE rebuild = %(rebuild)s
+        """.format(
+            rebuilds=REBUILDS_TABLE
+        )
+        stmt_swap = """
+        ALTER TABLE {table} RENAME TO {table}_replaced;
+        ALTER TABLE {shadow} RENAME TO {table};
+        DROP TABLE {table}_replaced;
+        """.format(
+            table=self.table, shadow=self.shadow
+        )
+        stmt_delete = """
+        DELETE FROM {rebuilds} WHERE rebuild = %(rebuild)s
+        """.format(
+            rebuilds=REBUILDS_TABLE
+        )
+        router = load(self.setup)()
+        connection, engine = await self._connect()
+        try:
+            async with engine.acquire() as saconnection:
+                result = await saconnection.execute(
+                    stmt_started, {"rebuild": self.name}
+                )
+                started_at = await result.scalar()
+                caught_up_at = await self._now(connection)
+                projected = await self._catch_up(
+                    connection, saconnection, router, started_at
+                )
+                async with saconnection.begin():
+                    await saconnection.execute(
+                        "LOCK TABLE {} IN EXCLUSIVE MODE".format(self.table)
+                    )
+                    projected += await self._catch_up(
+                        connection, saconnection, router, caught_up_at
+                    )
+                    await saconnection.execute(stmt_swap)
+                    await saconnection.execute(stmt_delete, {"rebuild": self.name})
+        finally:
+            await self._close(connection, engine)
+        return projected
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m kant.projections.rebuild",
+        description="Rebuilds the read model of a keyspace.",
+    )
+    parser.add_argument("keyspace")
+    parser.add_argument("setup", help="module:function returning the router")
+    parser.add_argument("--dsn")
+    parser.add_argument("--user")
+    parser.add_argument("--password")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--database")
+    parser.add_argument("--projection-dsn")
+    parser.add_argument("--name")
+    parser.add_argument("--partitions", type=int, default=8)
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--fetch-size", type=int, default=500)
+    options = parser.parse_args(argv)
+    settings = {
+        key: getattr(options, key)
+        for key in CONNECTION_SETTINGS
+        if getattr(options, key) is not None
+    }
+    projection_settings = None
+    if options.projection_dsn is not None:
+        projection_settings = {"dsn": options.projection_dsn}
+    rebuild = ProjectionRebuild(
+        options.keyspace,
+        options.setup,
+        settings,
+        projection_settings=projection_settings,
+        name=options.name,
+        partitions=options.partitions,
+        processes=options.processes,
+        fetch_size=options.fetch_size,
+    )
+    logging.basicConfig(level=logging.INFO)
+    loop = asyncio.get_event_loop()
+    projected = loop.run_until_complete(rebuild.run())
+    logger.info("The rebuild of '%s' projected %s streams", rebuild.name, projected)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,47 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
 from sqlalchemy import and_, literal_column
+from sqlalchemy.dialects.postgresql import insert
 
 from .exceptions import ProjectionDoesNotExist, ProjectionError
 
+logger = logging.getLogger(__name__)
+
+
+def upsert(table, values, primary_keys):
+    """
+    Builds one ``INSERT ... ON CONFLICT DO UPDATE`` writing the rows.
+    """
+    if not primary_keys:
+        msg = "The table '{}' must have a primary key".format(table.name)
+        raise ProjectionError(msg)
+    columns = list(OrderedDict.fromkeys(name for row in values for name in row))
+    stmt = insert(table).values(
+        [{column: row.get(column) for column in columns} for row in values]
+    )
+    changes = {
+        column: stmt.excluded[column]
+        for column in columns
+        if column not in primary_keys
+    }
+    if not changes:
+        return stmt.on_conflict_do_nothing(index_elements=primary_keys)
+    return stmt.on_conflict_do_update(index_elements=primary_keys, set_=changes)
+
 
 class SQLAlchemyProjectionAdapter:
+    """
+    Keeps one row per stream. Updates load the current row by the stream id,
+    apply only the events appended since the last update and write only the
+    columns that changed. :meth:`rebuild` replays a whole stream instead.
+
+    Projections with several primary keys, or a stream without a row, are
+    written by projecting the events given. A missing row is inserted when
+    they start at the first event of the stream, otherwise the update is
+    skipped and logged, and the projection must be rebuilt.
+    """
 
     def __init__(self, saconnection, router):
         self.saconnection = saconnection
@@ -15,16 +53,201 @@ class SQLAlchemyProjectionAdapter:
         await self.saconnection.execute(stmt)
 
     async def handle_update(self, keyspace, steam, eventstream):
+        Projection = self.router.get_projection_class(keyspace)
+        model = self.router.get_model(keyspace)
+        if len(Projection._primary_keys) == 1:
+            where = self._where_stream(Projection, steam)
+            projection = await self._load(Projection, model, where)
+            if projection is not None:
+                stored = projection.decode()
+                after_version = projection.applied_version(eventstream.initial_version)
+                projection.fetch_events(eventstream, after_version)
+                changes = {
+                    column: value
+                    for column, value in projection.decode().items()
+                    if column not in stored or stored[column] != value
+                }
+                if changes:
+                    stmt = model.update().values(**changes).where(where)
+                    await self.saconnection.execute(stmt)
+                return
+        self._check_primary_keys(Projection)
+        insert = self._starts_stream(eventstream)
+        if insert or len(Projection._primary_keys) > 1:
+            projection = self.router.get_projection(keyspace, eventstream)
+            await self._write(model, projection, steam, insert)
+        else:
+            self._skip(steam)
+
+    async def rebuild(self, keyspace, stream, eventstream):
+        """
+        Replays the whole stream and writes every column of the projection.
+        """
+        self._check_primary_keys(self.router.get_projection_class(keyspace))
         projection = self.router.get_projection(keyspace, eventstream)
-        if not projection.primary_keys():
-            msg = "'{}' not have primary keys".format(projection.__class__.__name__)
-            raise ProjectionError(msg)
-        stmt = self.router.get_model(keyspace).update().values(
-            **projection.decode()
-        ).where(
-            and_(
-                literal_column(field) == value
-                for field, value in projection.primary_keys().items()
-            )
+        model = self.router.get_model(keyspace)
+        await self._write(model, projection, stream, insert=True)
+
+    async def _write(self, model, projection, stream, insert):
+        """
+        Updates the row of the projection by its primary keys, inserting it
+        when it does not exist and ``insert`` is set.
+        """
+        primary_keys = projection.primary_keys()
+        values = projection.decode()
+        where = and_(
+            *(literal_column(field) == value for field, value in primary_keys.items())
         )
-        await self.saconnection.execute(stmt)
+        result = await self.saconnection.execute(
+            model.update().values(**values).where(where)
+        )
+        if result.rowcount > 0:
+            return
+        if insert:
+            await self.saconnection.execute(model.insert().values(**values))
+        else:
+            self._skip(stream)
+
+    def _skip(self, stream):
+        logger.warning(
+            "The projection of %r does not exist, it must be rebuilt", stream
+        )
+
+    def _check_primary_keys(self, Projection):
+        if not Projection._primary_keys:
+            msg = "'{}' not have primary keys".format(Projection.__name__)
+            raise ProjectionError(msg)
+
+    async def _load(self, Projection, model, where):
+        result = await self.saconnection.execute(model.select().where(where))
+        row = await result.first()
+        if row is None:
+            return None
+        return Projection.make(dict(row.items()))
+
+    def _starts_stream(self, eventstream):
+        """
+        Tells whether the events given start at the first event of the stream.
+        """
+        return any(event.version == 0 for event in eventstream)
+
+    def _stream_key(self, Projection, stream):
+        """
+        Returns the primary key column of the projection and its value for
+        the stream.
+        """
+        if len(Projection._primary_keys) != 1:
+            msg = "'{}' must have one primary key".format(Projection.__name__)
+            raise ProjectionError(msg)
+        ((name, field_name, encode),) = Projection._primary_keys
+        return field_name, encode(Projection._parsers[name](stream))
+
+    def _where_stream(self, Projection, stream):
+        field_name, value = self._stream_key(Projection, stream)
+        return literal_column(field_name) == value
+
+
+class BufferedSQLAlchemyProjectionAdapter(SQLAlchemyProjectionAdapter):
+    """
+    Buffers the projections and writes them in batches, keeping only the
+    latest row of each primary key. A batch is written with one multi-row
+    ``INSERT ... ON CONFLICT DO UPDATE`` per table when it reaches
+    ``batch_size`` rows, or ``flush_interval`` seconds after its first row,
+    so replays and bursts on the same stream cost one write per row.
+
+    The read models lag by up to ``flush_interval``: call :meth:`flush`
+    before reading them and :meth:`close` on shutdown. A timed flush that
+    fails is logged and its rows are kept for the next one.
+    """
+
+    def __init__(self, saconnection, router, batch_size=500, flush_interval=0.05):
+        super().__init__(saconnection, router)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = OrderedDict()
+        self._lock = asyncio.Lock()
+        self._timer = None
+
+    def __len__(self):
+        return len(self._buffer)
+
+    async def handle_create(self, keyspace, steam, eventstream):
+        Projection = self.router.get_projection_class(keyspace)
+        projection = self.router.get_projection(keyspace, eventstream)
+        async with self._lock:
+            await self._put(keyspace, Projection, steam, projection)
+
+    async def handle_update(self, keyspace, steam, eventstream):
+        Projection = self.router.get_projection_class(keyspace)
+        model = self.router.get_model(keyspace)
+        async with self._lock:
+            if len(Projection._primary_keys) != 1:
+                # the rows are buffered by the stream id, so they are written now
+                self._check_primary_keys(Projection)
+                await self._flush()
+                projection = self.router.get_projection(keyspace, eventstream)
+                insert = self._starts_stream(eventstream)
+                await self._write(model, projection, steam, insert)
+                return
+            key = (keyspace, self._stream_key(Projection, steam)[1])
+            if key in self._buffer:
+                projection = Projection.make(self._buffer[key][1])
+            else:
+                where = self._where_stream(Projection, steam)
+                projection = await self._load(Projection, model, where)
+            if projection is not None:
+                after_version = projection.applied_version(eventstream.initial_version)
+                projection.fetch_events(eventstream, after_version)
+            elif self._starts_stream(eventstream):
+                projection = self.router.get_projection(keyspace, eventstream)
+            else:
+                self._skip(steam)
+                return
+            await self._put(keyspace, Projection, steam, projection)
+
+    async def rebuild(self, keyspace, stream, eventstream):
+        projection = self.router.get_projection(keyspace, eventstream)
+        async with self._lock:
+            await self._put(keyspace, projection.__class__, stream, projection)
+
+    async def _put(self, keyspace, Projection, stream, projection):
+        key = (keyspace, self._stream_key(Projection, stream)[1])
+        self._buffer[key] = (self.router.get_model(keyspace), projection.decode())
+        if len(self._buffer) >= self.batch_size:
+            await self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("The buffered projections could not be written")
+
+    async def flush(self):
+        """
+        Writes the buffered projections now.
+        """
+        async with self._lock:
+            await self._flush()
+
+    async def close(self):
+        await self.flush()
+
+    async def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        rows, self._buffer = self._buffer, OrderedDict()
+        tables = OrderedDict()
+        for model, row in rows.values():
+            tables.setdefault(model, []).append(row)
+        try:
+            for model, values in tables.items():
+                primary_keys = [column.name for column in model.primary_key.columns]
+                await self.saconnection.execute(upsert(model, values, primary_keys))
+        except BaseException:
+            self._buffer = rows
+            raise
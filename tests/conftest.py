@@ -3,10 +3,24 @@ from os import environ
 import aiopg
 from aiopg.sa import create_engine
 from async_generator import async_generator, yield_
+from kant.eventstore import AIOPG_BACKEND, APPEND_ONLY_LAYOUT, ASYNCPG_BACKEND
 from kant.eventstore.connection import connect
 
 import pytest
 
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+BACKENDS = [
+    AIOPG_BACKEND,
+    pytest.param(
+        ASYNCPG_BACKEND,
+        marks=pytest.mark.skipif(asyncpg is None, reason="asyncpg is not installed"),
+    ),
+]
+
 
 @pytest.fixture
 @async_generator
@@ -38,11 +52,34 @@ async def saconnection():
             await transaction.rollback()
 
 
-@pytest.fixture
+async def connect_backend(backend, dbsession):
+    if backend == AIOPG_BACKEND:
+        return await connect(pool=dbsession)
+    connection = await asyncpg.connect(
+        user=environ.get("DATABASE_USER"),
+        password=environ.get("DATABASE_PASSWORD"),
+        database=environ.get("DATABASE_DATABASE"),
+        host=environ.get("DATABASE_HOST", "localhost"),
+        port=int(environ.get("DATABASE_PORT", 5432)),
+    )
+    return await connect(pool=connection, backend=backend)
+
+
+@pytest.fixture(params=BACKENDS)
 @async_generator
-async def eventsourcing(dbsession):
-    eventstore = await connect(pool=dbsession)
+async def eventsourcing(request, dbsession):
+    eventstore = await connect_backend(request.param, dbsession)
     await eventstore.create_keyspace("event_store")
     await yield_(eventstore)
     await eventstore.drop_keyspace("event_store")
     await eventstore.close()
+
+
+@pytest.fixture(params=BACKENDS)
+@async_generator
+async def append_only_eventsourcing(request, dbsession):
+    eventstore = await connect_backend(request.param, dbsession)
+    await eventstore.create_keyspace("event_store", layout=APPEND_ONLY_LAYOUT)
+    await yield_(eventstore)
+    await eventstore.drop_keyspace("event_store")
+    await eventstore.close()
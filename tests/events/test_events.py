@@ -1,5 +1,8 @@
-from kant.events import DecimalField, Event
-from kant.exceptions import EventDoesNotExist
+import copy
+from decimal import Decimal
+
+from kant.events import CharField, DecimalField, Event, SchemaField, SchemaModel
+from kant.exceptions import EventDoesNotExist, EventTypeCollision
 
 import pytest
 
@@ -23,3 +26,124 @@ def test_event_should_raise_when_encode_invalid_obj():
     # act and assert
     with pytest.raises(EventDoesNotExist):
         my_event_model = Event.make(serialized)
+
+
+def test_event_should_decode_json_columns_and_schema_fields():
+    # arrange
+    class AddressSchema(SchemaModel):
+        street = CharField(json_column="street_name")
+
+    class CustomerMoved(Event):
+        id = CharField(primary_key=True, json_column="customer_id")
+        address = SchemaField(to=AddressSchema)
+
+    serialized = {
+        "$type": "CustomerMoved",
+        "$version": 1,
+        "customer_id": "1",
+        "address": {"street_name": "Main Street"},
+    }
+    # act
+    my_event_model = Event.make(serialized)
+    # assert
+    assert my_event_model.id == "1"
+    assert my_event_model.address.street == "Main Street"
+    assert my_event_model.decode() == serialized
+    assert my_event_model.primary_keys() == {"customer_id": "1"}
+
+
+def test_event_should_encode_obj_of_nested_subclass():
+    # arrange
+    class AccountEvent(Event):
+        account_id = CharField()
+
+    class AccountClosed(AccountEvent):
+        reason = CharField()
+
+    serialized = {"$type": "AccountClosed", "account_id": "1", "reason": "moved"}
+    # act
+    my_event_model = Event.make(serialized)
+    # assert
+    assert isinstance(my_event_model, AccountClosed), type(my_event_model)
+    assert my_event_model.account_id == "1"
+    assert my_event_model.reason == "moved"
+    assert serialized["$type"] == "AccountClosed"
+
+
+def test_event_should_encode_obj_with_namespace_and_aliases():
+    # arrange
+    class BankEvent(Event):
+        __namespace__ = "bank"
+
+    class TransferSent(BankEvent):
+        __aliases__ = ["MoneySent"]
+        amount = DecimalField()
+
+    # act
+    my_event_model = Event.make({"$type": "bank.TransferSent", "amount": 20})
+    my_old_event_model = Event.make({"$type": "MoneySent", "amount": 10})
+    # assert
+    assert isinstance(my_event_model, TransferSent)
+    assert isinstance(my_old_event_model, TransferSent)
+    assert my_event_model.decode()["$type"] == "bank.TransferSent"
+
+
+def test_event_should_raise_when_event_type_is_registered_twice():
+    # arrange
+    class PaymentRefunded(Event):
+        amount = DecimalField()
+
+    # act and assert
+    with pytest.raises(EventTypeCollision):
+
+        class RefundIssued(Event):
+            __event_type__ = "PaymentRefunded"
+            amount = DecimalField()
+
+    assert Event.make({"$type": "PaymentRefunded"}).__class__ is PaymentRefunded
+
+
+def test_event_should_resolve_dependencies_to_namespaced_types():
+    # arrange
+    class LoanEvent(Event):
+        __namespace__ = "loan"
+
+    class LoanRequested(LoanEvent):
+        pass
+
+    class LoanGranted(LoanEvent):
+        __dependencies__ = ["LoanRequested"]
+
+    # act
+    dependencies = LoanGranted.get_dependencies()
+    # assert
+    assert dependencies == ["loan.LoanRequested"]
+
+
+def test_event_should_store_compact_event_in_slots():
+    # arrange
+    class CompactDepositPerformed(Event):
+        __compact__ = True
+        id = CharField(primary_key=True)
+        amount = DecimalField()
+
+    serialized = {"$type": "CompactDepositPerformed", "$version": 2, "id": "1"}
+    # act
+    my_event_model = Event.make(serialized)
+    my_event_model.amount = 20
+    my_event_model["id"] = 2
+    # assert
+    assert not hasattr(my_event_model, "__dict__")
+    assert my_event_model.version == 2
+    assert my_event_model.amount == Decimal(20)
+    assert dict(my_event_model) == {"version": 2, "id": "2", "amount": Decimal(20)}
+    assert my_event_model.decode() == {
+        "$type": "CompactDepositPerformed",
+        "$version": 2,
+        "id": "2",
+        "amount": 20.0,
+    }
+    assert my_event_model.primary_keys() == {"id": "2"}
+    del my_event_model["amount"]
+    assert "amount" not in my_event_model
+    assert copy.deepcopy(my_event_model).decode() == my_event_model.decode()
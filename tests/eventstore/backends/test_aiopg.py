@@ -1,8 +1,42 @@
+import asyncio
+import json
+from os import environ
+
+import aiopg
+import psycopg2
+from kant import events
+from kant.eventstore import (
+    APPEND_ONLY_LAYOUT,
+    MSGPACK_SERIALIZER,
+    EventStream,
+    Snapshot,
+)
 from kant.eventstore.backends.aiopg import EventStoreConnection
+from kant.eventstore.outbox import OutboxWorker
+from kant.exceptions import (
+    IntegrityError,
+    LayoutError,
+    SerializerError,
+    VersionConflict,
+)
 
 import pytest
 
 
+class AccountCreated(events.Event):
+    __empty_stream__ = True
+
+    owner = events.CharField()
+
+
+class OwnerChanged(events.Event):
+    new_owner = events.CharField()
+
+
+class OwnerConfirmed(events.Event):
+    __dependencies__ = ["AccountCreated"]
+
+
 @pytest.mark.asyncio
 async def test_create_table_should_create_table_if_not_exists(dbsession):
     # arrange
@@ -46,3 +80,623 @@ async def test_drop_table_should_drop_table_if_exists(dbsession):
         )
         (exists,) = await cursor.fetchone()
         assert not exists
+
+
+@pytest.mark.asyncio
+async def test_migrate_keyspace_should_store_one_row_per_event(dbsession):
+    # arrange
+    settings = {"pool": dbsession}
+    connection = await EventStoreConnection.create(settings)
+    await connection.create_keyspace("event_store")
+    async with dbsession.cursor() as cursor:
+        await cursor.execute(
+            """
+        INSERT INTO event_store (id, data, created_at, updated_at)
+        VALUES (%(id)s, %(data)s, NOW(), NOW())
+        """,
+            {
+                "id": "1",
+                "data": json.dumps(
+                    [
+                        {"$type": "DepositPerformed", "$version": 1, "amount": 20},
+                        {"$type": "AccountCreated", "$version": 0, "owner": "John"},
+                    ]
+                ),
+            },
+        )
+    # act
+    await connection.migrate_keyspace("event_store", APPEND_ONLY_LAYOUT)
+    # assert
+    async with dbsession.cursor() as cursor:
+        await cursor.execute(
+            """
+        SELECT stream_id, version, data FROM event_store ORDER BY version
+        """
+        )
+        events = await cursor.fetchall()
+        assert len(events) == 2
+        assert events[0][0] == "1"
+        assert events[0][1] == 0
+        assert events[0][2]["$type"] == "AccountCreated"
+        assert events[1][1] == 1
+        assert events[1][2]["$type"] == "DepositPerformed"
+    await connection.drop_keyspace("event_store")
+
+
+@pytest.mark.asyncio
+async def test_connection_should_acquire_one_connection_per_open():
+    # arrange
+    settings = {
+        "user": environ.get("DATABASE_USER"),
+        "password": environ.get("DATABASE_PASSWORD"),
+        "database": environ.get("DATABASE_DATABASE"),
+        "host": environ.get("DATABASE_HOST", "localhost"),
+        "port": environ.get("DATABASE_PORT", 5432),
+        "minsize": 2,
+        "maxsize": 2,
+    }
+    connection = await EventStoreConnection.create(settings)
+    await connection.create_keyspace("event_store")
+
+    async def get_backend_pid():
+        async with connection.open("event_store") as eventstore:
+            await eventstore.cursor.execute("SELECT pg_backend_pid(), pg_sleep(0.1)")
+            (backend_pid, _) = await eventstore.cursor.fetchone()
+            return backend_pid
+
+    # act
+    backend_pids = await asyncio.gather(get_backend_pid(), get_backend_pid())
+    # assert
+    assert backend_pids[0] != backend_pids[1]
+    await connection.drop_keyspace("event_store")
+    await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_msgpack_keyspace_should_store_events_as_bytea(dbsession):
+    # arrange
+    settings = {"pool": dbsession}
+    connection = await EventStoreConnection.create(settings)
+    await connection.create_keyspace(
+        "event_store", APPEND_ONLY_LAYOUT, serializer=MSGPACK_SERIALIZER
+    )
+    events = EventStream(
+        [AccountCreated(owner="John Doe"), OwnerChanged(new_owner="Jane Doe")]
+    )
+    # act
+    async with connection.open("event_store") as eventstore:
+        await eventstore.append_to_stream("1", events)
+    reader = await EventStoreConnection.create(settings)
+    async with reader.open("event_store") as eventstore:
+        stored_events = await eventstore.get_stream("1")
+        new_events = EventStream(initial_version=stored_events.current_version)
+        new_events.add(OwnerChanged(new_owner="John"))
+        await eventstore.append_to_stream("1", new_events)
+        stored_events = await eventstore.get_stream("1")
+        all_streams = [stream async for stream in eventstore.all_streams()]
+    # assert
+    assert [event.version for event in stored_events] == [0, 1, 2]
+    assert [event.new_owner for event in list(stored_events)[1:]] == [
+        "Jane Doe",
+        "John",
+    ]
+    assert len(list(all_streams[0])) == 3
+    async with dbsession.cursor() as cursor:
+        await cursor.execute("SELECT pg_typeof(data)::text FROM event_store LIMIT 1")
+        (column_type,) = await cursor.fetchone()
+        assert column_type == "bytea"
+    await connection.drop_keyspace("event_store")
+
+
+@pytest.mark.asyncio
+async def test_document_keyspace_should_not_accept_binary_serializer(dbsession):
+    # arrange
+    settings = {"pool": dbsession}
+    connection = await EventStoreConnection.create(settings)
+    # act and assert
+    with pytest.raises(SerializerError):
+        await connection.create_keyspace("event_store", serializer=MSGPACK_SERIALIZER)
+
+
+class RecordingAdapter:
+
+    def __init__(self):
+        self.notifications = []
+
+    async def handle_create(self, keyspace, stream, eventstream):
+        self.notifications.append(("create", stream, eventstream))
+
+    async def handle_update(self, keyspace, stream, eventstream):
+        self.notifications.append(("update", stream, eventstream))
+
+
+@pytest.mark.asyncio
+async def test_outbox_worker_should_deliver_appended_events(dbsession):
+    # arrange
+    connection = await EventStoreConnection.create({"pool": dbsession, "outbox": True})
+    await connection.create_keyspace("event_store", APPEND_ONLY_LAYOUT)
+    adapter = RecordingAdapter()
+    connection.projections.bind(adapter)
+    worker = OutboxWorker(connection, name="test")
+    async with connection.open("event_store") as eventstore:
+        await eventstore.append_to_stream(
+            "1", EventStream([AccountCreated(owner="John Doe")])
+        )
+        new_events = EventStream(initial_version=0)
+        new_events.add(OwnerChanged(new_owner="Jane Doe"))
+        await eventstore.append_to_stream("1", new_events)
+    assert adapter.notifications == []
+    assert (await worker.lag())["pending"] == 2
+    # act
+    delivered = await worker.drain()
+    # assert
+    assert delivered == 2
+    assert [(kind, stream) for kind, stream, _ in adapter.notifications] == [
+        ("create", "1"),
+        ("update", "1"),
+    ]
+    updated = adapter.notifications[1][2]
+    assert updated.initial_version == 0
+    assert [event.new_owner for event in updated] == ["Jane Doe"]
+    lag = await worker.lag()
+    assert lag["pending"] == 0
+    assert lag["processed"] == 2
+    async with dbsession.cursor() as cursor:
+        await cursor.execute(
+            "SELECT position, processed FROM kant_outbox_checkpoints "
+            "WHERE worker = 'test'"
+        )
+        (position, processed) = await cursor.fetchone()
+        assert position == worker.checkpoint
+        assert processed == 2
+        await cursor.execute("DROP TABLE kant_outbox, kant_outbox_checkpoints")
+    await connection.drop_keyspace("event_store")
+
+
+@pytest.mark.asyncio
+async def test_outbox_worker_should_skip_streams_delivered_by_other_workers(
+    dbsession
+):
+    # arrange
+    connection = await EventStoreConnection.create({"pool": dbsession, "outbox": True})
+    await connection.create_keyspace("event_store", APPEND_ONLY_LAYOUT)
+    adapter = RecordingAdapter()
+    connection.projections.bind(adapter)
+    worker = OutboxWorker(connection, name="test")
+    async with connection.open("event_store") as eventstore:
+        await eventstore.append_to_stream(
+            "1", EventStream([AccountCreated(owner="John Doe"), OwnerConfirmed()])
+        )
+        # the entry of an append of the dependent event alone
+        await eventstore._record([("1", 0, 1)])
+        await eventstore.append_to_stream(
+            "2", EventStream([AccountCreated(owner="Jane Doe")])
+        )
+    other_worker = await aiopg.connect(
+        user=environ.get("DATABASE_USER"),
+        password=environ.get("DATABASE_PASSWORD"),
+        database=environ.get("DATABASE_DATABASE"),
+        host=environ.get("DATABASE_HOST", "localhost"),
+        port=environ.get("DATABASE_PORT", 5432),
+    )
+    # act
+    async with other_worker.cursor() as cursor:
+        await cursor.execute("BEGIN")
+        await cursor.execute(
+            "SELECT 1 FROM kant_outbox WHERE stream_id = '1' "
+            "ORDER BY position LIMIT 1 FOR UPDATE"
+        )
+        delivered_while_locked = await worker.drain()
+        await cursor.execute("ROLLBACK")
+    other_worker.close()
+    delivered = await worker.drain()
+    # assert
+    assert delivered_while_locked == 1
+    assert delivered == 2
+    assert [(kind, stream) for kind, stream, _ in adapter.notifications] == [
+        ("create", "2"),
+        ("create", "1"),
+        ("update", "1"),
+    ]
+    updated = adapter.notifications[2][2]
+    assert [event.version for event in updated] == [1]
+    async with dbsession.cursor() as cursor:
+        await cursor.execute("DROP TABLE kant_outbox, kant_outbox_checkpoints")
+    await connection.drop_keyspace("event_store")
+
+
+@pytest.mark.asyncio
+async def test_subscribe_should_catch_up_and_follow_appends():
+    # arrange
+    settings = {
+        "user": environ.get("DATABASE_USER"),
+        "password": environ.get("DATABASE_PASSWORD"),
+        "database": environ.get("DATABASE_DATABASE"),
+        "host": environ.get("DATABASE_HOST", "localhost"),
+        "port": environ.get("DATABASE_PORT", 5432),
+        "minsize": 2,
+        "maxsize": 2,
+    }
+    connection = await EventStoreConnection.create(settings)
+    await connection.create_keyspace("event_store", APPEND_ONLY_LAYOUT)
+    async with connection.open("event_store") as eventstore:
+        for stream in ("1", "2", "3"):
+            await eventstore.append_to_stream(
+                stream, EventStream([AccountCreated(owner="John Doe")])
+            )
+    received = []
+
+    async def follow():
+        async with connection.open("event_store") as eventstore:
+            subscription = eventstore.subscribe(from_position=2, fetch_size=1)
+            while len(received) < 3:
+                received.append(await subscription.__anext__())
+            await subscription.aclose()
+
+    # act
+    follower = asyncio.ensure_future(follow())
+    await asyncio.sleep(0.2)
+    async with connection.open("event_store") as eventstore:
+        new_events = EventStream(initial_version=0)
+        new_events.add(OwnerChanged(new_owner="Jane Doe"))
+        await eventstore.append_to_stream("1", new_events)
+    await asyncio.wait_for(follower, 5)
+    # assert
+    assert [(recorded.position, recorded.stream) for recorded in received] == [
+        (2, "2"),
+        (3, "3"),
+        (4, "1"),
+    ]
+    assert received[2].event.new_owner == "Jane Doe"
+    assert received[2].event.version == 1
+    await connection.drop_keyspace("event_store")
+    await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_document_keyspace_should_not_subscribe(dbsession):
+    # arrange
+    connection = await EventStoreConnection.create({"pool": dbsession})
+    await connection.create_keyspace("event_store")
+    # act
+    async with connection.open("event_store") as eventstore:
+        with pytest.raises(LayoutError):
+            await eventstore.subscribe().__anext__()
+    # assert
+    await connection.drop_keyspace("event_store")
+
+
+@pytest.mark.asyncio
+async def test_create_keyspace_should_partition_by_stream_id(dbsession):
+    # arrange
+    connection = await EventStoreConnection.create({"pool": dbsession})
+    # act
+    await connection.create_keyspace("event_store", APPEND_ONLY_LAYOUT, partitions=4)
+    async with connection.open("event_store") as eventstore:
+        for stream in ("1", "2", "3", "4", "5"):
+            await eventstore.append_to_stream(
+                stream, EventStream([AccountCreated(owner="John Doe")])
+            )
+        stored_events = await eventstore.get_stream("3")
+    # assert
+    async with dbsession.cursor() as cursor:
+        await cursor.execute(
+            "SELECT count(*) FROM pg_inherits "
+            "WHERE inhparent = 'event_store'::regclass"
+        )
+        (partitions,) = await cursor.fetchone()
+        await cursor.execute("SELECT count(*) FROM event_store_p0")
+        (rows,) = await cursor.fetchone()
+    assert partitions == 4
+    assert 0 <= rows <= 5
+    assert [event.owner for event in stored_events] == ["John Doe"]
+    await connection.drop_keyspace("event_store")
+
+
+@pytest.mark.asyncio
+async def test_upgrade_keyspace_should_add_primary_key_and_indexes(dbsession):
+    # arrange
+    async with dbsession.cursor() as cursor:
+        await cursor.execute(
+            """
+            CREATE TABLE event_store (
+                id varchar(255),
+                data jsonb NOT NULL,
+                created_at timestamp NOT NULL,
+                updated_at timestamp NOT NULL,
+                version bigserial NOT NULL
+            );
+            CREATE TABLE event_store_log (
+                stream_id varchar(255) NOT NULL,
+                version bigint NOT NULL,
+                data jsonb NOT NULL,
+                created_at timestamp NOT NULL,
+                CONSTRAINT event_store_log_stream_id_version_key
+                UNIQUE (stream_id, version)
+            );
+            INSERT INTO event_store_log (stream_id, version, data, created_at)
+            VALUES ('2', 0, '{"$type": "AccountCreated", "owner": "Jane"}',
+                    '2020-01-02'),
+                   ('1', 1, '{"$type": "OwnerChanged", "new_owner": "Tim"}',
+                    '2020-01-03'),
+                   ('1', 0, '{"$type": "AccountCreated", "owner": "John"}',
+                    '2020-01-01');
+            """
+        )
+    connection = await EventStoreConnection.create({"pool": dbsession})
+    await connection.create_keyspace("event_store_log", APPEND_ONLY_LAYOUT)
+    # act
+    await connection.upgrade_keyspace("event_store")
+    await connection.upgrade_keyspace("event_store_log", batch_size=2)
+    await connection.upgrade_keyspace("event_store_log")
+    async with connection.open("event_store_log") as eventstore:
+        await eventstore.append_to_stream(
+            "2", EventStream([OwnerChanged(new_owner="John")], initial_version=0)
+        )
+        subscription = eventstore.subscribe(idle_timeout=0.1)
+        recorded = [await subscription.__anext__() for _ in range(4)]
+        await subscription.aclose()
+    # assert
+    async with dbsession.cursor() as cursor:
+        await cursor.execute(
+            "SELECT conrelid::regclass::text, contype, conname FROM pg_constraint "
+            "WHERE conrelid IN ('event_store'::regclass, 'event_store_log'::regclass) "
+            "ORDER BY 1"
+        )
+        constraints = await cursor.fetchall()
+        await cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'event_store_log' "
+            "ORDER BY 1"
+        )
+        indexes = [index for (index,) in await cursor.fetchall()]
+        await cursor.execute(
+            "SELECT attnotnull FROM pg_attribute "
+            "WHERE attrelid = 'event_store_log'::regclass AND attname = 'position'"
+        )
+        (not_null,) = await cursor.fetchone()
+        await cursor.execute("DROP TABLE event_store")
+    await connection.drop_keyspace("event_store_log")
+    assert constraints == [
+        ("event_store", "p", "event_store_pkey"),
+        ("event_store_log", "p", "event_store_log_pkey"),
+    ]
+    assert indexes == ["event_store_log_pkey", "event_store_log_position_idx"]
+    assert not_null
+    assert [(event.position, event.stream) for event in recorded] == [
+        (1, "1"),
+        (2, "2"),
+        (3, "1"),
+        (4, "2"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_upgrade_keyspace_should_report_duplicate_primary_keys(dbsession):
+    # arrange
+    async with dbsession.cursor() as cursor:
+        await cursor.execute(
+            """
+            CREATE TABLE event_store (
+                id varchar(255),
+                data jsonb NOT NULL,
+                created_at timestamp NOT NULL,
+                updated_at timestamp NOT NULL,
+                version bigserial NOT NULL
+            );
+            INSERT INTO event_store (id, data, created_at, updated_at)
+            VALUES ('1', '[]', NOW(), NOW()), ('1', '[]', NOW(), NOW());
+            """
+        )
+        # a failed build leaves an invalid index
+        with pytest.raises(psycopg2.IntegrityError):
+            await cursor.execute(
+                "CREATE UNIQUE INDEX CONCURRENTLY event_store_pkey ON event_store (id)"
+            )
+    connection = await EventStoreConnection.create({"pool": dbsession})
+    # act
+    with pytest.raises(IntegrityError) as e:
+        await connection.upgrade_keyspace("event_store")
+    async with dbsession.cursor() as cursor:
+        await cursor.execute("DELETE FROM event_store WHERE version = 2")
+    await connection.upgrade_keyspace("event_store")
+    # assert
+    async with dbsession.cursor() as cursor:
+        await cursor.execute(
+            "SELECT contype, conname FROM pg_constraint "
+            "WHERE conrelid = 'event_store'::regclass"
+        )
+        constraints = await cursor.fetchall()
+        await cursor.execute("DROP TABLE event_store")
+    assert "[('1',)]" in str(e.value)
+    assert constraints == [("p", "event_store_pkey")]
+
+
+@pytest.mark.asyncio
+async def test_keyspace_should_be_read_again_when_migrated_by_other_connection(
+    dbsession
+):
+    # arrange
+    connection = await EventStoreConnection.create({"pool": dbsession})
+    other_connection = await EventStoreConnection.create({"pool": dbsession})
+    await other_connection.create_keyspace("event_store")
+    async with connection.open("event_store") as eventstore:
+        await eventstore.append_to_stream(
+            "1", EventStream([AccountCreated(owner="John Doe")])
+        )
+    await other_connection.migrate_keyspace("event_store", APPEND_ONLY_LAYOUT)
+    # act
+    with pytest.raises(psycopg2.ProgrammingError):
+        async with connection.open("event_store") as eventstore:
+            await eventstore.get_stream("1")
+    async with connection.open("event_store") as eventstore:
+        stored_events = await eventstore.get_stream("1")
+    # assert
+    await other_connection.drop_keyspace("event_store")
+    assert [event.owner for event in stored_events] == ["John Doe"]
+
+
+@pytest.mark.asyncio
+async def test_eventstore_should_prepare_statements_once_per_connection(dbsession):
+    # arrange
+    connection = await EventStoreConnection.create({"pool": dbsession})
+    await connection.create_keyspace("event_store", APPEND_ONLY_LAYOUT)
+    async with connection.open("event_store") as eventstore:
+        await eventstore.append_to_stream(
+            "1", EventStream([AccountCreated(owner="John Doe")])
+        )
+    stats = connection.statements.stats()
+    # act
+    for _ in range(3):
+        async with connection.open("event_store") as eventstore:
+            stored_events = await eventstore.get_stream("1")
+    # assert
+    async with dbsession.cursor() as cursor:
+        await cursor.execute(
+            "SELECT count(*) FROM pg_prepared_statements WHERE name LIKE 'kant_%%'"
+        )
+        (prepared,) = await cursor.fetchone()
+    await connection.drop_keyspace("event_store")
+    assert stored_events.current_version == 0
+    assert connection.statements.prepares - stats["prepares"] == 1
+    assert connection.statements.executes - stats["executes"] == 3
+    assert prepared == connection.statements.prepares
+
+
+@pytest.mark.asyncio
+async def test_append_to_streams_should_report_streams_created_concurrently():
+    # arrange
+    settings = {
+        "user": environ.get("DATABASE_USER"),
+        "password": environ.get("DATABASE_PASSWORD"),
+        "database": environ.get("DATABASE_DATABASE"),
+        "host": environ.get("DATABASE_HOST", "localhost"),
+        "port": environ.get("DATABASE_PORT", 5432),
+        "minsize": 2,
+        "maxsize": 2,
+    }
+    connection = await EventStoreConnection.create(settings)
+    await connection.create_keyspace("event_store")
+
+    async def create_stream(stream):
+        async with connection.open("event_store") as eventstore:
+            await eventstore.append_to_stream(
+                stream, EventStream([AccountCreated(owner="Jane Doe")])
+            )
+
+    # act
+    created = []
+    async with connection.open("event_store") as eventstore:
+        execute = eventstore.cursor.execute
+
+        async def execute_after_concurrent_create(query, *args, **kwargs):
+            if "INSERT INTO" in query and not created:
+                created.append("2")
+                await create_stream("2")
+            return await execute(query, *args, **kwargs)
+
+        eventstore.cursor.execute = execute_after_concurrent_create
+        with pytest.raises(VersionConflict) as e:
+            await eventstore.append_to_streams(
+                {
+                    "1": EventStream([AccountCreated(owner="John Doe")]),
+                    "2": EventStream([AccountCreated(owner="John Doe")]),
+                }
+            )
+        eventstore.cursor.execute = execute
+        stored_events = await eventstore.get_stream("2")
+    # assert
+    assert e.value.streams == ["2"]
+    assert list(stored_events)[0].owner == "Jane Doe"
+    await connection.drop_keyspace("event_store")
+    await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_keyspace_should_accept_name_to_be_quoted(dbsession):
+    # arrange
+    connection = await EventStoreConnection.create({"pool": dbsession})
+    await connection.create_keyspace("event-store", partitions=2)
+    # act
+    async with connection.open("event-store") as eventstore:
+        await eventstore.append_to_stream(
+            "1", EventStream([AccountCreated(owner="John Doe")])
+        )
+        await eventstore.append_to_streams(
+            {
+                "1": EventStream([OwnerChanged(new_owner="Jane Doe")]),
+                "2": EventStream([AccountCreated(owner="Tim Clock")]),
+            }
+        )
+        await eventstore.save_snapshot("1", Snapshot(version=1, data={"id": "1"}))
+        snapshot = await eventstore.get_snapshot("1")
+    await connection.migrate_keyspace("event-store", APPEND_ONLY_LAYOUT)
+    await connection.upgrade_keyspace("event-store")
+    async with connection.open("event-store") as eventstore:
+        await eventstore.append_to_stream(
+            "2", EventStream([OwnerChanged(new_owner="Jane Doe")])
+        )
+        stored_events = await eventstore.get_stream("2")
+        subscription = eventstore.subscribe()
+        recorded_event = await subscription.__anext__()
+        await subscription.aclose()
+    # assert
+    await connection.drop_keyspace("event-store")
+    assert snapshot.version == 1
+    assert [event.version for event in stored_events] == [0, 1]
+    assert recorded_event.stream == "1"
+
+
+@pytest.mark.asyncio
+async def test_eventstore_should_not_validate_appended_events_again(dbsession):
+    # arrange
+    connection = await EventStoreConnection.create({"pool": dbsession})
+    await connection.create_keyspace("event_store")
+    event = OwnerConfirmed(version=1)
+    # act
+    async with connection.open("event_store") as eventstore:
+        appended = eventstore._appended(0, [event])
+    # assert
+    await connection.drop_keyspace("event_store")
+    assert list(appended) == [event]
+    assert (appended.initial_version, appended.current_version) == (0, 1)
+
+
+@pytest.mark.asyncio
+async def test_append_to_streams_should_accept_keyspace_without_primary_key(
+    dbsession
+):
+    # arrange
+    async with dbsession.cursor() as cursor:
+        await cursor.execute(
+            """
+            CREATE TABLE event_store (
+                id varchar(255),
+                data jsonb NOT NULL,
+                created_at timestamp NOT NULL,
+                updated_at timestamp NOT NULL,
+                version bigserial NOT NULL
+            )
+            """
+        )
+    connection = await EventStoreConnection.create({"pool": dbsession})
+    await connection.create_keyspace("event_store")
+    # act
+    async with connection.open("event_store") as eventstore:
+        await eventstore.append_to_stream(
+            "1", EventStream([AccountCreated(owner="John Doe")])
+        )
+        await eventstore.append_to_streams(
+            {
+                "1": EventStream([OwnerChanged(new_owner="Jane Doe")]),
+                "2": EventStream([AccountCreated(owner="Tim Clock")]),
+            }
+        )
+        with pytest.raises(VersionConflict) as e:
+            await eventstore.append_to_streams(
+                {"2": EventStream([AccountCreated(owner="Tim Clock")])}
+            )
+        stored_events = await eventstore.get_stream("1")
+    # assert
+    await connection.drop_keyspace("event_store")
+    assert e.value.streams == ["2"]
+    assert [event.version for event in stored_events] == [0, 1]
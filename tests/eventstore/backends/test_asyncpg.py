@@ -0,0 +1,133 @@
+import asyncio
+from os import environ
+
+from kant import events
+from kant.eventstore import (
+    APPEND_ONLY_LAYOUT,
+    ASYNCPG_BACKEND,
+    MSGPACK_SERIALIZER,
+    EventStream,
+    connect,
+)
+from kant.eventstore.backends.asyncpg import EventStoreConnection
+from kant.exceptions import BackendError, VersionError
+
+import pytest
+
+pytest.importorskip("asyncpg")
+
+
+class AsyncpgEvent(events.Event):
+    __namespace__ = "asyncpg"
+
+
+class AccountCreated(AsyncpgEvent):
+    __empty_stream__ = True
+
+    owner = events.CharField()
+
+
+class OwnerChanged(AsyncpgEvent):
+    new_owner = events.CharField()
+
+
+def get_settings(**settings):
+    return dict(
+        {
+            "user": environ.get("DATABASE_USER"),
+            "password": environ.get("DATABASE_PASSWORD"),
+            "database": environ.get("DATABASE_DATABASE"),
+            "host": environ.get("DATABASE_HOST", "localhost"),
+            "port": environ.get("DATABASE_PORT", 5432),
+        },
+        **settings
+    )
+
+
+@pytest.mark.asyncio
+async def test_connect_should_create_asyncpg_pool():
+    # arrange
+    settings = get_settings(minsize=2, maxsize=2)
+    # act
+    connection = await connect(backend=ASYNCPG_BACKEND, **settings)
+    await connection.create_keyspace("event_store")
+    async with connection.open("event_store") as eventstore:
+        await eventstore.append_to_stream(
+            "1", EventStream([AccountCreated(owner="John Doe")])
+        )
+        stored_events = await eventstore.get_stream("1")
+        stale_events = EventStream(initial_version=-1)
+        stale_events.add(OwnerChanged(new_owner="Jane Doe"))
+        with pytest.raises(VersionError):
+            await eventstore.append_to_stream("1", stale_events)
+    # assert
+    assert isinstance(connection, EventStoreConnection)
+    assert connection.pool.get_size() == 2
+    assert list(stored_events)[0].owner == "John Doe"
+    await connection.drop_keyspace("event_store")
+    await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_connect_should_not_accept_unknown_backend():
+    # act and assert
+    with pytest.raises(BackendError):
+        await connect(backend="sqlite")
+
+
+@pytest.mark.asyncio
+async def test_msgpack_keyspace_should_store_events_as_bytea():
+    # arrange
+    connection = await EventStoreConnection.create(get_settings())
+    await connection.create_keyspace(
+        "event_store", APPEND_ONLY_LAYOUT, serializer=MSGPACK_SERIALIZER
+    )
+    events = EventStream(
+        [AccountCreated(owner="John Doe"), OwnerChanged(new_owner="Jane Doe")]
+    )
+    # act
+    async with connection.open("event_store") as eventstore:
+        await eventstore.append_to_stream("1", events)
+        stored_events = await eventstore.get_stream("1")
+        all_streams = [stream async for stream in eventstore.all_streams()]
+    # assert
+    assert [event.version for event in stored_events] == [0, 1]
+    assert list(stored_events)[1].new_owner == "Jane Doe"
+    assert len(list(all_streams[0])) == 2
+    await connection.drop_keyspace("event_store")
+    await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_subscribe_should_follow_appends():
+    # arrange
+    connection = await EventStoreConnection.create(get_settings(maxsize=2))
+    await connection.create_keyspace("event_store", APPEND_ONLY_LAYOUT)
+    async with connection.open("event_store") as eventstore:
+        await eventstore.append_to_stream(
+            "1", EventStream([AccountCreated(owner="John Doe")])
+        )
+    received = []
+
+    async def follow():
+        async with connection.open("event_store") as eventstore:
+            subscription = eventstore.subscribe()
+            while len(received) < 2:
+                received.append(await subscription.__anext__())
+            await subscription.aclose()
+
+    # act
+    follower = asyncio.ensure_future(follow())
+    await asyncio.sleep(0.2)
+    async with connection.open("event_store") as eventstore:
+        await eventstore.append_to_stream(
+            "2", EventStream([AccountCreated(owner="Jane Doe")])
+        )
+    await asyncio.wait_for(follower, 5)
+    # assert
+    assert [(recorded.position, recorded.stream) for recorded in received] == [
+        (1, "1"),
+        (2, "2"),
+    ]
+    await connection.drop_keyspace("event_store")
+    await connection.close()
@@ -6,7 +6,7 @@ from os import environ
 from kant import events
 from kant.aggregates import Aggregate
 from kant.eventstore.stream import EventStream
-from kant.exceptions import StreamDoesNotExist, VersionError
+from kant.exceptions import StreamDoesNotExist, VersionConflict, VersionError
 
 import pytest
 
@@ -26,6 +26,12 @@ class WithdrawalPerformed(events.Event):
     amount = events.DecimalField()
 
 
+class OverdraftGranted(events.Event):
+    __dependencies__ = ["BankAccountCreated"]
+
+    limit = events.DecimalField()
+
+
 class MyObjectCreated(events.Event):
     id = events.CUIDField(primary_key=True)
     owner = events.CharField()
@@ -195,3 +201,386 @@ async def test_eventstore_should_raise_version_error(dbsession, eventsourcing):
     with pytest.raises(VersionError):
         async with eventsourcing.open("event_store") as eventstore:
             await eventstore.append_to_stream(aggregate_id, events)
+
+
+@pytest.mark.asyncio
+async def test_append_only_keyspace_should_store_one_row_per_event(
+    dbsession, append_only_eventsourcing
+):
+    # arrange
+    aggregate_id = "052c21b6-aab9-4311-b954-518cd04f704c"
+    events = EventStream(
+        [
+            BankAccountCreated(id=aggregate_id, owner="John Doe"),
+            DepositPerformed(amount=20),
+        ]
+    )
+    # act
+    async with append_only_eventsourcing.open("event_store") as eventstore:
+        await eventstore.append_to_stream(aggregate_id, events)
+    # assert
+    async with dbsession.cursor() as cursor:
+        stmt = """
+        SELECT event_store.stream_id, event_store.version, event_store.data
+        FROM event_store WHERE event_store.stream_id = %(id)s
+        ORDER BY event_store.version
+        """
+        await cursor.execute(stmt, {"id": aggregate_id})
+        event_store = await cursor.fetchall()
+        assert len(event_store) == 2
+        assert event_store[0][0] == aggregate_id
+        assert event_store[0][1] == 0
+        assert event_store[0][2]["$type"] == "BankAccountCreated"
+        assert event_store[0][2]["owner"] == "John Doe"
+        assert event_store[1][1] == 1
+        assert event_store[1][2]["$type"] == "DepositPerformed"
+        assert event_store[1][2]["amount"] == 20
+
+
+@pytest.mark.asyncio
+async def test_append_only_keyspace_should_append_new_events(
+    append_only_eventsourcing
+):
+    # arrange
+    aggregate_id = "052c21b6-aab9-4311-b954-518cd04f704c"
+    events_base = EventStream([BankAccountCreated(id=aggregate_id, owner="John Doe")])
+    events = EventStream([DepositPerformed(amount=20), WithdrawalPerformed(amount=5)])
+    # act
+    async with append_only_eventsourcing.open("event_store") as eventstore:
+        await eventstore.append_to_stream(aggregate_id, events_base)
+        await eventstore.append_to_stream(aggregate_id, events)
+        stored_events = await eventstore.get_stream(aggregate_id)
+    # assert
+    stored_events = list(stored_events)
+    assert len(stored_events) == 3
+    assert isinstance(stored_events[0], BankAccountCreated)
+    assert stored_events[0].version == 0
+    assert isinstance(stored_events[1], DepositPerformed)
+    assert stored_events[1].version == 1
+    assert stored_events[1].amount == 20
+    assert isinstance(stored_events[2], WithdrawalPerformed)
+    assert stored_events[2].version == 2
+    assert stored_events[2].amount == 5
+
+
+@pytest.mark.asyncio
+async def test_append_only_keyspace_should_raise_version_error(
+    append_only_eventsourcing
+):
+    # arrange
+    aggregate_id = "f2283f9d-9ed2-4385-a614-53805725cbac"
+    events_base = EventStream(
+        [
+            BankAccountCreated(id=aggregate_id, owner="John Doe"),
+            DepositPerformed(amount=20),
+        ]
+    )
+    events = EventStream([DepositPerformed(amount=20)])
+    async with append_only_eventsourcing.open("event_store") as eventstore:
+        await eventstore.append_to_stream(aggregate_id, events_base)
+        # act and assert
+        with pytest.raises(VersionError):
+            await eventstore.append_to_stream(aggregate_id, events)
+
+
+@pytest.mark.asyncio
+async def test_eventstore_should_fetch_stream_from_version(eventsourcing):
+    # arrange
+    aggregate_id = "f2283f9d-9ed2-4385-a614-53805725cbac"
+    events = EventStream(
+        [
+            BankAccountCreated(id=aggregate_id, owner="John Doe"),
+            DepositPerformed(amount=10),
+            DepositPerformed(amount=20),
+            WithdrawalPerformed(amount=5),
+        ]
+    )
+    async with eventsourcing.open("event_store") as eventstore:
+        await eventstore.append_to_stream(aggregate_id, events)
+        # act
+        stored_events = await eventstore.get_stream(aggregate_id, start=2)
+    # assert
+    stored_events = list(stored_events)
+    assert len(stored_events) == 2
+    assert stored_events[0].version == 2
+    assert stored_events[0].amount == 20
+    assert stored_events[1].version == 3
+    assert isinstance(stored_events[1], WithdrawalPerformed)
+
+
+@pytest.mark.asyncio
+async def test_eventstore_should_fetch_version_range(eventsourcing):
+    # arrange
+    aggregate_id = "f2283f9d-9ed2-4385-a614-53805725cbac"
+    events = EventStream(
+        [
+            BankAccountCreated(id=aggregate_id, owner="John Doe"),
+            DepositPerformed(amount=10),
+            DepositPerformed(amount=20),
+            WithdrawalPerformed(amount=5),
+        ]
+    )
+    async with eventsourcing.open("event_store") as eventstore:
+        await eventstore.append_to_stream(aggregate_id, events)
+        # act
+        stored_events = await eventstore.get_stream(aggregate_id, start=1, end=3)
+    # assert
+    assert [event.version for event in stored_events] == [1, 2]
+    assert stored_events.current_version == 2
+
+
+@pytest.mark.asyncio
+async def test_eventstore_should_fetch_last_events_backward(eventsourcing):
+    # arrange
+    aggregate_id = "f2283f9d-9ed2-4385-a614-53805725cbac"
+    events = EventStream(
+        [
+            BankAccountCreated(id=aggregate_id, owner="John Doe"),
+            DepositPerformed(amount=10),
+            DepositPerformed(amount=20),
+            WithdrawalPerformed(amount=5),
+        ]
+    )
+    async with eventsourcing.open("event_store") as eventstore:
+        await eventstore.append_to_stream(aggregate_id, events)
+        # act
+        stored_events = await eventstore.get_stream(
+            aggregate_id, backward=True, limit=2
+        )
+        empty_events = await eventstore.get_stream(aggregate_id, start=4)
+    # assert
+    assert [event.version for event in stored_events] == [2, 3]
+    assert stored_events.current_version == 3
+    assert len(empty_events) == 0
+    assert empty_events.current_version == 3
+
+
+@pytest.mark.asyncio
+async def test_eventstore_should_fetch_slice_with_dependent_events(eventsourcing):
+    # arrange
+    aggregate_id = "f2283f9d-9ed2-4385-a614-53805725cbac"
+    events = EventStream(
+        [
+            BankAccountCreated(id=aggregate_id, owner="John Doe"),
+            OverdraftGranted(limit=12),
+        ]
+    )
+    async with eventsourcing.open("event_store") as eventstore:
+        await eventstore.append_to_stream(aggregate_id, events)
+        # act
+        stored_events = await eventstore.get_stream(aggregate_id, start=1)
+        last_events = await eventstore.get_stream(
+            aggregate_id, backward=True, limit=1
+        )
+    # assert
+    assert [event.limit for event in stored_events] == [12]
+    assert [event.version for event in last_events] == [1]
+
+
+@pytest.mark.asyncio
+async def test_append_only_keyspace_should_fetch_slice_with_dependent_events(
+    append_only_eventsourcing
+):
+    # arrange
+    aggregate_id = "f2283f9d-9ed2-4385-a614-53805725cbac"
+    events = EventStream(
+        [
+            BankAccountCreated(id=aggregate_id, owner="John Doe"),
+            OverdraftGranted(limit=12),
+        ]
+    )
+    async with append_only_eventsourcing.open("event_store") as eventstore:
+        await eventstore.append_to_stream(aggregate_id, events)
+        # act
+        stored_events = await eventstore.get_stream(aggregate_id, start=1)
+        last_events = await eventstore.get_stream(
+            aggregate_id, backward=True, limit=1
+        )
+    # assert
+    assert [event.limit for event in stored_events] == [12]
+    assert [event.version for event in last_events] == [1]
+
+
+@pytest.mark.asyncio
+async def test_append_only_keyspace_should_fetch_last_events_backward(
+    append_only_eventsourcing
+):
+    # arrange
+    aggregate_id = "f2283f9d-9ed2-4385-a614-53805725cbac"
+    events = EventStream(
+        [
+            BankAccountCreated(id=aggregate_id, owner="John Doe"),
+            DepositPerformed(amount=10),
+            DepositPerformed(amount=20),
+            WithdrawalPerformed(amount=5),
+        ]
+    )
+    async with append_only_eventsourcing.open("event_store") as eventstore:
+        await eventstore.append_to_stream(aggregate_id, events)
+        # act
+        stored_events = await eventstore.get_stream(
+            aggregate_id, backward=True, limit=2
+        )
+        empty_events = await eventstore.get_stream(aggregate_id, start=4)
+    # assert
+    assert [event.version for event in stored_events] == [2, 3]
+    assert stored_events.current_version == 3
+    assert len(empty_events) == 0
+    assert empty_events.current_version == 3
+
+
+@pytest.mark.asyncio
+async def test_eventstore_should_fetch_all_streams_in_batches(eventsourcing):
+    # arrange
+    async with eventsourcing.open("event_store") as eventstore:
+        for aggregate_id in ["1", "2", "3", "4", "5"]:
+            events = EventStream([BankAccountCreated(id=aggregate_id, owner="John")])
+            await eventstore.append_to_stream(aggregate_id, events)
+        # act
+        stored_eventstreams = []
+        async for stream in eventstore.all_streams(after_id="1", fetch_size=2):
+            stored_eventstreams.append(stream)
+    # assert
+    assert [list(stream)[0].id for stream in stored_eventstreams] == [
+        "2",
+        "3",
+        "4",
+        "5",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_append_only_keyspace_should_fetch_all_streams_in_batches(
+    append_only_eventsourcing
+):
+    # arrange
+    async with append_only_eventsourcing.open("event_store") as eventstore:
+        for aggregate_id in ["1", "2", "3", "4", "5"]:
+            events = EventStream(
+                [
+                    BankAccountCreated(id=aggregate_id, owner="John"),
+                    DepositPerformed(amount=10),
+                ]
+            )
+            await eventstore.append_to_stream(aggregate_id, events)
+        # act
+        stored_eventstreams = []
+        async for stream in eventstore.all_streams(start=1, end=3, fetch_size=2):
+            stored_eventstreams.append(stream)
+    # assert
+    assert [list(stream)[0].id for stream in stored_eventstreams] == ["2", "3", "4"]
+    assert all(len(stream) == 2 for stream in stored_eventstreams)
+
+
+@pytest.mark.asyncio
+async def test_eventstore_should_append_only_new_events(dbsession, eventsourcing):
+    # arrange
+    events_base = EventStream([BankAccountCreated(id="1", owner="John Doe")])
+    new_events = EventStream(initial_version=0)
+    new_events.extend([DepositPerformed(amount=20), WithdrawalPerformed(amount=5)])
+    stale_events = EventStream(initial_version=0)
+    stale_events.add(DepositPerformed(amount=30))
+    async with eventsourcing.open("event_store") as eventstore:
+        await eventstore.append_to_stream("1", events_base)
+        # act
+        await eventstore.append_to_stream("1", new_events)
+        with pytest.raises(VersionError):
+            await eventstore.append_to_stream("1", stale_events)
+        with pytest.raises(VersionError):
+            await eventstore.append_to_stream(
+                "1", EventStream([BankAccountCreated(id="1", owner="Jane")])
+            )
+    # assert
+    async with dbsession.cursor() as cursor:
+        await cursor.execute("SELECT version, data FROM event_store WHERE id = '1'")
+        (version, data) = await cursor.fetchone()
+    assert version == 2
+    assert [event["$version"] for event in data] == [0, 1, 2]
+    assert [event["$type"] for event in data] == [
+        "BankAccountCreated",
+        "DepositPerformed",
+        "WithdrawalPerformed",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_eventstore_should_append_to_many_streams(eventsourcing):
+    # arrange
+    events_base = EventStream([BankAccountCreated(id="1", owner="John Doe")])
+    async with eventsourcing.open("event_store") as eventstore:
+        await eventstore.append_to_stream("1", events_base)
+        # act
+        await eventstore.append_to_streams(
+            {
+                "1": EventStream([DepositPerformed(amount=20)]),
+                "2": EventStream([BankAccountCreated(id="2", owner="Tim Clock")]),
+            }
+        )
+        stored_events_1 = list(await eventstore.get_stream("1"))
+        stored_events_2 = list(await eventstore.get_stream("2"))
+    # assert
+    assert len(stored_events_1) == 2
+    assert stored_events_1[1].version == 1
+    assert stored_events_1[1].amount == 20
+    assert len(stored_events_2) == 1
+    assert stored_events_2[0].owner == "Tim Clock"
+
+
+@pytest.mark.asyncio
+async def test_eventstore_should_report_conflicting_streams(eventsourcing):
+    # arrange
+    async with eventsourcing.open("event_store") as eventstore:
+        await eventstore.append_to_stream(
+            "1",
+            EventStream(
+                [
+                    BankAccountCreated(id="1", owner="John Doe"),
+                    DepositPerformed(amount=20),
+                ]
+            ),
+        )
+        # act
+        with pytest.raises(VersionConflict) as e:
+            await eventstore.append_to_streams(
+                {
+                    "1": EventStream([DepositPerformed(amount=20)]),
+                    "2": EventStream([BankAccountCreated(id="2", owner="Tim")]),
+                }
+            )
+        # assert
+        assert e.value.streams == ["1"]
+        with pytest.raises(StreamDoesNotExist):
+            await eventstore.get_stream("2")
+
+
+@pytest.mark.asyncio
+async def test_append_only_keyspace_should_append_to_many_streams(
+    append_only_eventsourcing
+):
+    # arrange
+    events_base = EventStream([BankAccountCreated(id="1", owner="John Doe")])
+    async with append_only_eventsourcing.open("event_store") as eventstore:
+        await eventstore.append_to_stream("1", events_base)
+        # act
+        await eventstore.append_to_streams(
+            {
+                "1": EventStream([DepositPerformed(amount=20)]),
+                "2": EventStream([BankAccountCreated(id="2", owner="Tim Clock")]),
+            }
+        )
+        stored_events_1 = list(await eventstore.get_stream("1"))
+        stored_events_2 = list(await eventstore.get_stream("2"))
+        with pytest.raises(VersionConflict) as e:
+            await eventstore.append_to_streams(
+                {
+                    "1": EventStream([DepositPerformed(amount=20)]),
+                    "3": EventStream([BankAccountCreated(id="3", owner="Tim")]),
+                }
+            )
+    # assert
+    assert len(stored_events_1) == 2
+    assert stored_events_1[1].version == 1
+    assert stored_events_1[1].amount == 20
+    assert len(stored_events_2) == 1
+    assert stored_events_2[0].owner == "Tim Clock"
+    assert e.value.streams == ["1"]
@@ -5,22 +5,26 @@ from kant.eventstore.stream import EventStream
 import pytest
 
 
-class BankAccountCreated(events.Event):
+class StreamEvent(events.Event):
+    __namespace__ = "stream"
+
+
+class BankAccountCreated(StreamEvent):
     __empty_stream__ = True
 
     id = events.CUIDField(primary_key=True)
     owner = events.CharField()
 
 
-class DepositPerformed(events.Event):
+class DepositPerformed(StreamEvent):
     amount = events.DecimalField()
 
 
-class WithdrawalPerformed(events.Event):
+class WithdrawalPerformed(StreamEvent):
     amount = events.DecimalField()
 
 
-class OwnerChanged(events.Event):
+class OwnerChanged(StreamEvent):
     __dependencies__ = ["BankAccountCreated"]
 
     new_owner = events.CharField()
@@ -82,3 +86,62 @@ async def test_eventstream_should_raise_version_error_when_dependency_not_found(
     with pytest.raises(DependencyDoesNotExist) as e:
         event_stream = EventStream()
         event_stream.add(owner_changed)
+
+
+@pytest.mark.asyncio
+async def test_eventstream_should_extend_events_in_order():
+    # arrange
+    bank_account_created = BankAccountCreated(
+        id="052c21b6-aab9-4311-b954-518cd04f704c", owner="John Doe"
+    )
+    owner_changed = OwnerChanged(new_owner="Jane Doe")
+    deposit_performed = DepositPerformed(amount=20)
+    # act
+    event_stream = EventStream()
+    event_stream.extend([bank_account_created, owner_changed, deposit_performed])
+    event_stream.extend([deposit_performed])
+    # assert
+    assert len(event_stream) == 3
+    assert event_stream.current_version == 2
+    assert list(event_stream) == [
+        bank_account_created,
+        owner_changed,
+        deposit_performed,
+    ]
+    assert [event.version for event in event_stream] == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_eventstream_should_not_extend_when_batch_conflicts():
+    # arrange
+    deposit_performed = DepositPerformed(amount=20)
+    owner_changed = OwnerChanged(new_owner="Jane Doe")
+    # act
+    event_stream = EventStream()
+    with pytest.raises(DependencyDoesNotExist):
+        event_stream.extend([deposit_performed, owner_changed])
+    # assert
+    assert len(event_stream) == 0
+    assert event_stream.current_version == -1
+
+
+@pytest.mark.asyncio
+async def test_eventstream_copy_should_share_events_until_changed():
+    # arrange
+    bank_account_created = BankAccountCreated(
+        id="052c21b6-aab9-4311-b954-518cd04f704c", owner="John Doe"
+    )
+    event_stream = EventStream([bank_account_created])
+    # act
+    copied_stream = event_stream.copy()
+    copied_stream.add(DepositPerformed(amount=20))
+    # assert
+    assert list(event_stream) == [bank_account_created]
+    assert list(copied_stream)[0] is bank_account_created
+    assert len(copied_stream) == 2
+    assert copied_stream.current_version == 1
+    assert event_stream.current_version == 0
+    with pytest.raises(StreamExists):
+        event_stream.add(
+            BankAccountCreated(id="052c21b6-aab9-4311-b954-518cd04f704c")
+        )
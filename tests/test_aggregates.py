@@ -1,21 +1,34 @@
+from decimal import Decimal
+
 from kant import aggregates, events
-from kant.eventstore import EventStream
+from kant.eventstore import EventStream, Snapshot
+from kant.exceptions import AggregateError, VersionConflict
 
 import pytest
 
 
-class BankAccountCreated(events.Event):
+class AggregatesEvent(events.Event):
+    __namespace__ = "aggregates"
+
+
+class BankAccountCreated(AggregatesEvent):
     __empty_stream__ = True
 
     id = events.CUIDField(primary_key=True)
     owner = events.CharField()
 
 
-class DepositPerformed(events.Event):
+class DepositPerformed(AggregatesEvent):
+    amount = events.DecimalField()
+
+
+class WithdrawalPerformed(AggregatesEvent):
     amount = events.DecimalField()
 
 
-class WithdrawalPerformed(events.Event):
+class BonusCredited(AggregatesEvent):
+    __dependencies__ = ["BankAccountCreated"]
+
     amount = events.DecimalField()
 
 
@@ -499,3 +512,417 @@ async def test_aggregate_should_refresh_from_db(dbsession, eventsourcing):
     assert stored_bank_account_2.id == 123
     assert stored_bank_account_2.owner == "John Doe"
     assert stored_bank_account_2.balance == 40
+
+
+@pytest.mark.asyncio
+async def test_manager_should_take_snapshot_when_policy_is_reached(
+    dbsession, eventsourcing
+):
+    # arrange
+    class BankAccount(aggregates.Aggregate):
+        __keyspace__ = "event_store"
+        __snapshot_policy__ = aggregates.EventCountPolicy(3)
+        id = aggregates.IntegerField(primary_key=True)
+        owner = aggregates.CharField()
+        balance = aggregates.IntegerField()
+
+        def apply_bank_account_created(self, event):
+            self.id = event.get("id")
+            self.owner = event.get("owner")
+            self.balance = 0
+
+        def apply_deposit_performed(self, event):
+            self.balance += event.get("amount")
+
+    bank_account = BankAccount()
+    bank_account.dispatch(
+        [
+            BankAccountCreated(id=123, owner="John Doe"),
+            DepositPerformed(amount=20),
+            DepositPerformed(amount=20),
+        ]
+    )
+    await bank_account.save()
+    # act
+    await BankAccount.objects.get(bank_account.id)
+    # assert
+    async with dbsession.cursor() as cursor:
+        stmt = """
+        SELECT version, data FROM event_store_snapshot WHERE id = %(id)s
+        """
+        await cursor.execute(stmt, {"id": "123"})
+        snapshot = await cursor.fetchone()
+        assert snapshot is not None
+        assert snapshot[0] == 2
+        assert snapshot[1] == {"id": 123, "owner": "John Doe", "balance": 40}
+
+
+@pytest.mark.asyncio
+async def test_manager_should_replay_only_events_after_snapshot(
+    dbsession, eventsourcing
+):
+    # arrange
+    class BankAccount(aggregates.Aggregate):
+        __keyspace__ = "event_store"
+        __snapshot_policy__ = aggregates.EventCountPolicy(100)
+        id = aggregates.IntegerField(primary_key=True)
+        owner = aggregates.CharField()
+        balance = aggregates.IntegerField()
+
+        def apply_bank_account_created(self, event):
+            self.id = event.get("id")
+            self.owner = event.get("owner")
+            self.balance = 0
+
+        def apply_deposit_performed(self, event):
+            self.balance += event.get("amount")
+
+    bank_account = BankAccount()
+    bank_account.dispatch(
+        [
+            BankAccountCreated(id=123, owner="John Doe"),
+            DepositPerformed(amount=20),
+            DepositPerformed(amount=20),
+        ]
+    )
+    await bank_account.save()
+    snapshot = Snapshot(version=1, data={"id": 123, "owner": "Jane", "balance": 100})
+    async with eventsourcing.open("event_store") as eventstore:
+        await eventstore.save_snapshot(bank_account.id, snapshot)
+    # act
+    stored_bank_account = await BankAccount.objects.get(bank_account.id)
+    # assert
+    assert stored_bank_account.version == 2
+    assert stored_bank_account.current_version == 2
+    assert stored_bank_account.id == 123
+    assert stored_bank_account.owner == "Jane"
+    assert stored_bank_account.balance == 120
+
+
+@pytest.mark.asyncio
+async def test_manager_should_restore_decimals_from_snapshot_as_replayed(
+    dbsession, eventsourcing
+):
+    # arrange
+    class BankAccount(aggregates.Aggregate):
+        __keyspace__ = "event_store"
+        __snapshot_policy__ = aggregates.EventCountPolicy(3)
+        id = aggregates.IntegerField(primary_key=True)
+        owner = aggregates.CharField()
+        balance = aggregates.DecimalField()
+
+        def apply_bank_account_created(self, event):
+            self.id = event.get("id")
+            self.owner = event.get("owner")
+            self.balance = 0
+
+        def apply_deposit_performed(self, event):
+            self.balance += event.get("amount")
+
+    bank_account = BankAccount()
+    bank_account.dispatch(
+        [
+            BankAccountCreated(id=123, owner="John Doe"),
+            DepositPerformed(amount=Decimal("0.1")),
+            DepositPerformed(amount=Decimal("0.2")),
+        ]
+    )
+    await bank_account.save()
+    replayed_bank_account = await BankAccount.objects.get(bank_account.id)
+    # act
+    restored_bank_account = await BankAccount.objects.get(bank_account.id)
+    # assert
+    async with eventsourcing.open("event_store") as eventstore:
+        snapshot = await eventstore.get_snapshot(bank_account.id)
+    assert snapshot.version == 2
+    assert restored_bank_account.balance == replayed_bank_account.balance
+
+
+def test_aggregate_snapshot_should_keep_nested_decimals():
+    # arrange
+    class Limits(events.SchemaModel):
+        overdraft = events.DecimalField()
+
+    class BankAccount(aggregates.Aggregate):
+        balance = aggregates.DecimalField()
+        limits = aggregates.SchemaField(to=Limits)
+
+    bank_account = BankAccount()
+    bank_account.balance = Decimal("0.3")
+    bank_account.limits = Limits(overdraft=Decimal("1234567890.123456789"))
+    restored_bank_account = BankAccount()
+    # act
+    snapshot = bank_account.snapshot()
+    restored_bank_account.restore(snapshot)
+    # assert
+    assert snapshot.data == {
+        "balance": "0.3",
+        "limits": {"overdraft": "1234567890.123456789"},
+    }
+    assert restored_bank_account.balance == Decimal("0.3")
+    assert restored_bank_account.limits.overdraft == Decimal("1234567890.123456789")
+
+
+@pytest.mark.asyncio
+async def test_manager_should_replay_dependent_events_after_snapshot(
+    dbsession, eventsourcing
+):
+    # arrange
+    class BankAccount(aggregates.Aggregate):
+        __keyspace__ = "event_store"
+        __snapshot_policy__ = aggregates.EventCountPolicy(100)
+        id = aggregates.IntegerField(primary_key=True)
+        owner = aggregates.CharField()
+        balance = aggregates.IntegerField()
+
+        def apply_bank_account_created(self, event):
+            self.id = event.get("id")
+            self.owner = event.get("owner")
+            self.balance = 0
+
+        def apply_bonus_credited(self, event):
+            self.balance += event.get("amount")
+
+    bank_account = BankAccount()
+    bank_account.dispatch(
+        [
+            BankAccountCreated(id=123, owner="John Doe"),
+            BonusCredited(amount=10),
+            BonusCredited(amount=2),
+        ]
+    )
+    await bank_account.save()
+    snapshot = Snapshot(version=1, data={"id": 123, "owner": "John", "balance": 10})
+    async with eventsourcing.open("event_store") as eventstore:
+        await eventstore.save_snapshot(bank_account.id, snapshot)
+    # act
+    stored_bank_account = await BankAccount.objects.get(bank_account.id)
+    # assert
+    assert stored_bank_account.version == 2
+    assert stored_bank_account.owner == "John"
+    assert stored_bank_account.balance == 12
+
+
+@pytest.mark.asyncio
+async def test_manager_should_save_many_aggregates(dbsession, eventsourcing):
+    # arrange
+    class BankAccount(aggregates.Aggregate):
+        __keyspace__ = "event_store"
+        id = aggregates.IntegerField(primary_key=True)
+        owner = aggregates.CharField()
+        balance = aggregates.IntegerField()
+
+        def apply_bank_account_created(self, event):
+            self.id = event.get("id")
+            self.owner = event.get("owner")
+            self.balance = 0
+
+        def apply_deposit_performed(self, event):
+            self.balance += event.get("amount")
+
+    bank_account_1 = BankAccount()
+    bank_account_1.dispatch(BankAccountCreated(id=123, owner="John Doe"))
+    await bank_account_1.save()
+    bank_account_1.dispatch(DepositPerformed(amount=20))
+    bank_account_2 = BankAccount()
+    bank_account_2.dispatch(
+        [BankAccountCreated(id=456, owner="Tim Clock"), DepositPerformed(amount=10)]
+    )
+    # act
+    await BankAccount.objects.save_many([bank_account_1, bank_account_2])
+    stored_bank_account_1 = await BankAccount.objects.get(123)
+    stored_bank_account_2 = await BankAccount.objects.get(456)
+    # assert
+    assert bank_account_1.version == 1
+    assert len(bank_account_1.get_events()) == 0
+    assert bank_account_2.version == 1
+    assert stored_bank_account_1.version == 1
+    assert stored_bank_account_1.balance == 20
+    assert stored_bank_account_2.version == 1
+    assert stored_bank_account_2.balance == 10
+
+
+@pytest.mark.asyncio
+async def test_manager_should_refresh_cached_aggregates(dbsession, eventsourcing):
+    # arrange
+    class BankAccount(aggregates.Aggregate):
+        __keyspace__ = "event_store"
+        __cache__ = aggregates.AggregateCache(max_entries=10)
+        id = aggregates.IntegerField(primary_key=True)
+        owner = aggregates.CharField()
+        balance = aggregates.IntegerField()
+
+        def apply_bank_account_created(self, event):
+            self.id = event.get("id")
+            self.owner = event.get("owner")
+            self.balance = 0
+
+        def apply_deposit_performed(self, event):
+            self.balance += event.get("amount")
+
+    bank_account = BankAccount()
+    bank_account.dispatch(
+        [BankAccountCreated(id=123, owner="John Doe"), DepositPerformed(amount=20)]
+    )
+    async with eventsourcing.open("event_store") as eventstore:
+        await eventstore.append_to_stream(bank_account.id, bank_account.get_events())
+    # act
+    loaded = await BankAccount.objects.get(123)
+    cached = await BankAccount.objects.get(123)
+    new_events = EventStream(initial_version=1)
+    new_events.add(DepositPerformed(amount=30))
+    async with eventsourcing.open("event_store") as eventstore:
+        await eventstore.append_to_stream(123, new_events)
+    refreshed = await BankAccount.objects.get(123)
+    refreshed.dispatch(DepositPerformed(amount=50))
+    await refreshed.save()
+    saved = await BankAccount.objects.get(123)
+    # assert
+    assert (loaded.version, loaded.balance) == (1, 20)
+    assert (cached.version, cached.balance) == (1, 20)
+    assert (refreshed.version, refreshed.balance) == (3, 100)
+    assert (saved.version, saved.balance) == (3, 100)
+    assert [event.version for event in saved.all_events()] == [0, 1, 2, 3]
+    stats = BankAccount.objects.cache.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 3
+    assert stats["refreshes"] == 1
+    assert stats["entries"] == 1
+
+
+@pytest.mark.asyncio
+async def test_manager_should_cache_decimals_as_replayed(dbsession, eventsourcing):
+    # arrange
+    class BankAccount(aggregates.Aggregate):
+        __keyspace__ = "event_store"
+        __cache__ = aggregates.AggregateCache(max_entries=10)
+        id = aggregates.IntegerField(primary_key=True)
+        owner = aggregates.CharField()
+        balance = aggregates.DecimalField()
+
+        def apply_bank_account_created(self, event):
+            self.id = event.get("id")
+            self.owner = event.get("owner")
+            self.balance = 0
+
+        def apply_deposit_performed(self, event):
+            self.balance += event.get("amount")
+
+    bank_account = BankAccount()
+    bank_account.dispatch(
+        [
+            BankAccountCreated(id=123, owner="John Doe"),
+            DepositPerformed(amount=Decimal("0.1")),
+            DepositPerformed(amount=Decimal("0.2")),
+        ]
+    )
+    async with eventsourcing.open("event_store") as eventstore:
+        await eventstore.append_to_stream(bank_account.id, bank_account.get_events())
+    # act
+    loaded = await BankAccount.objects.get(123)
+    cached = await BankAccount.objects.get(123)
+    # assert
+    stats = BankAccount.objects.cache.stats()
+    assert (stats["misses"], stats["hits"]) == (1, 1)
+    assert cached.balance == loaded.balance
+
+
+@pytest.mark.asyncio
+async def test_session_should_commit_aggregates_in_one_transaction(
+    dbsession, eventsourcing
+):
+    # arrange
+    class BankAccount(aggregates.Aggregate):
+        __keyspace__ = "event_store"
+        id = aggregates.IntegerField(primary_key=True)
+        owner = aggregates.CharField()
+        balance = aggregates.IntegerField()
+
+        def apply_bank_account_created(self, event):
+            self.id = event.get("id")
+            self.owner = event.get("owner")
+            self.balance = 0
+
+        def apply_deposit_performed(self, event):
+            self.balance += event.get("amount")
+
+    bank_account = BankAccount()
+    bank_account.dispatch(BankAccountCreated(id=123, owner="John Doe"))
+    await bank_account.save()
+    # act
+    async with aggregates.session() as session:
+        loaded = await session.get(BankAccount, 123)
+        same = await session.get(BankAccount, 123)
+        loaded.dispatch(DepositPerformed(amount=20))
+        new_account = BankAccount()
+        new_account.dispatch(BankAccountCreated(id=456, owner="Tim Clock"))
+        session.add(new_account)
+        await session.commit()
+    async with aggregates.session() as session:
+        stale = await session.get(BankAccount, 123)
+        stale.dispatch(DepositPerformed(amount=30))
+        concurrent = await BankAccount.objects.get(123)
+        concurrent.dispatch(DepositPerformed(amount=40))
+        await concurrent.save()
+        other_account = BankAccount()
+        other_account.dispatch(BankAccountCreated(id=789, owner="Jane"))
+        session.add(other_account)
+        with pytest.raises(VersionConflict):
+            await session.commit()
+    # assert
+    assert loaded is same
+    assert loaded.version == 1
+    assert len(loaded.get_events()) == 0
+    assert new_account.version == 0
+    assert (await BankAccount.objects.get(123)).balance == 60
+    assert (await BankAccount.objects.get(456)).owner == "Tim Clock"
+    assert len(stale.get_events()) == 1
+    async with eventsourcing.open("event_store") as eventstore:
+        assert await eventstore.get_version(789) == -1
+
+
+@pytest.mark.asyncio
+async def test_aggregate_should_apply_registered_handlers():
+    # arrange
+    class BankAccount(aggregates.Aggregate):
+        owner = aggregates.CharField()
+        balance = aggregates.IntegerField()
+
+        @events.handles(BankAccountCreated)
+        def open(self, event):
+            self.owner = event.owner
+            self.balance = 0
+
+        @events.handles("aggregates.DepositPerformed", "aggregates.WithdrawalPerformed")
+        def move(self, event):
+            if isinstance(event, DepositPerformed):
+                self.balance += event.amount
+            else:
+                self.balance -= event.amount
+
+    bank_account = BankAccount()
+    # act
+    bank_account.dispatch(
+        [
+            BankAccountCreated(id=123, owner="John Doe"),
+            DepositPerformed(amount=20),
+            WithdrawalPerformed(amount=5),
+        ]
+    )
+    # assert
+    assert bank_account.owner == "John Doe"
+    assert bank_account.balance == 15
+
+
+@pytest.mark.asyncio
+async def test_aggregate_should_raise_when_handler_is_not_defined():
+    # arrange
+    class BankAccount(aggregates.Aggregate):
+        balance = aggregates.IntegerField()
+
+    bank_account = BankAccount()
+    # act and assert
+    with pytest.raises(AggregateError) as e:
+        bank_account.dispatch(DepositPerformed(amount=20))
+    assert "DepositPerformed" in str(e.value)
+    assert len(bank_account.get_events()) == 0
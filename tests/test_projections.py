@@ -1,28 +1,39 @@
+import asyncio
+import time
 from operator import attrgetter
+from os import environ
 
 import sqlalchemy as sa
 from async_generator import async_generator, yield_
 from kant import aggregates, events, projections
 from kant.eventstore import EventStream
 from kant.projections import ProjectionError, ProjectionRouter
-from kant.projections.sa import SQLAlchemyProjectionAdapter
+from kant.projections.rebuild import ProjectionRebuild
+from kant.projections.sa import (
+    BufferedSQLAlchemyProjectionAdapter,
+    SQLAlchemyProjectionAdapter,
+)
 from sqlalchemy.schema import CreateTable, DropTable
 
 import pytest
 
 
-class BankAccountCreated(events.Event):
+class ProjectionsEvent(events.Event):
+    __namespace__ = "projections"
+
+
+class BankAccountCreated(ProjectionsEvent):
     __empty_stream__ = True
 
     id = events.CUIDField(primary_key=True)
     owner = events.CharField()
 
 
-class DepositPerformed(events.Event):
+class DepositPerformed(ProjectionsEvent):
     amount = events.DecimalField()
 
 
-class WithdrawalPerformed(events.Event):
+class WithdrawalPerformed(ProjectionsEvent):
     amount = events.DecimalField()
 
 
@@ -181,3 +192,358 @@ async def test_projection_should_raise_exception_when_update_without_primary_key
             await eventstore.append_to_stream(
                 bank_account.id, bank_account.get_events(), bank_account.notify_save
             )
+
+
+def test_projection_should_skip_events_without_handler():
+    # arrange
+    class Statement(projections.Projection):
+        balance = projections.IntegerField()
+
+        def when_deposit_performed(self, event):
+            self.balance = event.amount
+
+    class StrictStatement(Statement):
+        __strict__ = True
+
+    received_events = [DepositPerformed(amount=20), WithdrawalPerformed(amount=5)]
+    statement = Statement()
+    # act
+    statement.fetch_events(received_events)
+    # assert
+    assert statement.balance == 20
+    with pytest.raises(ProjectionError):
+        StrictStatement().fetch_events(received_events)
+
+
+def test_projection_should_not_hide_errors_raised_by_handlers():
+    # arrange
+    class Statement(projections.Projection):
+        def when_deposit_performed(self, event):
+            raise AttributeError("balance")
+
+    # act and assert
+    with pytest.raises(AttributeError):
+        Statement().when(DepositPerformed(amount=20))
+
+
+@pytest.mark.asyncio
+async def test_projection_should_apply_only_new_events(
+    saconnection, append_only_eventsourcing
+):
+    # arrange
+    statement = sa.Table(
+        "versioned_statement",
+        sa.MetaData(),  # NOQA
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("owner", sa.String(255)),
+        sa.Column("balance", sa.Integer),
+        sa.Column("version", sa.Integer),
+    )
+    await saconnection.execute(CreateTable(statement))
+
+    class Statement(projections.Projection):
+        __version_field__ = "version"
+        id = projections.IntegerField(primary_key=True)
+        owner = projections.CharField()
+        balance = projections.IntegerField()
+        version = projections.IntegerField()
+
+        def when_bank_account_created(self, event):
+            self.id = event.id
+            self.owner = event.owner
+            self.balance = 0
+
+        def when_deposit_performed(self, event):
+            self.balance += event.amount
+
+    router = ProjectionRouter()
+    router.add("event_store", statement, Statement)
+    projection_adapter = SQLAlchemyProjectionAdapter(saconnection, router)
+    append_only_eventsourcing.projections.bind(projection_adapter)
+
+    bank_account = BankAccount()
+    bank_account.dispatch(BankAccountCreated(id=321, owner="John Doe"))
+    # act
+    async with append_only_eventsourcing.open("event_store") as eventstore:
+        await eventstore.append_to_stream(
+            bank_account.id, bank_account.get_events(), bank_account.notify_save
+        )
+        for amount in (20, 30):
+            bank_account.dispatch(DepositPerformed(amount=amount))
+            await eventstore.append_to_stream(
+                bank_account.id, bank_account.get_events(), bank_account.notify_save
+            )
+        stored_events = await eventstore.get_stream(bank_account.id)
+    await projection_adapter.handle_update("event_store", 321, stored_events)
+    # assert
+    result = await saconnection.execute(statement.select())
+    rows = await result.fetchall()
+    assert len(rows) == 1
+    assert rows[0].balance == 50
+    assert rows[0].version == 2
+    await saconnection.execute(statement.delete())
+    await projection_adapter.rebuild("event_store", 321, stored_events)
+    result = await saconnection.execute(statement.select())
+    rows = await result.fetchall()
+    assert [(row.id, row.balance, row.version) for row in rows] == [(321, 50, 2)]
+    await saconnection.execute(DropTable(statement))
+
+
+@pytest.mark.asyncio
+async def test_projection_should_not_raise_when_updating_missing_row(
+    saconnection, statement, caplog
+):
+    # arrange
+    class Statement(projections.Projection):
+        id = projections.IntegerField(primary_key=True)
+        owner = projections.CharField()
+        balance = projections.IntegerField()
+
+        def when_bank_account_created(self, event):
+            self.id = event.id
+            self.owner = event.owner
+            self.balance = 0
+
+        def when_deposit_performed(self, event):
+            self.balance += event.amount
+
+    router = ProjectionRouter()
+    router.add("event_store", statement, Statement)
+    projection_adapter = SQLAlchemyProjectionAdapter(saconnection, router)
+    whole_stream = EventStream(
+        [
+            BankAccountCreated(id=1, owner="John", version=0),
+            DepositPerformed(amount=20, version=1),
+        ]
+    )
+    appended = EventStream.trusted(
+        [DepositPerformed(amount=30, version=1)], initial_version=0
+    )
+    # act
+    await projection_adapter.handle_update("event_store", 1, whole_stream)
+    await projection_adapter.handle_update("event_store", 2, appended)
+    # assert
+    result = await saconnection.execute(statement.select())
+    rows = await result.fetchall()
+    assert [(row.id, row.owner, row.balance) for row in rows] == [(1, "John", 20)]
+    assert "must be rebuilt" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_buffered_projection_should_write_latest_rows_in_one_upsert(
+    saconnection, append_only_eventsourcing
+):
+    # arrange
+    statement = sa.Table(
+        "buffered_statement",
+        sa.MetaData(),  # NOQA
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("owner", sa.String(255)),
+        sa.Column("balance", sa.Integer),
+    )
+    await saconnection.execute(CreateTable(statement))
+
+    class Statement(projections.Projection):
+        id = projections.IntegerField(primary_key=True)
+        owner = projections.CharField()
+        balance = projections.IntegerField()
+
+        def when_bank_account_created(self, event):
+            self.id = event.id
+            self.owner = event.owner
+            self.balance = 0
+
+        def when_deposit_performed(self, event):
+            self.balance += event.amount
+
+    router = ProjectionRouter()
+    router.add("event_store", statement, Statement)
+    projection_adapter = BufferedSQLAlchemyProjectionAdapter(
+        saconnection, router, flush_interval=60
+    )
+    append_only_eventsourcing.projections.bind(projection_adapter)
+    # act
+    async with append_only_eventsourcing.open("event_store") as eventstore:
+        for account_id in (1, 2):
+            bank_account = BankAccount()
+            bank_account.dispatch(BankAccountCreated(id=account_id, owner="John"))
+            for amount in (20, 30):
+                bank_account.dispatch(DepositPerformed(amount=amount))
+                await eventstore.append_to_stream(
+                    bank_account.id, bank_account.get_events(), bank_account.notify_save
+                )
+        stored_events = await eventstore.get_stream(1)
+    buffered = len(projection_adapter)
+    result = await saconnection.execute(statement.select())
+    rows_before_flush = await result.fetchall()
+    await projection_adapter.flush()
+    await projection_adapter.rebuild("event_store", 1, stored_events)
+    await projection_adapter.close()
+    # assert
+    assert buffered == 2
+    assert rows_before_flush == []
+    result = await saconnection.execute(statement.select().order_by(statement.c.id))
+    rows = await result.fetchall()
+    assert [(row.id, row.owner, row.balance) for row in rows] == [
+        (1, "John", 50),
+        (2, "John", 50),
+    ]
+    await saconnection.execute(DropTable(statement))
+
+
+rebuilt_statement = sa.Table(
+    "rebuilt_statement",
+    sa.MetaData(),  # NOQA
+    sa.Column("id", sa.Integer, primary_key=True),
+    sa.Column("owner", sa.String(255)),
+    sa.Column("balance", sa.Integer),
+)
+
+
+class RebuiltStatement(projections.Projection):
+    id = projections.IntegerField(primary_key=True)
+    owner = projections.CharField()
+    balance = projections.IntegerField()
+
+    def when_bank_account_created(self, event):
+        self.id = event.id
+        self.owner = event.owner
+        self.balance = 0
+
+    def when_deposit_performed(self, event):
+        self.balance += event.amount
+
+
+def get_rebuild_router():
+    router = ProjectionRouter()
+    router.add("event_store", rebuilt_statement, RebuiltStatement)
+    return router
+
+
+@pytest.mark.asyncio
+async def test_projection_rebuild_should_replace_the_read_model(
+    dbsession, append_only_eventsourcing
+):
+    # arrange
+    async with dbsession.cursor() as cursor:
+        await cursor.execute(str(CreateTable(rebuilt_statement)))
+        await cursor.execute(
+            "INSERT INTO rebuilt_statement (id, owner, balance) VALUES (1, 'Old', 0)"
+        )
+    async with append_only_eventsourcing.open("event_store") as eventstore:
+        for account_id in range(1, 6):
+            bank_account = BankAccount()
+            bank_account.dispatch(BankAccountCreated(id=account_id, owner="John"))
+            bank_account.dispatch(DepositPerformed(amount=account_id * 10))
+            await eventstore.append_to_stream(
+                bank_account.id, bank_account.get_events(), bank_account.notify_save
+            )
+    settings = {
+        "user": environ.get("DATABASE_USER"),
+        "password": environ.get("DATABASE_PASSWORD"),
+        "database": environ.get("DATABASE_DATABASE"),
+        "host": environ.get("DATABASE_HOST", "localhost"),
+        "port": environ.get("DATABASE_PORT", 5432),
+    }
+    rebuild = ProjectionRebuild(
+        "event_store", get_rebuild_router, settings, partitions=3, processes=2
+    )
+    # act
+    projected = await rebuild.run()
+    # assert
+    async with dbsession.cursor() as cursor:
+        await cursor.execute("SELECT id, owner, balance FROM rebuilt_statement")
+        rows = sorted(await cursor.fetchall())
+        await cursor.execute("SELECT to_regclass('rebuilt_statement_rebuild')")
+        (shadow,) = await cursor.fetchone()
+        await cursor.execute("SELECT count(*) FROM kant_rebuilds")
+        (checkpoints,) = await cursor.fetchone()
+        await cursor.execute("DROP TABLE rebuilt_statement, kant_rebuilds")
+    assert projected >= 5
+    assert rows == [(account_id, "John", account_id * 10) for account_id in range(1, 6)]
+    assert shadow is None
+    assert checkpoints == 0
+
+
+class SleepyAdapter:
+
+    def __init__(self, delay, error=None):
+        self.delay = delay
+        self.error = error
+        self.updates = []
+        self.eventstreams = []
+
+    async def handle_create(self, keyspace, stream, eventstream):
+        await self.handle_update(keyspace, stream, eventstream)
+
+    async def handle_update(self, keyspace, stream, eventstream):
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        self.updates.append(stream)
+        self.eventstreams.append(eventstream)
+
+
+@pytest.mark.asyncio
+async def test_projection_manager_should_notify_adapters_concurrently():
+    # arrange
+    manager = projections.ProjectionManager()
+    adapters = [SleepyAdapter(0.1), SleepyAdapter(0.1), SleepyAdapter(0.1)]
+    for adapter in adapters:
+        manager.bind(adapter)
+    started_at = time.monotonic()
+    # act
+    await manager.notify_update("event_store", "1", EventStream())
+    # assert
+    assert time.monotonic() - started_at < 0.25
+    assert [adapter.updates for adapter in adapters] == [["1"], ["1"], ["1"]]
+
+
+@pytest.mark.asyncio
+async def test_projection_manager_should_isolate_best_effort_adapters():
+    # arrange
+    errors = []
+    manager = projections.ProjectionManager(
+        on_error=lambda adapter, error: errors.append((adapter, error))
+    )
+    required = SleepyAdapter(0)
+    failing = SleepyAdapter(0, error=ProjectionError("failed"))
+    slow = SleepyAdapter(1)
+    manager.bind(required)
+    manager.bind(failing, required=False)
+    manager.bind(slow, required=False, timeout=0.05)
+    # act
+    await manager.notify_update("event_store", "1", EventStream())
+    # assert
+    assert required.updates == ["1"]
+    await manager.join()
+    assert {adapter for adapter, error in errors} == {failing, slow}
+    assert slow.updates == []
+
+
+@pytest.mark.asyncio
+async def test_projection_manager_should_detach_streams_of_best_effort_adapters():
+    # arrange
+    manager = projections.ProjectionManager()
+    adapter = SleepyAdapter(0)
+    manager.bind(adapter, required=False)
+    bank_account = BankAccount()
+    bank_account.dispatch(BankAccountCreated(id=1, owner="John Doe"))
+    # act
+    await manager.notify_create("event_store", "1", bank_account.get_events())
+    bank_account.notify_save(0)
+    await manager.join()
+    # assert
+    (eventstream,) = adapter.eventstreams
+    assert eventstream.initial_version == -1
+    assert [event.owner for event in eventstream] == ["John Doe"]
+
+
+@pytest.mark.asyncio
+async def test_projection_manager_should_raise_when_required_adapter_times_out():
+    # arrange
+    manager = projections.ProjectionManager()
+    manager.bind(SleepyAdapter(1), timeout=0.05)
+    # act and assert
+    with pytest.raises(asyncio.TimeoutError):
+        await manager.notify_update("event_store", "1", EventStream())